@@ -1,6 +1,14 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-"""入口：项目根目录运行，加载 src 服务"""
+"""入口：项目根目录运行，加载 src 服务
+
+先只用标准库读配置并进入 LISTEN（或接管 systemd socket），再导入业务模块（requests 等），
+重启期间到达的 webhook 在 backlog 中排队而不是被拒绝。
+"""
+
+import time
+
+_STARTED = time.monotonic()
 
 import os
 import sys
@@ -9,7 +17,24 @@ ROOT = os.path.dirname(os.path.abspath(__file__))
 if ROOT not in sys.path:
     sys.path.insert(0, ROOT)
 
-from src.server import main
+from src.config import load_config
+from src.listen_socket import listen_socket
+
+
+def run():
+    cfg = load_config()
+    try:
+        sock, activated = listen_socket(cfg.github_webhook_port)
+    except OSError as e:
+        if getattr(e, "errno", None) == 98:
+            print(f"bind failed port={cfg.github_webhook_port} address already in use", file=sys.stderr)
+        raise
+    listening_s = time.monotonic() - _STARTED
+
+    from src.server import main
+
+    main(cfg, sock, activated, started_at=_STARTED, listening_s=listening_s)
+
 
 if __name__ == "__main__":
-    main()
+    run()
@@ -0,0 +1 @@
+# 压测与基准脚本（不随服务部署运行）
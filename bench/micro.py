@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""纯 Python 热路径微基准与回归预算
+
+    python -m bench.micro                 # 运行并与 bench/baselines.json 比较，超预算退出码 1
+    python -m bench.micro --update        # 以本机结果重写基线（换机器 / 有意的性能变化后）
+    python -m bench.micro -k card         # 只跑名字包含 card 的用例
+
+基线与机器相关：部署前在同一台构建机上比较。每个用例取多轮中最快一轮的单次耗时。
+"""
+
+from __future__ import annotations
+
+import argparse
+import atexit
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Callable
+
+from src.event_store import EventStore, demote, touch, trim_pr_record_count
+from src.feishu_card import (
+    MAX_TIMELINE_CHARS,
+    _trim_events,
+    build_timeline_card,
+    extract_ai_review_for_card,
+    strip_blockquote_lines,
+)
+from src.github_api import GitHubAPI
+from src.timeline_event_type import TimelineEventType
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+DEFAULT_TOLERANCE = 0.5
+
+SEED = 20240601
+_rng = random.Random(SEED)
+
+
+def _words(n: int) -> str:
+    return " ".join(_rng.choice(("fix", "add", "refactor", "card", "store", "push", "修复", "优化")) for _ in range(n))
+
+
+def make_events(n: int) -> list[dict[str, Any]]:
+    kinds = [
+        TimelineEventType.PR_PUSH,
+        TimelineEventType.PR_COMMENT,
+        TimelineEventType.AI_REVIEW,
+        TimelineEventType.HUMAN_REVIEW,
+        TimelineEventType.REVIEW_REQUESTED,
+    ]
+    out: list[dict[str, Any]] = [
+        {
+            "type": TimelineEventType.PR_OPEN.value,
+            "time": "2024-06-01T08:00:00Z",
+            "author": "dev",
+            "title": _words(8),
+            "pr_number": 42,
+            "file_stat": "\n".join(f" src/mod{i} | 12 +10 -2 (3 files)" for i in range(8)),
+        }
+    ]
+    for i in range(n - 1):
+        k = kinds[i % len(kinds)]
+        ev: dict[str, Any] = {"type": k.value, "time": f"2024-06-01T{8 + i % 12:02d}:{i % 60:02d}:00Z", "author": f"dev{i % 5}"}
+        if k is TimelineEventType.PR_PUSH:
+            ev.update(branch="feature/x", head_sha="abcdef1", commit_count=5, commit_messages=[_words(6) for _ in range(5)])
+        elif k is TimelineEventType.PR_COMMENT:
+            ev.update(comment_id=10_000 + i, body=_words(15))
+        elif k is TimelineEventType.AI_REVIEW:
+            ev.update(comment_id=10_000 + i, final_opinion=_words(60))
+        elif k is TimelineEventType.HUMAN_REVIEW:
+            ev.update(reviewer="lead", state="approved", body=_words(10))
+        else:
+            ev.update(requester="dev", reviewer="lead")
+        out.append(ev)
+    return out
+
+
+def make_record(n_events: int) -> dict[str, Any]:
+    return {
+        "message_id": "om_x",
+        "pr_state": "open",
+        "pr_title": "bench",
+        "pr_number": 42,
+        "pr_url": "https://github.com/o/r/pull/42",
+        "repo": "o/r",
+        "events": make_events(n_events),
+        "last_touched": "2024-06-01T08:00:00Z",
+    }
+
+
+def make_files(n: int) -> list[dict[str, Any]]:
+    return [
+        {
+            "filename": "/".join(f"d{_rng.randrange(6)}" for _ in range(_rng.randrange(1, 6))) + f"/f{i}.py",
+            "additions": _rng.randrange(200),
+            "deletions": _rng.randrange(50),
+        }
+        for i in range(n)
+    ]
+
+
+def make_comment(size: int) -> str:
+    lines = []
+    total = 0
+    i = 0
+    while total < size:
+        line = (f"> quoted {_words(10)}" if i % 3 == 0 else _words(12)) if i % 50 else "## 总结"
+        lines.append(line)
+        total += len(line) + 1
+        i += 1
+    return "\n".join(lines)
+
+
+class _FilesAPI(GitHubAPI):
+    def __init__(self, files):
+        super().__init__()
+        self._files = files
+
+    def get_pr_files(self, repo_name, pr_number):
+        return self._files
+
+
+def _cases() -> dict[str, Callable[[], Callable[[], Any]]]:
+    """name -> setup()；setup 构造夹具并返回被测零参函数。"""
+
+    def card(n):
+        def setup():
+            rec = make_record(n)
+            return lambda: build_timeline_card(rec)
+
+        return setup
+
+    def trim(n):
+        def setup():
+            evs = make_events(n)
+            return lambda: _trim_events(evs, MAX_TIMELINE_CHARS)
+
+        return setup
+
+    def file_stats():
+        api = _FilesAPI(make_files(3000))
+        return lambda: api.format_git_file_stats("o/r", 1)
+
+    def group():
+        api = _FilesAPI(make_files(3000))
+        files = api._files
+        return lambda: api._group(files, 3)
+
+    def store_mutate():
+        d = tempfile.mkdtemp(prefix="feishubot-micro-")
+        atexit.register(shutil.rmtree, d, True)
+        store = EventStore(os.path.join(d, ".pr_event_store"))
+        seed = {f"o/r#{i}": make_record(30) for i in range(20)}
+        store.mutate(lambda data: data.update(seed))
+
+        def run():
+            def fn(data):
+                data["o/r#0"]["last_touched"] = "2024-06-02T00:00:00Z"
+
+            store.mutate(fn)
+
+        return run
+
+    def trim_at_capacity(n):
+        def setup():
+            # 满容量的稳态：每轮新开一个 PR、关闭一个最旧的打开 PR（demote），再淘汰一条
+            data = {f"o/r#{i}": {"pr_state": "open", "last_touched": ""} for i in range(n)}
+            seq = iter(range(n, 1 << 62))
+            to_close = iter(range(1 << 62))
+
+            def run():
+                data[f"o/r#{next(seq)}"] = {"pr_state": "open", "last_touched": ""}
+                k = f"o/r#{next(to_close)}"
+                data[k]["pr_state"] = "closed"
+                demote(data, k)
+                trim_pr_record_count(data, n)
+
+            return run
+
+        return setup
+
+    def touch_at_capacity(n):
+        def setup():
+            # 满容量时的普通事件（评论 / push）：移到末尾 + 检查容量
+            data = {f"o/r#{i}": {"pr_state": "open", "last_touched": ""} for i in range(n)}
+            keys = itertools.cycle(list(data))
+
+            def run():
+                touch(data, next(keys))
+                trim_pr_record_count(data, n)
+
+            return run
+
+        return setup
+
+    def store_mutate_large(n):
+        def setup():
+            d = tempfile.mkdtemp(prefix="feishubot-micro-")
+            atexit.register(shutil.rmtree, d, True)
+            store = EventStore(os.path.join(d, ".pr_event_store"), max_records=n)
+            small = make_record(3)
+            store.mutate(lambda data: data.update({f"o/r#{i}": dict(small, pr_number=i) for i in range(n)}))
+
+            def run():
+                def fn(data):
+                    data["o/r#0"]["last_touched"] = "2024-06-02T00:00:00Z"
+                    touch(data, "o/r#0")
+
+                store.mutate(fn)
+
+            return run
+
+        return setup
+
+    def strip_quotes():
+        body = make_comment(1 << 20)
+        return lambda: strip_blockquote_lines(body)
+
+    def extract_ai():
+        body = make_comment(1 << 20)
+        return lambda: extract_ai_review_for_card(body)
+
+    return {
+        "card_build_10": card(10),
+        "card_build_100": card(100),
+        "card_build_1000": card(1000),
+        "trim_events_1000": trim(1000),
+        "format_git_file_stats_3000": file_stats,
+        "group_3000": group,
+        "store_mutate_20x30": store_mutate,
+        "touch_records_10k": touch_at_capacity(10_000),
+        "close_evict_10k": trim_at_capacity(10_000),
+        "store_mutate_10k": store_mutate_large(10_000),
+        "strip_blockquote_1mb": strip_quotes,
+        "extract_ai_review_1mb": extract_ai,
+    }
+
+
+def measure(fn: Callable[[], Any], min_time: float = 0.2, repeat: int = 5) -> float:
+    """返回单次调用耗时（秒）：先估算每轮次数使一轮约 min_time/repeat，再取各轮最快。"""
+    t0 = time.perf_counter()
+    fn()
+    one = max(time.perf_counter() - t0, 1e-7)
+    loops = max(1, int(min_time / repeat / one))
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        best = min(best, (time.perf_counter() - t0) / loops)
+    return best
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-k", dest="pattern", default="", help="只运行名字包含该子串的用例")
+    ap.add_argument("--update", action="store_true", help="写入 bench/baselines.json")
+    ap.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="允许超出基线的比例，默认 0.5")
+    ap.add_argument("--min-time", type=float, default=0.2, help="每个用例的大致测量时长（秒）")
+    args = ap.parse_args()
+
+    baselines: dict[str, float] = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, "r", encoding="utf-8") as f:
+            baselines = json.load(f)
+
+    results: dict[str, float] = {}
+    failed: list[str] = []
+    for name, setup in _cases().items():
+        if args.pattern and args.pattern not in name:
+            continue
+        _rng.seed(SEED)  # 每个用例夹具独立可复现，与 -k 过滤无关
+        t = measure(setup(), args.min_time)
+        results[name] = t
+        base = baselines.get(name)
+        if base:
+            ratio = t / base
+            verdict = "ok" if ratio <= 1 + args.tolerance else "REGRESSION"
+            if verdict != "ok":
+                failed.append(name)
+            print(f"{name:<30} {t * 1e3:10.3f} ms   baseline {base * 1e3:10.3f} ms   x{ratio:5.2f}  {verdict}")
+        else:
+            print(f"{name:<30} {t * 1e3:10.3f} ms   (no baseline)")
+
+    if args.update:
+        baselines.update({k: round(v, 9) for k, v in results.items()})
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(dict(sorted(baselines.items())), f, indent=2)
+            f.write("\n")
+        print(f"baselines written: {BASELINE_PATH}")
+        return 0
+    if failed:
+        print(f"{len(failed)} case(s) over budget: {', '.join(failed)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""端到端压测：启动本地飞书 / GitHub 替身与 app.py，按目标速率回放签名后的 webhook
+
+    python -m bench.replay --prs 50 --rate 20
+    python -m bench.replay --recording deliveries.jsonl --rate 50 --latency-ms 80 --error-rate 0.02
+
+录制文件每行一个 JSON：{"event": "pull_request", "payload": {...}}。
+不给录制文件时按 --prs 生成 opened → push → 评论 → review → merged 的合成时间线。
+输出 p50/p95/p99 延迟、吞吐、状态码分布与飞书重复发卡数。
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import hmac
+import http.client
+import json
+import os
+import queue
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+
+from bench.stubs import FeishuStub, GitHubStub, StubStats, start_stub
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRET = "bench-secret"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _sha(seed: str) -> str:
+    return hashlib.sha1(seed.encode()).hexdigest()
+
+
+def synthetic_deliveries(prs: int, pushes: int, comments: int, repos: int) -> list[tuple[str, dict]]:
+    """每个 PR 一条完整时间线，PR 之间轮转交错（同一 PR 内保持顺序）。"""
+    timelines: list[list[tuple[str, dict]]] = []
+    for i in range(prs):
+        repo = {"full_name": f"bench/repo{i % repos}"}
+        num = 1000 + i
+        url = f"https://github.com/{repo['full_name']}/pull/{num}"
+        user = {"login": f"dev{i % 7}"}
+        head = _sha(f"{i}:0")
+
+        def pr(state="open", merged=False, head_sha=head):
+            return {
+                "number": num,
+                "title": f"Bench PR {num}",
+                "state": state,
+                "merged": merged,
+                "draft": False,
+                "html_url": url,
+                "head": {"ref": f"feature/{num}", "sha": head_sha},
+            }
+
+        tl = [("pull_request", {"action": "opened", "pull_request": pr(), "repository": repo, "sender": user})]
+        for p in range(pushes):
+            before, after = _sha(f"{i}:{p}"), _sha(f"{i}:{p + 1}")
+            tl.append(
+                (
+                    "pull_request",
+                    {
+                        "action": "synchronize",
+                        "before": before,
+                        "after": after,
+                        "pull_request": pr(head_sha=after),
+                        "repository": repo,
+                        "sender": user,
+                    },
+                )
+            )
+        for c in range(comments):
+            tl.append(
+                (
+                    "issue_comment",
+                    {
+                        "action": "created",
+                        "issue": {"number": num, "pull_request": {"url": url}, "html_url": url, "title": f"Bench PR {num}"},
+                        "comment": {"id": num * 1000 + c, "body": f"comment {c}\n> quoted", "user": {"login": "reviewer"}},
+                        "repository": repo,
+                    },
+                )
+            )
+        tl.append(
+            (
+                "pull_request_review",
+                {
+                    "action": "submitted",
+                    "pull_request": pr(),
+                    "review": {"state": "approved", "user": {"login": "reviewer"}, "body": "LGTM"},
+                    "repository": repo,
+                },
+            )
+        )
+        tl.append(("pull_request", {"action": "closed", "pull_request": pr("closed", True), "repository": repo, "sender": user}))
+        timelines.append(tl)
+
+    out: list[tuple[str, dict]] = []
+    depth = max((len(t) for t in timelines), default=0)
+    for step in range(depth):
+        for tl in timelines:
+            if step < len(tl):
+                out.append(tl[step])
+    return out
+
+
+def load_recording(path: str) -> list[tuple[str, dict]]:
+    out = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                j = json.loads(line)
+                out.append((j["event"], j["payload"]))
+    return out
+
+
+def _percentile(sorted_vals: list[float], p: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    k = min(len(sorted_vals) - 1, max(0, int(round(p / 100.0 * (len(sorted_vals) - 1)))))
+    return sorted_vals[k]
+
+
+def _wait_listening(port: int, proc: subprocess.Popen, timeout: float = 15.0) -> float:
+    t0 = time.monotonic()
+    while time.monotonic() - t0 < timeout:
+        if proc.poll() is not None:
+            raise RuntimeError(f"app.py 提前退出 code={proc.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return time.monotonic() - t0
+        except OSError:
+            time.sleep(0.02)
+    raise RuntimeError("app.py 启动超时")
+
+
+def run(args) -> dict:
+    stats = StubStats()
+    feishu_port, github_port, app_port = _free_port(), _free_port(), _free_port()
+    feishu = start_stub(FeishuStub, feishu_port, args.latency_ms, args.error_rate, stats)
+    github = start_stub(GitHubStub, github_port, args.latency_ms, args.error_rate, stats)
+
+    workdir = tempfile.mkdtemp(prefix="feishubot-bench-")
+    cfg = {
+        "github_webhook_port": app_port,
+        "github_token": "bench",
+        "github_webhook_secret": SECRET,
+        "app_id": "bench",
+        "app_secret": "bench",
+        "chat_id": "oc_bench",
+        "feishu_base_url": f"http://127.0.0.1:{feishu_port}",
+        "github_api_url": f"http://127.0.0.1:{github_port}",
+        "data_dir": workdir,
+    }
+    cfg.update(json.loads(args.config_override or "{}"))
+    cfg_path = os.path.join(workdir, "config.json")
+    with open(cfg_path, "w", encoding="utf-8") as f:
+        json.dump(cfg, f)
+
+    deliveries = (
+        load_recording(args.recording)
+        if args.recording
+        else synthetic_deliveries(args.prs, args.pushes, args.comments, args.repos)
+    )
+    env = dict(os.environ, FEISHU_BOT_CONFIG=cfg_path)
+    log_path = os.path.join(workdir, "app.log")
+    with open(log_path, "wb") as logf:
+        proc = subprocess.Popen([sys.executable, os.path.join(ROOT, "app.py")], cwd=ROOT, env=env, stdout=logf, stderr=subprocess.STDOUT)
+        try:
+            startup = _wait_listening(app_port, proc)
+            results = _fire(app_port, deliveries, args.rate, args.concurrency)
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    feishu.shutdown()
+    github.shutdown()
+
+    lat = sorted(r[1] for r in results)
+    wall = max((r[2] for r in results), default=0.0)
+    codes = Counter(r[0] for r in results)
+    report = {
+        "deliveries": len(results),
+        "time_to_listening_ms": round(startup * 1000, 1),
+        "throughput_rps": round(len(results) / wall, 2) if wall else 0.0,
+        "latency_ms": {
+            "p50": round(_percentile(lat, 50) * 1000, 2),
+            "p95": round(_percentile(lat, 95) * 1000, 2),
+            "p99": round(_percentile(lat, 99) * 1000, 2),
+            "max": round((lat[-1] if lat else 0) * 1000, 2),
+        },
+        "status": dict(codes),
+        "upstream_calls": stats.snapshot()["calls"],
+        "cards": stats.snapshot()["cards"],
+        "duplicate_feishu_sends": stats.duplicate_sends(),
+    }
+    if args.keep:
+        report["workdir"] = workdir
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def _fire(port: int, deliveries: list[tuple[str, dict]], rate: float, concurrency: int) -> list[tuple[int, float, float]]:
+    """开环调度：按 rate 排定发送时刻，延迟从排定时刻算起（含排队，避免 coordinated omission）。"""
+    q: queue.Queue = queue.Queue()
+    results: list[tuple[int, float, float]] = []
+    lock = threading.Lock()
+    t_start = time.monotonic()
+    interval = 1.0 / rate if rate > 0 else 0.0
+
+    def worker():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            due, event, body = item
+            sig = "sha256=" + hmac.new(SECRET.encode(), body, hashlib.sha256).hexdigest()
+            headers = {
+                "Content-Type": "application/json",
+                "X-GitHub-Event": event,
+                "X-GitHub-Delivery": str(uuid.uuid4()),
+                "X-Hub-Signature-256": sig,
+            }
+            for attempt in range(2):
+                try:
+                    conn.request("POST", "/webhook", body=body, headers=headers)
+                    r = conn.getresponse()
+                    r.read()
+                    code = r.status
+                    break
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+                    code = 599
+            done = time.monotonic()
+            with lock:
+                results.append((code, done - due, done - t_start))
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for i, (event, payload) in enumerate(deliveries):
+        due = t_start + i * interval
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        q.put((due, event, json.dumps(payload).encode("utf-8")))
+    for _ in threads:
+        q.put(None)
+    for t in threads:
+        t.join()
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--recording", help="录制的 webhook JSONL；不给则生成合成时间线")
+    ap.add_argument("--prs", type=int, default=30)
+    ap.add_argument("--repos", type=int, default=3)
+    ap.add_argument("--pushes", type=int, default=3, help="每个 PR 的 synchronize 次数")
+    ap.add_argument("--comments", type=int, default=2, help="每个 PR 的评论数")
+    ap.add_argument("--rate", type=float, default=20.0, help="目标速率（请求/秒），0 为尽快发送")
+    ap.add_argument("--concurrency", type=int, default=16, help="并发连接数")
+    ap.add_argument("--latency-ms", type=float, default=50.0, help="替身平均延迟")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="替身返回 5xx 的概率")
+    ap.add_argument("--config-override", help="合并进 config.json 的 JSON 对象")
+    ap.add_argument("--keep", action="store_true", help="保留临时目录（app.log / store）")
+    args = ap.parse_args()
+    random.seed(0)
+    print(json.dumps(run(args), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""压测用本地上游替身：open.feishu.cn（鉴权 / 发送 / 更新卡片）与 api.github.com（files / compare / commits / graphql）
+
+可单独运行：python -m bench.stubs --feishu-port 18081 --github-port 18082
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+_PR_URL_RE = re.compile(r"https?://[^\s\"'\\]+/pull/\d+")
+
+
+class StubStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls: Counter[str] = Counter()
+        # (群, pr_url) -> send 次数；>1 即重复发卡
+        self.sends_by_pr: Counter[tuple[str, str]] = Counter()
+
+    def hit(self, name: str, n: int = 1) -> None:
+        with self.lock:
+            self.calls[name] += n
+
+    def sent(self, chat_id: str, pr_url: str) -> None:
+        with self.lock:
+            self.sends_by_pr[(chat_id, pr_url)] += 1
+
+    def duplicate_sends(self) -> int:
+        with self.lock:
+            return sum(n - 1 for n in self.sends_by_pr.values() if n > 1)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {"calls": dict(self.calls), "cards": len(self.sends_by_pr)}
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency_ms = 0.0
+    error_rate = 0.0
+    stats: StubStats
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self) -> bytes:
+        n = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(n) if n else b""
+
+    def _reply(self, status: int, obj) -> None:
+        b = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(b)))
+        self.end_headers()
+        self.wfile.write(b)
+
+    def _delay_and_maybe_fail(self) -> bool:
+        if self.latency_ms > 0:
+            # 指数分布抖动，均值为 latency_ms
+            time.sleep(random.expovariate(1.0 / self.latency_ms) / 1000.0)
+        return random.random() < self.error_rate
+
+
+class FeishuStub(_StubHandler):
+    _seq = 0
+    _seq_lock = threading.Lock()
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        body = self._body()
+        if path.endswith("/tenant_access_token/internal"):
+            self.stats.hit("feishu_auth")
+            if self._delay_and_maybe_fail():
+                self._reply(500, {"code": 99991400, "msg": "stub error"})
+                return
+            self._reply(200, {"code": 0, "tenant_access_token": "stub-token", "expire": 7200})
+            return
+        if path.endswith("/im/v1/messages"):
+            self.stats.hit("feishu_send")
+            if self._delay_and_maybe_fail():
+                self._reply(500, {"code": 99991400, "msg": "stub error"})
+                return
+            msg = json.loads(body or b"{}")
+            if self._bad_template(msg.get("content") or ""):
+                self._reply(400, {"code": 230099, "msg": "template not found"})
+                return
+            m = _PR_URL_RE.search(msg.get("content") or "")
+            self.stats.sent(msg.get("receive_id") or "?", m.group(0) if m else "?")
+            with self._seq_lock:
+                FeishuStub._seq += 1
+                mid = f"om_stub_{FeishuStub._seq}"
+            self._reply(200, {"code": 0, "data": {"message_id": mid}})
+            return
+        self._reply(404, {"code": 404, "msg": "not found"})
+
+    @staticmethod
+    def _bad_template(content: str) -> bool:
+        """模板 ID 以 bad 开头的模板卡片按飞书的模板错误拒绝（压测回退路径）。"""
+        try:
+            card = json.loads(content or "{}")
+        except ValueError:
+            return False
+        return card.get("type") == "template" and str((card.get("data") or {}).get("template_id", "")).startswith("bad")
+
+    def do_PATCH(self):
+        body = self._body()
+        self.stats.hit("feishu_patch")
+        self.stats.hit("feishu_patch_bytes", len(body))
+        if self._delay_and_maybe_fail():
+            self._reply(500, {"code": 99991400, "msg": "stub error"})
+            return
+        if self._bad_template(json.loads(body or b"{}").get("content") or ""):
+            self._reply(400, {"code": 230099, "msg": "template not found"})
+            return
+        self._reply(200, {"code": 0})
+
+
+class GitHubStub(_StubHandler):
+    files_per_pr = 20
+    commits_per_push = 3
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        parts = path.strip("/").split("/")
+        if self._delay_and_maybe_fail():
+            self.stats.hit("github_error")
+            self._reply(502, {"message": "stub error"})
+            return
+        # /repos/{o}/{r}/pulls/{n}/files
+        if len(parts) == 6 and parts[3] == "pulls" and parts[5] == "files":
+            self.stats.hit("github_files")
+            files = [
+                {"filename": f"src/mod{i % 5}/file{i}.py", "additions": i % 17, "deletions": i % 7}
+                for i in range(self.files_per_pr)
+            ]
+            self._reply(200, files)
+            return
+        # /repos/{o}/{r}/compare/{base}...{head}
+        if len(parts) == 5 and parts[3] == "compare":
+            self.stats.hit("github_compare")
+            head = parts[4].split("...")[-1]
+            commits = [
+                {"sha": _fake_sha(head, i), "commit": {"message": f"stub commit {i} of {head[:7]}\n\nbody"}}
+                for i in range(self.commits_per_push)
+            ]
+            self._reply(200, {"total_commits": len(commits), "commits": commits})
+            return
+        # /repos/{o}/{r}/commits/{sha}
+        if len(parts) == 5 and parts[3] == "commits":
+            self.stats.hit("github_commit")
+            self._reply(200, {"sha": parts[4], "commit": {"message": f"stub commit {parts[4][:7]}"}})
+            return
+        # /repos/{o}/{r}/git/commits/{sha}
+        if len(parts) == 6 and parts[3] == "git" and parts[4] == "commits":
+            self.stats.hit("github_commit")
+            self._reply(200, {"sha": parts[5], "message": f"stub commit {parts[5][:7]}\n\nbody"})
+            return
+        self._reply(404, {"message": "Not Found"})
+
+    def do_POST(self):
+        """/graphql：只认 github_graphql 的两种查询（按变量区分），结构与真实响应一致。"""
+        body = json.loads(self._body() or b"{}")
+        if urlparse(self.path).path.rstrip("/") != "/graphql":
+            self._reply(404, {"message": "Not Found"})
+            return
+        self.stats.hit("github_graphql")
+        if self._delay_and_maybe_fail():
+            self.stats.hit("github_error")
+            self._reply(502, {"message": "stub error"})
+            return
+        v = body.get("variables") or {}
+        if "number" in v:
+            page = {"hasNextPage": False, "endCursor": None}
+            nodes = [
+                {"path": f"src/mod{i % 5}/file{i}.py", "additions": i % 17, "deletions": i % 7}
+                for i in range(self.files_per_pr)
+            ]
+            repo = {"pullRequest": {"files": {"pageInfo": page, "nodes": nodes}}}
+        else:
+            head, base = v.get("head", ""), v.get("base", "")
+            one = {"totalCount": 1}
+            nodes = [
+                {"oid": _fake_sha(head, i), "message": f"stub commit {i} of {head[:7]}\n\nbody", "parents": one}
+                for i in reversed(range(self.commits_per_push))
+            ]
+            nodes[0]["oid"] = head
+            nodes.append({"oid": base, "message": "base", "parents": one})
+            history = {"totalCount": 100 + len(nodes) - 1, "nodes": nodes[: v.get("first") or len(nodes)]}
+            repo = {"base": {"oid": base, "history": {"totalCount": 100}}, "head": {"history": history}}
+        self._reply(200, {"data": {"repository": repo}})
+
+
+def _fake_sha(seed: str, i: int) -> str:
+    return hashlib.sha1(f"{seed}:{i}".encode()).hexdigest()
+
+
+def start_stub(handler: type[_StubHandler], port: int, latency_ms: float, error_rate: float, stats: StubStats):
+    cls = type(handler.__name__, (handler,), {"latency_ms": latency_ms, "error_rate": error_rate, "stats": stats})
+    srv = ThreadingHTTPServer(("127.0.0.1", port), cls)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--feishu-port", type=int, default=18081)
+    ap.add_argument("--github-port", type=int, default=18082)
+    ap.add_argument("--latency-ms", type=float, default=50)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    args = ap.parse_args()
+    stats = StubStats()
+    start_stub(FeishuStub, args.feishu_port, args.latency_ms, args.error_rate, stats)
+    start_stub(GitHubStub, args.github_port, args.latency_ms, args.error_rate, stats)
+    print(f"feishu stub :{args.feishu_port}  github stub :{args.github_port}  (Ctrl-C 退出)")
+    try:
+        while True:
+            time.sleep(5)
+            print(json.dumps(stats.snapshot()), "duplicate_sends=%d" % stats.duplicate_sends())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -30,6 +30,7 @@ script_dir=$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)
 install_dir=$(cd "$script_dir" && mkdir -p "$INSTALL_DIR" && cd "$INSTALL_DIR" && pwd)
 run_user="${SUDO_USER:-root}"
 run_group=$(id -gn "$run_user")
+keep_socket=0
 
 copy_project() {
     log_info "复制工程到 $install_dir ..."
@@ -45,7 +46,13 @@ copy_project() {
         --exclude='.git' \
         --exclude="$(basename "$install_dir")" \
         --exclude='.pr_event_store' \
+        --exclude='.pr_event_store.d' \
+        --exclude='.pr_event_store.migrated' \
         --exclude='.feishu_token' \
+        --exclude='.feishu_token.*' \
+        --exclude='.traces' \
+        --exclude='.commit_title_cache' \
+        --exclude='.pr_archive' \
         "$script_dir/" "$install_dir/"
 }
 
@@ -96,11 +103,27 @@ stop_existing_service() {
         systemctl stop github-feishu-bot 2>/dev/null || true
     fi
     systemctl disable github-feishu-bot 2>/dev/null || true
+    # socket 单元持有监听端口：端口未变时保留，重新部署期间到达的 webhook 在队列中等待新进程；
+    # 否则一并停掉，端口才会释放
+    local socket_file=/etc/systemd/system/github-feishu-bot.socket port=""
+    if command -v jq &> /dev/null && [[ -f "$install_dir/config.json" ]]; then
+        port=$(jq -r '.github_webhook_port' "$install_dir/config.json" 2>/dev/null || echo "")
+    fi
+    if [[ -n "$port" && -f "$socket_file" ]] && grep -qx "ListenStream=$port" "$socket_file" \
+        && systemctl is-active --quiet github-feishu-bot.socket 2>/dev/null; then
+        keep_socket=1
+        log_info "保留 github-feishu-bot.socket（端口 ${port}），部署期间的 webhook 将排队等待"
+    else
+        systemctl stop github-feishu-bot.socket 2>/dev/null || true
+        systemctl disable github-feishu-bot.socket 2>/dev/null || true
+    fi
     systemctl reset-failed github-feishu-bot 2>/dev/null || true
     sleep 1
 }
 
 ensure_port_released() {
+    # 端口由保留的 socket 单元持有时无需释放
+    [[ "$keep_socket" == 1 ]] && return 0
     # 仅当 config.json 可用时才尝试释放端口，避免在没配置时误杀
     if [[ ! -f "$install_dir/config.json" ]]; then
         return 0
@@ -143,11 +166,35 @@ ensure_port_released() {
 
 setup_systemd() {
     log_info "注册 systemd 服务..."
+    # socket 激活：端口由 systemd 监听，服务重启期间到来的 webhook 在队列中等待而不是被拒绝
+    local port="" socket_deps=""
+    if command -v jq &> /dev/null; then
+        port=$(jq -r '.github_webhook_port' "$install_dir/config.json" 2>/dev/null || echo "")
+        [[ "$port" == "null" ]] && port=""
+    fi
+    rm -f /etc/systemd/system/github-feishu-bot.socket
+    if [[ -n "$port" ]]; then
+        cat > /etc/systemd/system/github-feishu-bot.socket << UNIT
+[Unit]
+Description=GitHub PR to Feishu Bot Listen Socket
+
+[Socket]
+ListenStream=$port
+Backlog=128
+
+[Install]
+WantedBy=sockets.target
+UNIT
+        socket_deps=$'Requires=github-feishu-bot.socket\nAfter=github-feishu-bot.socket'
+    else
+        log_warn "未安装 jq，跳过 socket 激活，由服务自行监听端口"
+    fi
     cat > /etc/systemd/system/github-feishu-bot.service << UNIT
 [Unit]
 Description=GitHub PR to Feishu Bot Service
 After=network.target
 Wants=network.target
+$socket_deps
 
 [Service]
 Type=exec
@@ -156,11 +203,14 @@ Group=$run_group
 WorkingDirectory=$install_dir
 Environment=PATH=$install_dir/venv/bin:/usr/local/bin:/usr/bin
 ExecStart=$install_dir/venv/bin/python app.py
+# systemctl reload：SIGHUP 热加载 config.json（凭据、签名密钥、群路由），不断开监听
+ExecReload=/bin/kill -HUP \$MAINPID
 Restart=always
 RestartSec=10
 
 # 方案A：加固停止/重启时的清理，避免旧进程仍在 LISTEN 导致新实例 bind 失败
-TimeoutStopSec=10
+# SIGTERM 后进程最多排空 shutdown_drain_seconds（默认 8 秒），留出余量再强杀
+TimeoutStopSec=15
 KillSignal=SIGTERM
 FinalKillSignal=SIGKILL
 KillMode=control-group
@@ -176,6 +226,9 @@ UNIT
 
 enable_and_start() {
     log_info "设置自启动并启动服务..."
+    if [[ -f /etc/systemd/system/github-feishu-bot.socket ]]; then
+        systemctl enable --now github-feishu-bot.socket
+    fi
     systemctl enable github-feishu-bot
     systemctl start github-feishu-bot
     sleep 2
@@ -200,6 +253,7 @@ show_info() {
     echo "  sudo systemctl start github-feishu-bot"
     echo "  sudo systemctl stop github-feishu-bot"
     echo "  sudo systemctl restart github-feishu-bot"
+    echo "  sudo systemctl reload github-feishu-bot   # 热加载 config.json"
     echo "  sudo journalctl -u github-feishu-bot -f"
 }
 
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""群路由：按 repo glob / PR label 把卡片发到一个或多个飞书群
+
+config.json 的 chat_routes 形如::
+
+    [{"repos": ["org/backend-*"], "chat_ids": ["oc_backend"]},
+     {"labels": ["security"], "chat_ids": ["oc_sec", "oc_backend"]}]
+
+一条路由的 repos 与 labels 都给出时须同时满足，省略的一项视为不限；命中的所有路由的群取并集（按配置顺序）。
+一条都没命中时发往 chat_id（为空则不发）。repo 与 label 均不区分大小写。
+
+属于其它飞书应用（租户）的群在路由上写 "app_id"，其 app_secret 配在 feishu_apps 中；未写的用默认 app_id。
+digest_repos 中的仓库（同样是 glob）不发逐 PR 的时间线卡片，改为按 digest_interval_seconds 周期发摘要卡片。
+"""
+
+from __future__ import annotations
+
+import fnmatch
+import re
+import threading
+from typing import Any, Iterable
+
+from src.config import Config
+
+
+class ChatRouter:
+    """路由表在构造时编译：每条路由的 repo glob 合并为一个正则，label 为集合。"""
+
+    def __init__(
+        self,
+        routes: Iterable[Any],
+        default_chat_id: str = "",
+        default_app_id: str = "",
+        apps: dict[str, str] | None = None,
+        digest_repos: Iterable[str] = (),
+    ):
+        self.default = (default_chat_id,) if default_chat_id else ()
+        self.default_app_id = default_app_id
+        # app_id -> app_secret
+        self.apps = dict(apps or {})
+        self._chat_apps: dict[str, str] = {}
+        self._routes: list[tuple[re.Pattern[str] | None, frozenset[str], tuple[str, ...]]] = []
+        for i, r in enumerate(routes):
+            if not isinstance(r, dict):
+                raise ValueError(f"chat_routes[{i}] 应为对象")
+            chats = tuple(c for c in _strings(r.get("chat_ids"), f"chat_routes[{i}].chat_ids") if c)
+            if not chats:
+                raise ValueError(f"chat_routes[{i}] 缺少 chat_ids")
+            app_id = r.get("app_id") or default_app_id
+            if app_id not in self.apps:
+                raise ValueError(f"chat_routes[{i}].app_id {app_id} 未在 feishu_apps 中配置")
+            for c in chats:
+                if self._chat_apps.setdefault(c, app_id) != app_id:
+                    raise ValueError(f"群 {c} 在不同路由中属于不同的 app_id")
+            globs = _strings(r.get("repos"), f"chat_routes[{i}].repos")
+            labels = frozenset(s.lower() for s in _strings(r.get("labels"), f"chat_routes[{i}].labels"))
+            pattern = re.compile("|".join(fnmatch.translate(g.lower()) for g in globs)) if globs else None
+            self._routes.append((pattern, labels, chats))
+        globs = _strings(digest_repos, "digest_repos")
+        self._digest = re.compile("|".join(fnmatch.translate(g.lower()) for g in globs)) if globs else None
+
+    def chats_for(self, repo_name: str, labels: Iterable[str] = ()) -> tuple[str, ...]:
+        repo = repo_name.lower()
+        have = {s.lower() for s in labels}
+        out: dict[str, None] = {}
+        for pattern, want, chats in self._routes:
+            if pattern is not None and not pattern.match(repo):
+                continue
+            if want and want.isdisjoint(have):
+                continue
+            out.update(dict.fromkeys(chats))
+        return tuple(out) or self.default
+
+    def digest(self, repo_name: str) -> bool:
+        """该仓库是否为摘要模式。"""
+        return self._digest is not None and self._digest.match(repo_name.lower()) is not None
+
+    def app_for(self, chat_id: str) -> str:
+        """向该群发卡所用的 app_id。"""
+        return self._chat_apps.get(chat_id, self.default_app_id)
+
+
+def _strings(v: Any, name: str) -> list[str]:
+    if v is None:
+        return []
+    if isinstance(v, str):
+        return [v]
+    if isinstance(v, (list, tuple)) and all(isinstance(s, str) for s in v):
+        return list(v)
+    raise ValueError(f"{name} 应为字符串或字符串数组")
+
+
+def app_secrets(cfg: Config) -> dict[str, str]:
+    """默认应用与 feishu_apps 中各应用的 app_id -> app_secret。"""
+    out = {cfg.app_id: cfg.app_secret}
+    for i, a in enumerate(cfg.feishu_apps):
+        if not (isinstance(a, dict) and a.get("app_id") and isinstance(a.get("app_secret"), str)):
+            raise ValueError(f"feishu_apps[{i}] 需要 app_id 与 app_secret")
+        out[a["app_id"]] = a["app_secret"]
+    return out
+
+
+_cached: tuple[Config, ChatRouter] | None = None
+_cached_guard = threading.Lock()
+
+
+def router(cfg: Config) -> ChatRouter:
+    """按配置对象缓存编译结果；热加载换了 Config 后首次调用重新编译。配置非法时抛 ValueError。"""
+    global _cached
+    with _cached_guard:
+        if _cached is None or _cached[0] is not cfg:
+            _cached = (cfg, ChatRouter(cfg.chat_routes, cfg.chat_id, cfg.app_id, app_secrets(cfg), cfg.digest_repos))
+        return _cached[1]
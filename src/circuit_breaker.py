@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""上游熔断：按「上游:接口类」统计最近调用的失败率与慢调用率，超阈值快速失败，冷却后半开探测恢复"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import deque
+
+from src.metrics import Counter, Gauge, REGISTRY
+
+log = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+_STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str):
+        super().__init__(f"circuit {name} open")
+        self.name = name
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        window: int = 20,
+        min_calls: int = 5,
+        failure_rate: float = 0.5,
+        slow_call_seconds: float = 3.0,
+        slow_rate: float = 0.8,
+        open_seconds: float = 30.0,
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        # 每项 (failed, slow)
+        self._calls: deque[tuple[bool, bool]] = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now: float) -> str:
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN)
+        return self._state
+
+    def _transition(self, new: str) -> None:
+        if new == self._state:
+            return
+        log.warning("circuit %s %s -> %s", self.name, self._state, new)
+        self._state = new
+        self._probing = False
+        if new == OPEN:
+            self._opened_at = time.monotonic()
+        if new == CLOSED:
+            self._calls.clear()
+
+    def allow(self) -> bool:
+        """是否放行本次调用；半开时只放行一个探测请求。被拒绝的调用计入 metrics。"""
+        with self._lock:
+            st = self._current_state(time.monotonic())
+            if st == CLOSED:
+                return True
+            if st == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+        REJECTED.inc(self.name)
+        return False
+
+    def record(self, ok: bool, elapsed: float) -> None:
+        slow = elapsed >= self.slow_call_seconds
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._transition(CLOSED if ok and not slow else OPEN)
+                return
+            if self._state == OPEN:
+                return
+            self._calls.append((not ok, slow))
+            n = len(self._calls)
+            if n < self.min_calls:
+                return
+            failed = sum(1 for f, _ in self._calls if f)
+            slowed = sum(1 for _, s in self._calls if s)
+            if failed / n >= self.failure_rate or slowed / n >= self.slow_rate:
+                self._transition(OPEN)
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_guard = threading.Lock()
+
+# 各接口类的默认参数：GitHub 超时 5s，飞书 10s，慢调用阈值取其约一半
+_DEFAULTS: dict[str, dict[str, float]] = {
+    "github": {"slow_call_seconds": 2.5},
+    "feishu": {"slow_call_seconds": 5.0},
+}
+
+
+def breaker(name: str) -> CircuitBreaker:
+    """name 形如 "feishu:send"、"github:compare"；同名共享一个实例。"""
+    with _breakers_guard:
+        br = _breakers.get(name)
+        if br is None:
+            br = _breakers[name] = CircuitBreaker(name, **_DEFAULTS.get(name.split(":", 1)[0], {}))
+        return br
+
+
+def states() -> dict[tuple[str, ...], float]:
+    with _breakers_guard:
+        items = list(_breakers.items())
+    return {(name,): _STATE_VALUE[br.state] for name, br in items}
+
+
+REJECTED = REGISTRY.register(
+    Counter("feishubot_circuit_rejected_total", "Calls rejected by an open circuit.", ("breaker",))
+)
+REGISTRY.register(
+    Gauge("feishubot_circuit_state", "Circuit state per upstream endpoint (0 closed, 1 half-open, 2 open).", states, ("breaker",))
+)
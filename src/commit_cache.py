@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""提交标题缓存：repo@sha -> message 首行的有界 LRU，可选落盘
+
+SHA 对应的提交内容不可变，缓存永不过期，只按容量淘汰最久未用的项。
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+COMMIT_CACHE_FILENAME = ".commit_title_cache"
+DEFAULT_MAX_ENTRIES = 4096
+# 落盘节流：距上次写盘超过该秒数才在 put 时写出
+SAVE_INTERVAL = 30.0
+
+
+class CommitTitleCache:
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, path: str | None = None):
+        self.max_entries = max(1, max_entries)
+        self.path = path
+        self._items: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        if path:
+            self._load()
+
+    @staticmethod
+    def _key(repo_name: str, sha: str) -> str:
+        return f"{repo_name}@{sha}"
+
+    def get(self, repo_name: str, sha: str) -> str | None:
+        k = self._key(repo_name, sha)
+        with self._lock:
+            title = self._items.get(k)
+            if title is not None:
+                self._items.move_to_end(k)
+            return title
+
+    def put(self, repo_name: str, sha: str, title: str) -> None:
+        """空标题不缓存（可能是临时失败）。"""
+        if not sha or not title:
+            return
+        k = self._key(repo_name, sha)
+        with self._lock:
+            self._items[k] = title
+            self._items.move_to_end(k)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+            self._dirty = True
+            due = self.path and time.monotonic() - self._saved_at >= SAVE_INTERVAL
+        if due:
+            self.save()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._items)
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            log.warning("commit title cache %s unreadable, starting empty: %s", self.path, e)
+            return
+        if isinstance(data, dict):
+            # 文件按 LRU 顺序写出（最近使用在后），超出容量时保留最近的
+            for k, v in list(data.items())[-self.max_entries:]:
+                if isinstance(v, str):
+                    self._items[k] = v
+
+    def save(self) -> None:
+        """有改动时原子写盘（临时文件 + rename）；未配置路径时为空操作。"""
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = dict(self._items)
+            self._dirty = False
+            self._saved_at = time.monotonic()
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log.warning("commit title cache save failed: %s", e)
+            with self._lock:
+                self._dirty = True
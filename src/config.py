@@ -3,11 +3,13 @@
 
 import json
 import os
-from dataclasses import dataclass, fields
+from dataclasses import MISSING, dataclass, fields
 
 _ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 DEFAULT_PATHS = [os.path.join(_ROOT, "config.json")]
+# 指定配置文件路径（压测 / 多实例），优先于 DEFAULT_PATHS
+CONFIG_PATH_ENV = "FEISHU_BOT_CONFIG"
 
 
 @dataclass
@@ -18,10 +20,65 @@ class Config:
     app_secret: str
     chat_id: str
     github_webhook_secret: str = ""
+    # 群路由：[{"repos": [glob], "labels": [...], "chat_ids": [...]}]，见 chat_routing；都未命中时发往 chat_id
+    chat_routes: tuple = ()
+    # 其它飞书应用（租户）的凭据：[{"app_id": ..., "app_secret": ...}]，路由中以 app_id 引用
+    feishu_apps: tuple = ()
+    # 摘要模式的仓库 glob（如 bot 为主的仓库）：事件先缓冲，每个周期每群只发一张汇总卡片
+    digest_repos: tuple = ()
+    digest_interval_seconds: int = 3600
+    # 同一作者连续 push 在该秒数内合并为时间线上的一条事件；0 不合并
+    push_fold_seconds: int = 900
+    # 飞书卡片模板 ID（及版本）：配置后 send / patch 只发模板变量，模板失败时回退完整卡片 JSON
+    card_template_id: str = ""
+    card_template_version: str = ""
+    # 上游地址（压测时指向本地 stub）；运行时数据（.pr_event_store 等）目录，空为项目根目录
+    feishu_base_url: str = "https://open.feishu.cn"
+    github_api_url: str = "https://api.github.com"
+    # GitHub 查询方式：rest 或 graphql（一次查询取文件统计 / 区间提交，失败回退 REST）
+    github_api_mode: str = "rest"
+    data_dir: str = ""
+    # .pr_event_store 最多保留的 PR 记录数（LRU，已关闭的先淘汰）。分桶时是每个桶的上限：
+    # 同一 repo 只落在一个桶里，总量最多 store_shards × max_pr_records 条（磁盘与每次读写的 JSON 随之增大）
+    max_pr_records: int = 1000
+    # store 分桶数（按 repo 哈希，每桶独立文件锁）；0 为单文件。修改后启动时自动迁移
+    store_shards: int = 0
+    # 已结束 / 被淘汰的记录归档到数据目录 .pr_archive，迟到事件可找回原卡片
+    archive_records: bool = True
+    # 提交标题 LRU 缓存容量；persist 为 true 时落盘到数据目录，重启后仍可命中
+    commit_cache_size: int = 4096
+    commit_cache_persist: bool = False
+    # 慢请求追踪：超过阈值（毫秒）的请求写出 span 树；0 关闭
+    trace_slow_ms: int = 0
+    trace_profile: bool = False
+    trace_dir: str = ""
+    trace_keep: int = 50
+    # 日志：级别、是否输出 JSON lines、DEBUG 每秒最多条数（0 不限）
+    log_level: str = "DEBUG"
+    log_json: bool = False
+    log_debug_per_sec: int = 200
+    # SIGTERM 后等待进行中的 webhook 与 outbox 投递完成的最长秒数
+    shutdown_drain_seconds: int = 8
+
+
+# SIGHUP 热加载时不生效、需重启才能修改的字段（端口、数据目录与 store / 缓存 / 日志管道结构）
+RESTART_ONLY_FIELDS = (
+    "github_webhook_port",
+    "data_dir",
+    "max_pr_records",
+    "store_shards",
+    "archive_records",
+    "commit_cache_size",
+    "commit_cache_persist",
+    "log_json",
+    "log_debug_per_sec",
+)
 
 
 def load_config(paths: list[str] | None = None) -> Config:
-    paths = paths or DEFAULT_PATHS
+    if not paths:
+        env_path = os.environ.get(CONFIG_PATH_ENV)
+        paths = [env_path] if env_path else DEFAULT_PATHS
     for p in paths:
         if os.path.exists(p):
             try:
@@ -29,21 +86,32 @@ def load_config(paths: list[str] | None = None) -> Config:
                     raw = json.load(f)
             except (json.JSONDecodeError, OSError) as e:
                 raise RuntimeError(f"读取配置失败 {p}: {e}") from e
+            kwargs = {}
             for field in fields(Config):
-                if field.name == "github_webhook_secret":
-                    continue
                 if field.name not in raw:
-                    raise RuntimeError(f"配置缺少必填项: {field.name}")
-            return Config(
-                github_webhook_port=int(raw["github_webhook_port"]),
-                github_token=raw["github_token"],
-                app_id=raw["app_id"],
-                app_secret=raw["app_secret"],
-                chat_id=raw["chat_id"],
-                github_webhook_secret=str(raw.get("github_webhook_secret", "")),
-            )
+                    if field.default is MISSING:
+                        raise RuntimeError(f"配置缺少必填项: {field.name}")
+                    continue
+                kwargs[field.name] = _coerce(field.name, field.type, raw[field.name])
+            return Config(**kwargs)
     raise FileNotFoundError(f"未找到配置文件，已尝试: {paths}")
 
 
+def _coerce(name: str, typ: object, value: object) -> object:
+    """按字段注解做简单类型转换（int/bool/str），其余原样返回。"""
+    try:
+        if typ in (int, "int"):
+            return int(value)
+        if typ in (bool, "bool"):
+            return value if isinstance(value, bool) else str(value).lower() in ("1", "true", "yes", "on")
+        if typ in (str, "str"):
+            return str(value)
+        if typ in (tuple, "tuple"):
+            return tuple(value) if isinstance(value, list) else value
+    except (TypeError, ValueError) as e:
+        raise RuntimeError(f"配置项类型错误: {name}: {e}") from e
+    return value
+
+
 def project_root() -> str:
     return _ROOT
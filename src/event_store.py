@@ -1,81 +1,232 @@
 # -*- coding: utf-8 -*-
-"""PR 时间线持久化：.pr_event_store JSON，按 repo#pr 维度存储事件与飞书 message_id"""
+"""PR 时间线持久化：.pr_event_store JSON，按 repo#pr 维度存储事件与飞书 message_id
+
+记录在 JSON 对象中的先后顺序即淘汰顺序：头部是已关闭的记录（按关闭先后），其后是其余记录的
+LRU 顺序（最近更新在后）。更新记录时用 touch 移到末尾、关闭时用 demote 移入头部，
+淘汰直接从头部开始，无需每次按 last_touched 排序。
+"""
 
 import fcntl
 import json
+import logging
 import os
+import shutil
+import time
+import zlib
 from typing import Any, Callable
 
+from src.metrics import observe_stage
+from src.record_archive import RecordArchive, archive_for_store
+
+log = logging.getLogger(__name__)
+
 
 EVENT_STORE_FILENAME = ".pr_event_store"
-MAX_PR_RECORDS = 20
+# 分桶布局：<store>.d/shard-NNN.json，layout.json 记录桶数
+SHARD_DIR_SUFFIX = ".d"
+SHARD_META_FILENAME = "layout.json"
+# 默认容量；可由 config.max_pr_records 覆盖。应大于同时活跃的 PR 数，否则淘汰会丢 message_id 导致重复发卡
+MAX_PR_RECORDS = 1000
 
 
 def pr_key(repo_full_name: str, pr_number: str | int) -> str:
     return f"{repo_full_name}#{pr_number}"
 
 
-def trim_pr_record_count(data: dict[str, Any]) -> None:
-    """超过 MAX_PR_RECORDS 时按 last_touched 最旧优先删除。"""
-    if len(data) <= MAX_PR_RECORDS:
+def published(rec: dict[str, Any]) -> bool:
+    """是否已向任一群发过卡片（message_ids 按群记录；message_id 为单群时期的旧字段）。"""
+    return bool(rec.get("message_ids") or rec.get("message_id"))
+
+
+def touch(data: dict[str, Any], key: str) -> None:
+    """把记录移到 LRU 末尾（最近使用）；在 mutate 回调内更新 last_touched 时调用。"""
+    rec = data.pop(key, None)
+    if rec is not None:
+        data[key] = rec
+
+
+def _is_closed(rec: Any) -> bool:
+    return isinstance(rec, dict) and rec.get("pr_state") in ("closed", "merged")
+
+
+def demote(data: dict[str, Any], key: str) -> None:
+    """PR 关闭 / 合并后调用：移到头部已关闭区段的末尾，成为优先淘汰对象。
+
+    需要重排整个对象（O(n)），但只在关闭时发生一次，与本次 mutate 的 JSON 读写同量级。
+    """
+    rec = data.pop(key, None)
+    if rec is None:
         return
-    keys_by_age = sorted(
-        data.keys(),
-        key=lambda k: (data[k].get("last_touched") or "", k),
-    )
-    while len(data) > MAX_PR_RECORDS and keys_by_age:
-        oldest = keys_by_age.pop(0)
-        data.pop(oldest, None)
+    items = list(data.items())
+    i = 0
+    while i < len(items) and _is_closed(items[i][1]):
+        i += 1
+    data.clear()
+    data.update(items[:i])
+    data[key] = rec
+    data.update(items[i:])
+
+
+def lru_order(data: dict[str, Any]) -> dict[str, Any] | None:
+    """按淘汰顺序（已关闭在前，其余按 last_touched）重排；已有序时返回 None。
+
+    用于升级：引入 touch / demote 之前写入的文件是插入顺序，启动时重排一次，之后由 touch / demote 维持。
+    """
+    def rank(item: tuple[str, Any]) -> tuple[bool, str]:
+        rec = item[1]
+        return (not _is_closed(rec), str(rec.get("last_touched") or "") if isinstance(rec, dict) else "")
+
+    items = list(data.items())
+    i = 0
+    while i < len(items) and _is_closed(items[i][1]):
+        i += 1
+    rest = [rank(it) for it in items[i:]]
+    if all(r[0] for r in rest) and all(a <= b for a, b in zip(rest, rest[1:])):
+        return None
+    return dict(sorted(items, key=rank))
+
+
+def _evict_rank(rec: Any) -> int:
+    """淘汰优先级：已关闭 < 打开 < 有待投递 outbox 意图或摘要缓冲（最后才丢）。"""
+    if not isinstance(rec, dict):
+        return 0
+    if rec.get("outbox") or rec.get("digest"):
+        return 2
+    return 0 if _is_closed(rec) else 1
+
+
+def trim_pr_record_count(data: dict[str, Any], max_records: int = MAX_PR_RECORDS) -> dict[str, Any]:
+    """超过 max_records 时从头部淘汰，已关闭 / 已合并的记录先于打开的记录；返回被淘汰的记录。
+
+    未超限时 O(1)；超限时从头部扫描到凑够待淘汰数量为止。已关闭记录由 demote 放在头部，
+    通常第一条即命中；只有全部打开时才会扫描整个对象。
+    """
+    excess = len(data) - max_records
+    if excess <= 0:
+        return {}
+    picked: list[list[str]] = [[], [], []]
+    for k, rec in data.items():
+        picked[_evict_rank(rec)].append(k)
+        if len(picked[0]) >= excess:
+            break
+    victims = (picked[0] + picked[1] + picked[2])[:excess]
+    return {k: data.pop(k) for k in victims}
 
 
 class EventStore:
-    def __init__(self, path: str):
+    """shards > 0 时按 repo 哈希分桶，每个桶一个 JSON 文件、各自加锁与计容量，互不阻塞。
+
+    max_records 是每个桶的上限（分桶时总量最多 shards × max_records）。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_records: int = MAX_PR_RECORDS,
+        archive: RecordArchive | None = None,
+        shards: int = 0,
+    ):
         self.path = path
+        self.shards = max(0, shards)
+        # 每个桶各自保留完整容量：按 repo 分桶，平摊后单个繁忙 repo 只能用 1/shards，会挤掉仍打开的 PR
+        self.max_records = max_records
+        # 设置后，离开热存储（合并收尾、淘汰、删除）且发过卡的记录写入冷归档
+        self.archive = archive
+
+    def archived(self, key: str) -> dict[str, Any] | None:
+        """在 mutate 回调内找回已归档的记录（含各群 message_id），未启用归档或不存在时返回 None。"""
+        return self.archive.get(key) if self.archive is not None else None
+
+    def _path_for(self, key: str | None) -> str:
+        if not self.shards:
+            return self.path
+        if key is None:
+            raise ValueError("sharded event store: mutate needs the record key")
+        return shard_path(self.path, shard_of(key, self.shards))
+
+    def _paths(self) -> list[str]:
+        if not self.shards:
+            return [self.path]
+        return [shard_path(self.path, i) for i in range(self.shards)]
 
-    def _mutate(self, fn: Callable[[dict[str, Any]], Any]) -> Any:
-        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
-        with open(self.path, "a+", encoding="utf-8") as f:
+    def _mutate(self, fn: Callable[[dict[str, Any]], Any], path: str) -> Any:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a+", encoding="utf-8") as f:
+            t0 = time.monotonic()
             fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            t1 = time.monotonic()
+            observe_stage("store_lock_wait", t1 - t0)
             try:
                 f.seek(0)
                 raw = f.read()
                 data: dict[str, Any] = json.loads(raw) if raw.strip() else {}
+                t2 = time.monotonic()
+                before = dict(data) if self.archive is not None else None
                 result = fn(data)
-                trim_pr_record_count(data)
+                evicted = trim_pr_record_count(data, self.max_records)
+                for k in evicted:
+                    log.warning("event store over capacity (%d), evicted %s", self.max_records, k)
+                if before is not None:
+                    removed = {k: before[k] for k in before.keys() - data.keys()}
+                    removed.update(evicted)
+                    self._archive(removed)
+                t3 = time.monotonic()
                 f.seek(0)
                 f.truncate(0)
                 f.write(json.dumps(data, ensure_ascii=False, indent=2))
                 f.flush()
                 os.fsync(f.fileno())
+                observe_stage("store_io", (t2 - t1) + (time.monotonic() - t3))
                 return result
             finally:
                 fcntl.flock(f.fileno(), fcntl.LOCK_UN)
 
+    def _archive(self, removed: dict[str, Any]) -> None:
+        for k, rec in removed.items():
+            if isinstance(rec, dict) and published(rec):
+                self.archive.put(k, rec)
+
     def get(self, repo_full_name: str, pr_number: str | int) -> dict[str, Any] | None:
-        if not os.path.exists(self.path):
+        k = pr_key(repo_full_name, pr_number)
+        path = self._path_for(k)
+        if not os.path.exists(path):
             return None
-        with open(self.path, "r", encoding="utf-8") as f:
+        with open(path, "r", encoding="utf-8") as f:
+            t0 = time.monotonic()
             fcntl.flock(f.fileno(), fcntl.LOCK_SH)
+            t1 = time.monotonic()
+            observe_stage("store_lock_wait", t1 - t0)
             try:
                 raw = f.read()
                 data: dict[str, Any] = json.loads(raw) if raw.strip() else {}
-                return data.get(pr_key(repo_full_name, pr_number))
+                observe_stage("store_io", time.monotonic() - t1)
+                return data.get(k)
             finally:
                 fcntl.flock(f.fileno(), fcntl.LOCK_UN)
 
     def get_readonly(self, repo_full_name: str, pr_number: str | int) -> dict[str, Any] | None:
         """不加锁只读，用于读多写少场景；写路径请用 mutate。"""
-        if not os.path.exists(self.path):
+        k = pr_key(repo_full_name, pr_number)
+        path = self._path_for(k)
+        if not os.path.exists(path):
             return None
         try:
-            with open(self.path, "r", encoding="utf-8") as f:
+            with open(path, "r", encoding="utf-8") as f:
                 data = json.load(f)
         except Exception:
             return None
-        return data.get(pr_key(repo_full_name, pr_number))
+        return data.get(k)
 
-    def mutate(self, fn: Callable[[dict[str, Any]], Any]) -> Any:
-        return self._mutate(fn)
+    def all_records(self) -> dict[str, Any]:
+        """逐个文件加共享锁读取全部记录（outbox 扫描待投递意图用）。"""
+        out: dict[str, Any] = {}
+        for path in self._paths():
+            out.update(_read_locked(path))
+        return out
+
+    def mutate(self, fn: Callable[[dict[str, Any]], Any], key: str | None = None) -> Any:
+        """key 为回调要改动的记录（pr_key）；分桶时必填，只锁该记录所在的桶。"""
+        return self._mutate(fn, self._path_for(key))
 
     def remove_record(self, repo_full_name: str, pr_number: str | int) -> None:
         k = pr_key(repo_full_name, pr_number)
@@ -83,4 +234,102 @@ class EventStore:
         def fn(data: dict[str, Any]):
             data.pop(k, None)
 
-        self._mutate(fn)
+        self.mutate(fn, k)
+
+
+def shard_of(key: str, shards: int) -> int:
+    """同一 repo 的 PR 落在同一个桶（crc32 跨进程稳定，不受 PYTHONHASHSEED 影响）。"""
+    repo = key.rsplit("#", 1)[0]
+    return zlib.crc32(repo.encode("utf-8")) % shards
+
+
+def shard_dir(path: str) -> str:
+    return path + SHARD_DIR_SUFFIX
+
+
+def shard_path(path: str, i: int) -> str:
+    return os.path.join(shard_dir(path), f"shard-{i:03d}.json")
+
+
+def _read_locked(path: str) -> dict[str, Any]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_SH)
+        try:
+            raw = f.read()
+            return json.loads(raw) if raw.strip() else {}
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _write_atomic(path: str, data: dict[str, Any]) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(json.dumps(data, ensure_ascii=False, indent=2))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _current_shards(path: str) -> int | None:
+    """当前落盘布局：分桶数；单文件布局返回 0；尚无数据返回 None。"""
+    meta = os.path.join(shard_dir(path), SHARD_META_FILENAME)
+    if os.path.exists(meta):
+        try:
+            with open(meta, "r", encoding="utf-8") as f:
+                return int(json.load(f)["shards"])
+        except (OSError, ValueError, KeyError):
+            pass
+    if os.path.exists(path) and os.path.getsize(path):
+        return 0
+    return None
+
+
+def migrate_store(path: str, shards: int) -> int:
+    """把现有数据迁移到 shards 个桶（0 为单文件），返回迁移的记录数；布局已一致时不做事。
+
+    须在服务开始处理请求前调用（启动时）。旧单文件改名为 .migrated 保留备份。
+    """
+    current = _current_shards(path)
+    if current is None:
+        current = 0 if not shards else None
+    if current == shards:
+        for p in [shard_path(path, i) for i in range(shards)] if shards else [path]:
+            data = lru_order(_read_locked(p))
+            if data is not None:
+                _write_atomic(p, data)
+                log.warning("event store %s reordered for eviction (%d records)", p, len(data))
+        return 0
+    records: dict[str, Any] = {}
+    if os.path.exists(path):
+        records.update(_read_locked(path))
+    if current:
+        for i in range(current):
+            records.update(_read_locked(shard_path(path, i)))
+    if shards:
+        buckets: list[dict[str, Any]] = [{} for _ in range(shards)]
+        for k, rec in records.items():
+            buckets[shard_of(k, shards)][k] = rec
+        os.makedirs(shard_dir(path), exist_ok=True)
+        for i, data in enumerate(buckets):
+            _write_atomic(shard_path(path, i), lru_order(data) or data)
+        for i in range(shards, current or 0):
+            try:
+                os.remove(shard_path(path, i))
+            except FileNotFoundError:
+                pass
+        _write_atomic(os.path.join(shard_dir(path), SHARD_META_FILENAME), {"shards": shards})
+        if os.path.exists(path):
+            os.replace(path, path + ".migrated")
+    else:
+        _write_atomic(path, lru_order(records) or records)
+        shutil.rmtree(shard_dir(path), ignore_errors=True)
+    if records:
+        log.warning("event store migrated: %s shards -> %d shards, %d records", current or 0, shards, len(records))
+    return len(records)
+
+
+def open_store(path: str, max_records: int = MAX_PR_RECORDS, archive: bool = False, shards: int = 0) -> EventStore:
+    """按配置构造 store；archive 为 True 时挂上与 store 同目录的共享归档。"""
+    return EventStore(path, max_records, archive_for_store(path) if archive else None, shards)
@@ -3,47 +3,128 @@
 
 import json
 import logging
+import threading
 import time
+from typing import Any
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
 
-FEISHU_MSG_URL = "https://open.feishu.cn/open-apis/im/v1/messages"
+from src.circuit_breaker import breaker
+from src.metrics import observe_stage
+
+FEISHU_BASE_URL = "https://open.feishu.cn"
+FEISHU_MSG_PATH = "/open-apis/im/v1/messages"
+FEISHU_MSG_URL = FEISHU_BASE_URL + FEISHU_MSG_PATH
+# 连接池大小：多群 send / patch 并发扇出（upstream_pool）与投递线程共用飞书长连接
+POOL_SIZE = 16
+# 模板卡片的业务错误码（模板不存在、未发布、版本不对、变量不合法），飞书统一以「卡片内容创建失败」返回
+TEMPLATE_ERROR_CODES = frozenset({230099})
 log = logging.getLogger(__name__)
 
 
+class CardTemplateError(Exception):
+    """模板卡片被飞书以业务错误码明确拒绝；超时、5xx 等其它失败不抛出，仍按返回值表示。"""
+
+    def __init__(self, code: Any):
+        super().__init__(f"template card rejected code={code}")
+        self.code = code
+
+
+_session: requests.Session | None = None
+_session_guard = threading.Lock()
+
+
+def session() -> requests.Session:
+    """进程内共享的飞书 HTTP 会话（keep-alive 连接池），避免每次请求重新建连与 TLS 握手。"""
+    global _session
+    with _session_guard:
+        if _session is None:
+            s = requests.Session()
+            s.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE))
+            s.mount("http://", HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE))
+            _session = s
+        return _session
+
+
+def upstream_failed(status_code: int) -> bool:
+    """熔断统计口径：5xx 与 429 视为上游故障，其余 4xx / 业务错误码不算。"""
+    return status_code >= 500 or status_code == 429
+
+
+def _json_body(r) -> dict:
+    try:
+        data = r.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _check_template(card: dict, data: dict) -> None:
+    if card.get("type") == "template" and data.get("code") in TEMPLATE_ERROR_CODES:
+        raise CardTemplateError(data.get("code"))
+
+
+def _dumps(obj: Any) -> str:
+    """紧凑且不把中文转义为 \\uXXXX：卡片内容以中文为主，请求体明显变小。"""
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
 def send_interactive_card(
-    token: str, chat_id: str, card: dict, timeout: int = 10, ctx: str = ""
+    token: str, chat_id: str, card: dict, timeout: int = 10, ctx: str = "", base_url: str = FEISHU_BASE_URL
 ) -> str | None:
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json; charset=utf-8"}
     params = {"receive_id_type": "chat_id"}
-    body = {"receive_id": chat_id, "msg_type": "interactive", "content": json.dumps(card)}
+    body = {"receive_id": chat_id, "msg_type": "interactive", "content": _dumps(card)}
     p = f"{ctx} " if ctx else ""
+    br = breaker("feishu:send")
+    if not br.allow():
+        log.warning("%sFeishu send_card skipped: circuit open", p)
+        return None
     t0 = time.monotonic()
     try:
-        r = requests.post(FEISHU_MSG_URL, headers=headers, params=params, json=body, timeout=timeout)
+        r = session().post(base_url + FEISHU_MSG_PATH, headers=headers, params=params, data=_dumps(body).encode("utf-8"), timeout=timeout)
     except RequestException as e:
-        log.warning("%sFeishu send_card network error %.3fs %s", p, time.monotonic() - t0, e)
+        elapsed = time.monotonic() - t0
+        br.record(False, elapsed)
+        observe_stage("feishu_send", elapsed)
+        log.warning("%sFeishu send_card network error %.3fs %s", p, elapsed, e)
         return None
     elapsed = time.monotonic() - t0
-    data = r.json()
+    br.record(not upstream_failed(r.status_code), elapsed)
+    observe_stage("feishu_send", elapsed)
+    data = _json_body(r)
     log.info("%sFeishu send_card http=%s code=%s %.3fs", p, r.status_code, data.get("code"), elapsed)
+    _check_template(card, data)
     if data.get("code") != 0:
         return None
     return data.get("data", {}).get("message_id")
 
 
-def patch_interactive_card(token: str, message_id: str, card: dict, timeout: int = 10, ctx: str = "") -> bool:
-    url = f"{FEISHU_MSG_URL}/{message_id}"
+def patch_interactive_card(
+    token: str, message_id: str, card: dict, timeout: int = 10, ctx: str = "", base_url: str = FEISHU_BASE_URL
+) -> bool:
+    url = f"{base_url}{FEISHU_MSG_PATH}/{message_id}"
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json; charset=utf-8"}
     p = f"{ctx} " if ctx else ""
+    br = breaker("feishu:patch")
+    if not br.allow():
+        log.warning("%sFeishu patch_card skipped: circuit open", p)
+        return False
     t0 = time.monotonic()
     try:
-        r = requests.patch(url, headers=headers, json={"content": json.dumps(card)}, timeout=timeout)
+        r = session().patch(url, headers=headers, data=_dumps({"content": _dumps(card)}).encode("utf-8"), timeout=timeout)
     except RequestException as e:
-        log.warning("%sFeishu patch_card network error %.3fs %s", p, time.monotonic() - t0, e)
+        elapsed = time.monotonic() - t0
+        br.record(False, elapsed)
+        observe_stage("feishu_patch", elapsed)
+        log.warning("%sFeishu patch_card network error %.3fs %s", p, elapsed, e)
         return False
     elapsed = time.monotonic() - t0
-    data = r.json()
+    br.record(not upstream_failed(r.status_code), elapsed)
+    observe_stage("feishu_patch", elapsed)
+    data = _json_body(r)
     log.info("%sFeishu patch_card http=%s code=%s %.3fs", p, r.status_code, data.get("code"), elapsed)
+    _check_template(card, data)
     return data.get("code") == 0
@@ -4,11 +4,14 @@
 from __future__ import annotations
 
 import re
+from datetime import datetime, timedelta, timezone
 from typing import Any, Callable
 
 from src.timeline_event_type import TimelineEventType
 
 TYPE_TEMPLATE = {"open": "red", "merged": "green", "closed": "grey"}
+# Asia/Shanghai 自 1991 年起无夏令时，固定 UTC+8 即可，免去 zoneinfo 导入与时区库查找
+CN_TZ = timezone(timedelta(hours=8), "CST")
 
 # 与 handlers.pr_state_from_payload 一致，共 3 种
 PR_STATE_HEADER_EN = {"open": "Open", "merged": "Merged", "closed": "Closed"}
@@ -16,6 +19,8 @@ PR_STATE_HEADER_EN = {"open": "Open", "merged": "Merged", "closed": "Closed"}
 MAX_SINGLE_EVENT_CHARS = 2000
 MAX_TIMELINE_CHARS = 22000
 MAX_ISSUE_COMMENT_BODY = 100
+# push 事件卡片上展示的提交说明条数；handlers 据此限制向 GitHub 取的条数
+PUSH_MESSAGES_SHOWN = 8
 
 
 def strip_blockquote_lines(text: str) -> str:
@@ -46,14 +51,11 @@ def fmt_display_time(iso_str: str) -> str:
     if not iso_str:
         return ""
     try:
-        from datetime import datetime, timezone
-        from zoneinfo import ZoneInfo
-
         t = iso_str.replace("Z", "+00:00")
         dt = datetime.fromisoformat(t)
         if dt.tzinfo is None:
             dt = dt.replace(tzinfo=timezone.utc)
-        cn = dt.astimezone(ZoneInfo("Asia/Shanghai"))
+        cn = dt.astimezone(CN_TZ)
         return cn.strftime("%m-%d %H:%M")
     except Exception:
         return iso_str[:19]
@@ -78,15 +80,13 @@ def extract_ai_review_for_card(body: str) -> str:
 _GITHUB_ACTIONS_LOGINS = frozenset({"github-actions[bot]", "github-actions"})
 
 
-def is_claude_ai_comment(_body: str, comment: dict[str, Any] | None = None) -> bool:
+def is_claude_ai_comment(login: str, user_type: str, in_reply_to_id: Any = None) -> bool:
     """识别 AI review：仅 GitHub Actions 机器人发帖；排除楼中楼回复。"""
-    if not comment or comment.get("in_reply_to_id"):
+    if in_reply_to_id:
         return False
-    user = comment.get("user") or {}
-    if user.get("type") != "Bot":
+    if user_type != "Bot":
         return False
-    login = (user.get("login") or "").strip().lower()
-    return login in _GITHUB_ACTIONS_LOGINS
+    return (login or "").strip().lower() in _GITHUB_ACTIONS_LOGINS
 
 
 def _render_pr_open(ev: dict[str, Any]) -> str:
@@ -117,15 +117,19 @@ def _render_pr_push(ev: dict[str, Any]) -> str:
     branch = ev.get("branch", "")
     sha = ev.get("head_sha", "")
     msgs = [str(m).strip() for m in (ev.get("commit_messages") or []) if str(m).strip()]
-    head = f"📦 **{author}** pushed **{n}** commit(s) to `{branch}` · {tm}\n"
+    pushes = int(ev.get("pushes") or 1)
+    times = f"（{pushes} 次 push）" if pushes > 1 else ""
+    head = f"📦 **{author}** pushed **{n}** commit(s){times} to `{branch}` · {tm}\n"
+    # 只存了最新的 PUSH_MESSAGES_SHOWN 条说明（从旧到新），总数以 commit_count 为准
+    total = max(int(n or 0), len(msgs))
 
-    if len(msgs) == 1:
+    if len(msgs) == 1 and total <= 1:
         return head + f"**{truncate_text(msgs[0], 200)}** · `{sha}`"
-    if len(msgs) > 1:
+    if msgs:
         first = truncate_text(msgs[0], 200)
-        lines = "\n".join(f"- {truncate_text(m, 200)}" for m in msgs[1:8])
-        if len(msgs) > 8:
-            lines += f"\n- … 共 {len(msgs)} 条说明"
+        lines = "\n".join(f"- {truncate_text(m, 200)}" for m in msgs[1:PUSH_MESSAGES_SHOWN])
+        if total > min(len(msgs), PUSH_MESSAGES_SHOWN):
+            lines += f"\n- … 共 {total} 条说明"
         extra = f"\n{lines}" if lines else ""
         return head + f"**{first}** · `{sha}`{extra}"
     return head + f"`{sha}`"
@@ -222,9 +226,92 @@ def _trim_events(events: list[dict[str, Any]], budget: int) -> tuple[list[dict[s
     return kept, omitted
 
 
-def build_timeline_card(record: dict[str, Any]) -> dict:
+# 记录中的压缩摘要字段：{"count": 总数, "by_type": {type: 数量}, "comment_ids": [...]}
+COMPACTED_FIELD = "compacted"
+# 摘要中只保留最近折叠的若干 comment_id：GitHub 的重投递在数小时内，更早的评论不会再来
+COMPACTED_COMMENT_IDS_KEPT = 200
+
+_COMPACT_LABELS = {
+    TimelineEventType.PR_PUSH.value: "次 push",
+    TimelineEventType.PR_COMMENT.value: "条评论",
+    TimelineEventType.AI_REVIEW.value: "条 AI 评审",
+    TimelineEventType.HUMAN_REVIEW.value: "条 Review",
+    TimelineEventType.REVIEW_REQUESTED.value: "次请求评审",
+}
+
+
+def compact_timeline(record: dict[str, Any]) -> int:
+    """把再也不会展示的早期事件折叠进摘要计数并从记录中删除，返回折叠条数。
+
+    _trim_events 从最新事件往前按预算取，事件只会追加，所以当前窗口之外的事件以后也不会再展示。
+    被折叠事件的 comment_id 保留在摘要中（最近 COMPACTED_COMMENT_IDS_KEPT 个），评论去重不受影响。
+    """
+    events = record.get("events") or []
+    kept, omitted = _trim_events(events, MAX_TIMELINE_CHARS)
+    if not omitted:
+        return 0
+    dropped = events[: len(events) - len(kept)]
+    summary = record.setdefault(COMPACTED_FIELD, {"count": 0, "by_type": {}, "comment_ids": []})
+    summary["count"] = int(summary.get("count", 0)) + len(dropped)
+    by_type = summary.setdefault("by_type", {})
+    ids = summary.setdefault("comment_ids", [])
+    for ev in dropped:
+        t = ev.get("type", "")
+        by_type[t] = int(by_type.get(t, 0)) + 1
+        if ev.get("comment_id"):
+            ids.append(ev["comment_id"])
+    del ids[:-COMPACTED_COMMENT_IDS_KEPT]
+    record["events"] = kept
+    return len(dropped)
+
+
+def _parse_time(iso_str: str) -> datetime | None:
+    try:
+        dt = datetime.fromisoformat(iso_str.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def fold_push(record: dict[str, Any], ev: dict[str, Any], window: int) -> bool:
+    """把 push 事件合并进时间线末尾同一作者的 push（该组首次 push 起 window 秒内），返回是否已合并。
+
+    合并后提交数累加、说明按时间顺序拼接并只保留最近 PUSH_MESSAGES_SHOWN 条，head_sha 与时间取最新；
+    pushes 记合并的次数，first_time 记该组首次 push 时间。
+    """
+    events = record.get("events") or []
+    if window <= 0 or not events or ev.get("type") != TimelineEventType.PR_PUSH.value:
+        return False
+    last = events[-1]
+    if last.get("type") != TimelineEventType.PR_PUSH.value or last.get("author") != ev.get("author"):
+        return False
+    if last.get("branch") != ev.get("branch"):
+        return False
+    start = _parse_time(last.get("first_time") or last.get("time", ""))
+    now = _parse_time(ev.get("time", ""))
+    if start is None or now is None or (now - start).total_seconds() > window:
+        return False
+    msgs = list(last.get("commit_messages") or []) + list(ev.get("commit_messages") or [])
+    last["first_time"] = last.get("first_time") or last.get("time", "")
+    last["time"] = ev.get("time", "")
+    last["head_sha"] = ev.get("head_sha") or last.get("head_sha", "")
+    last["commit_count"] = int(last.get("commit_count") or 0) + int(ev.get("commit_count") or 0)
+    last["commit_messages"] = msgs[-PUSH_MESSAGES_SHOWN:]
+    last["pushes"] = int(last.get("pushes") or 1) + 1
+    return True
+
+
+def _compacted_summary(by_type: dict[str, int]) -> str:
+    parts = [f"{n} {_COMPACT_LABELS[t]}" for t, n in by_type.items() if t in _COMPACT_LABELS and n]
+    other = sum(n for t, n in by_type.items() if t not in _COMPACT_LABELS)
+    if other:
+        parts.append(f"{other} 条其他事件")
+    return "、".join(parts)
+
+
+def _timeline_view(record: dict[str, Any]) -> tuple[str, str, str, list[str]]:
+    """两种卡片共用的渲染结果：(标题, 标题栏颜色, 省略提示（无则为空）, 各事件的 markdown)。"""
     repo = record.get("repo", "")
-    pr_url = record.get("pr_url", "")
     pr_state = record.get("pr_state", "open")
     events = list(record.get("events") or [])
 
@@ -233,25 +320,33 @@ def build_timeline_card(record: dict[str, Any]) -> dict:
     header_title = truncate_text(f"{repo} · {state_label}", 200)
 
     trimmed, omitted = _trim_events(events, MAX_TIMELINE_CHARS)
+    notice = ""
+    compacted = record.get(COMPACTED_FIELD) or {}
+    if omitted or compacted.get("count"):
+        n = len(events) - len(trimmed) + int(compacted.get("count", 0))
+        by_type = dict(compacted.get("by_type") or {})
+        for ev in events[: len(events) - len(trimmed)]:
+            t = ev.get("type", "")
+            by_type[t] = by_type.get(t, 0) + 1
+        detail = _compacted_summary(by_type)
+        detail = f"（{detail}）" if detail else ""
+        notice = f"⏱ 较早 **{n}** 条事件{detail}已省略展示，完整记录见 GitHub。"
+    texts = [truncate_text(_render_one(ev), MAX_SINGLE_EVENT_CHARS) for ev in trimmed]
+    return header_title, template, notice, texts
+
+
+def build_timeline_card(record: dict[str, Any]) -> dict:
+    pr_url = record.get("pr_url", "")
+    header_title, template, notice, texts = _timeline_view(record)
     elements: list[dict[str, Any]] = []
 
-    if omitted:
-        n = len(events) - len(trimmed)
-        elements.append(
-            {
-                "tag": "div",
-                "text": {
-                    "tag": "lark_md",
-                    "content": f"⏱ 较早 **{n}** 条事件已省略展示，完整记录见 GitHub。",
-                },
-            }
-        )
+    if notice:
+        elements.append({"tag": "div", "text": {"tag": "lark_md", "content": notice}})
         elements.append({"tag": "hr"})
 
-    for i, ev in enumerate(trimmed):
+    for i, text in enumerate(texts):
         if i > 0:
             elements.append({"tag": "hr"})
-        text = truncate_text(_render_one(ev), MAX_SINGLE_EVENT_CHARS)
         elements.append({"tag": "div", "text": {"tag": "lark_md", "content": text}})
 
     elements.append(
@@ -272,3 +367,80 @@ def build_timeline_card(record: dict[str, Any]) -> dict:
         "header": {"template": template, "title": {"content": header_title, "tag": "plain_text"}},
         "elements": elements,
     }
+
+
+# 模板卡片中事件之间的分隔（时间线整体作为一个 markdown 变量）
+TEMPLATE_EVENT_SEPARATOR = "\n\n---\n\n"
+
+
+def build_template_card(record: dict[str, Any], template_id: str, version: str = "") -> dict:
+    """飞书卡片模板消息：卡片结构保存在飞书侧，每次只发模板 ID 与变量。
+
+    模板需声明变量 title、state、state_color、notice、timeline（markdown）与 pr_url。
+    """
+    header_title, template, notice, texts = _timeline_view(record)
+    data: dict[str, Any] = {
+        "template_id": template_id,
+        "template_variable": {
+            "title": header_title,
+            "state": record.get("pr_state", "open"),
+            "state_color": template,
+            "notice": notice,
+            "timeline": TEMPLATE_EVENT_SEPARATOR.join(texts),
+            "pr_url": record.get("pr_url", ""),
+        },
+    }
+    if version:
+        data["template_version_name"] = version
+    return {"type": "template", "data": data}
+
+
+# 摘要卡片：每个 PR 最多展示的事件数与单条事件长度
+DIGEST_EVENTS_SHOWN = 3
+DIGEST_EVENT_CHARS = 400
+
+
+def _fmt_interval(seconds: int) -> str:
+    if seconds % 3600 == 0:
+        return f"{seconds // 3600} 小时"
+    if seconds % 60 == 0:
+        return f"{seconds // 60} 分钟"
+    return f"{seconds} 秒"
+
+
+def build_digest_card(repo: str, items: list[tuple[dict[str, Any], dict[str, Any]]], interval: int) -> dict:
+    """digest 模式的周期摘要卡片：一个仓库多个 PR 的新事件合在一张卡里。
+
+    items 为 [(PR 记录, 摘要缓冲)]；缓冲中 events 为最近的若干条事件，count 为该周期事件总数。
+    事件用与时间线卡片相同的 _TIMELINE_RENDERERS 渲染。
+    """
+    total = sum(int(buf.get("count", 0)) for _, buf in items)
+    elements: list[dict[str, Any]] = [
+        {
+            "tag": "div",
+            "text": {"tag": "lark_md", "content": f"过去 {_fmt_interval(interval)}：**{len(items)}** 个 PR，**{total}** 条事件"},
+        }
+    ]
+    used = 0
+    for i, (rec, buf) in enumerate(items):
+        state = PR_STATE_HEADER_EN.get(rec.get("pr_state", "open"), "Open")
+        title = truncate_text(rec.get("pr_title", ""), 120)
+        lines = [f"**[#{rec.get('pr_number', '')} {title}]({rec.get('pr_url', '')})** · {state}"]
+        events = list(buf.get("events") or [])[-DIGEST_EVENTS_SHOWN:]
+        lines += [truncate_text(_render_one(ev), DIGEST_EVENT_CHARS) for ev in events]
+        more = int(buf.get("count", 0)) - len(events)
+        if more > 0:
+            lines.append(f"… 另有 {more} 条事件")
+        text = "\n".join(lines)
+        if used and used + len(text) > MAX_TIMELINE_CHARS:
+            elements.append({"tag": "hr"})
+            elements.append({"tag": "div", "text": {"tag": "lark_md", "content": f"… 另有 {len(items) - i} 个 PR 未展示"}})
+            break
+        used += len(text)
+        elements.append({"tag": "hr"})
+        elements.append({"tag": "div", "text": {"tag": "lark_md", "content": text}})
+
+    return {
+        "header": {"template": "blue", "title": {"content": truncate_text(f"{repo} · Digest", 200), "tag": "plain_text"}},
+        "elements": elements,
+    }
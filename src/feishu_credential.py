@@ -1,20 +1,74 @@
 # -*- coding: utf-8 -*-
-"""飞书 tenant_access_token 缓存与刷新"""
+"""飞书 tenant_access_token 缓存与刷新：按 app_id 分别缓存（多应用 / 多租户），同一应用的刷新只由一个线程发起"""
 
 import json
 import logging
 import os
+import threading
 import time
 
-import requests
 from requests.exceptions import RequestException
 
+from src.circuit_breaker import breaker
+from src.feishu_api import FEISHU_BASE_URL, session, upstream_failed
+
 log = logging.getLogger(__name__)
 
-AUTH_URL = "https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal"
+AUTH_PATH = "/open-apis/auth/v3/tenant_access_token/internal"
+AUTH_URL = FEISHU_BASE_URL + AUTH_PATH
 FEISHU_TOKEN_FILENAME = ".feishu_token"
 
 
+class _AppToken:
+    __slots__ = ("lock", "cached")
+
+    def __init__(self):
+        # 持有者负责刷新，其余线程等待后直接读取其结果（single-flight）
+        self.lock = threading.Lock()
+        # (token, expire_at) 整体替换，无锁读取也不会读到不一致的一对
+        self.cached: tuple[str | None, int] = (None, 0)
+
+
+_apps: dict[str, _AppToken] = {}
+_apps_guard = threading.Lock()
+
+
+def _app(app_id: str) -> _AppToken:
+    with _apps_guard:
+        e = _apps.get(app_id)
+        if e is None:
+            e = _apps[app_id] = _AppToken()
+        return e
+
+
+def token_file_for(token_file: str, app_id: str) -> str:
+    """每个应用单独落盘，互不覆盖：.feishu_token.<app_id>。"""
+    return f"{token_file}.{app_id}" if app_id else token_file
+
+
+def migrate_legacy_token(token_file: str, app_id: str) -> None:
+    """按应用分文件之前只有默认应用，token 存在 .feishu_token：启动时改名为默认应用的文件，免一次重新获取。"""
+    path = token_file_for(token_file, app_id)
+    if path == token_file or not os.path.exists(token_file):
+        return
+    try:
+        if os.path.exists(path):
+            os.remove(token_file)
+        else:
+            os.replace(token_file, path)
+    except OSError as e:
+        log.warning("legacy feishu token %s not migrated: %s", token_file, e)
+
+
+def forget(app_id: str, token_file: str) -> None:
+    """丢弃该应用的缓存 token（app_secret 变更时调用），下次使用时重新获取。"""
+    _app(app_id).cached = (None, 0)
+    try:
+        os.remove(token_file_for(token_file, app_id))
+    except FileNotFoundError:
+        pass
+
+
 def load_token(token_file: str) -> tuple[str | None, int]:
     if not os.path.exists(token_file):
         return None, 0
@@ -37,22 +91,52 @@ def get_tenant_access_token(
     token_file: str,
     token_buffer: int = 100,
     timeout: int = 10,
+    base_url: str = FEISHU_BASE_URL,
 ) -> str | None:
-    token, expire_at = load_token(token_file)
+    """token_file 为数据目录下的 .feishu_token，实际读写 token_file_for(token_file, app_id)。"""
+    e = _app(app_id)
+    token, expire_at = e.cached
     if token and expire_at > int(time.time()) + token_buffer:
         return token
-    log.debug("Feishu token refresh (network)")
+    with e.lock:
+        # 等锁期间其它线程可能已刷新完成
+        token, expire_at = e.cached
+        if token and expire_at > int(time.time()) + token_buffer:
+            return token
+        path = token_file_for(token_file, app_id)
+        token, expire_at = load_token(path)
+        if token and expire_at > int(time.time()) + token_buffer:
+            e.cached = (token, expire_at)
+            return token
+        token, expire_at = _refresh(app_id, app_secret, token_buffer, timeout, base_url)
+        if token:
+            e.cached = (token, expire_at)
+            save_token(path, token, expire_at)
+        return token
+
+
+def _refresh(app_id: str, app_secret: str, token_buffer: int, timeout: int, base_url: str) -> tuple[str | None, int]:
+    br = breaker("feishu:auth")
+    if not br.allow():
+        log.warning("Feishu token refresh skipped: circuit open app=%s", app_id)
+        return None, 0
+    log.debug("Feishu token refresh (network) app=%s", app_id)
+    t0 = time.monotonic()
     try:
-        r = requests.post(AUTH_URL, json={"app_id": app_id, "app_secret": app_secret}, timeout=timeout)
-        r.raise_for_status()
+        r = session().post(base_url + AUTH_PATH, json={"app_id": app_id, "app_secret": app_secret}, timeout=timeout)
     except RequestException as e:
-        log.error("Feishu token refresh network error: %s", e)
-        return None
-    data = r.json()
+        br.record(False, time.monotonic() - t0)
+        log.error("Feishu token refresh network error app=%s: %s", app_id, e)
+        return None, 0
+    br.record(not upstream_failed(r.status_code), time.monotonic() - t0)
+    try:
+        r.raise_for_status()
+        data = r.json()
+    except (RequestException, ValueError) as e:
+        log.error("Feishu token refresh failed app=%s: %s", app_id, e)
+        return None, 0
     if data.get("code") != 0:
-        log.error("Feishu token refresh failed: %s", data.get("msg", data))
-        return None
-    token = data["tenant_access_token"]
-    save_token(token_file, token, int(time.time()) + data.get("expire", 7200) - token_buffer)
-    log.debug("Feishu token refresh ok")
-    return token
+        log.error("Feishu token refresh failed app=%s: %s", app_id, data.get("msg", data))
+        return None, 0
+    log.debug("Feishu token refresh ok app=%s", app_id)
+    return data["tenant_access_token"], int(time.time()) + data.get("expire", 7200) - token_buffer
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-"""飞书卡片：按 PR 维度加锁，send 或 patch 交互卡片"""
+"""飞书卡片：按 PR 维度加锁，向路由到的各群并发 send 或 patch 交互卡片（由 outbox 投递线程调用）"""
 
 from __future__ import annotations
 
@@ -7,13 +7,18 @@ import logging
 import threading
 import time
 from datetime import datetime, timezone
-from typing import Any
+from functools import partial
+from typing import Any, Callable
 
+from src import upstream_pool
+from src.chat_routing import router
 from src.config import Config
-from src.event_store import EventStore, pr_key
-from src.feishu_api import patch_interactive_card, send_interactive_card
-from src.feishu_card import build_timeline_card
+from src.event_store import EventStore, pr_key, touch
+from src.feishu_api import CardTemplateError, patch_interactive_card, send_interactive_card
+from src.feishu_card import build_digest_card, build_template_card, build_timeline_card
 from src.feishu_credential import get_tenant_access_token
+from src.metrics import observe_stage, register_gauge_callback, stage
+from src.tracing import span
 
 log = logging.getLogger(__name__)
 
@@ -21,6 +26,8 @@ log = logging.getLogger(__name__)
 _pr_sync_locks: dict[str, threading.Lock] = {}
 _pr_sync_locks_guard = threading.Lock()
 
+register_gauge_callback("feishubot_pr_sync_locks", "Per-PR sync locks held in memory.", lambda: len(_pr_sync_locks))
+
 
 def _now_iso() -> str:
     return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
@@ -34,55 +41,196 @@ def _sync_lock_for_pr(repo_name: str, pr_number: int) -> threading.Lock:
         return _pr_sync_locks[k]
 
 
-def _sync_card(
+def card_ids(rec: dict[str, Any], cfg: Config) -> dict[str, str]:
+    """记录已发卡片的 chat_id -> message_id；单群时期的旧记录只有 message_id，归到默认群 chat_id。"""
+    ids = dict(rec.get("message_ids") or {})
+    legacy = rec.get("message_id")
+    if legacy and legacy not in ids.values():
+        ids.setdefault(cfg.chat_id, legacy)
+    return ids
+
+
+# 模板卡片被飞书拒绝（模板不存在、变量不匹配等）后，在此秒数内直接用内联卡片
+TEMPLATE_COOLDOWN = 600.0
+_template_off_until = 0.0
+
+
+class _CardVariants:
+    """配置了 card_template_id 时优先发模板卡片（只带变量），失败则回退内联卡片；卡片按需构建一次。"""
+
+    def __init__(self, cfg: Config, rec: dict[str, Any]):
+        self.cfg = cfg
+        self.rec = rec
+        self._template: dict | None = None
+        self._inline: dict | None = None
+        self._lock = threading.Lock()
+
+    def template(self) -> dict | None:
+        if not self.cfg.card_template_id or time.monotonic() < _template_off_until:
+            return None
+        with self._lock, stage("card_build"):
+            if self._template is None:
+                self._template = build_template_card(self.rec, self.cfg.card_template_id, self.cfg.card_template_version)
+            return self._template
+
+    def inline(self) -> dict:
+        with self._lock, stage("card_build"):
+            if self._inline is None:
+                self._inline = build_timeline_card(self.rec)
+            return self._inline
+
+    def deliver(self, fn: Callable[[dict], Any]) -> Any:
+        """fn 为绑定了 token 与目标的 send / patch，参数为卡片内容。
+
+        只有飞书明确拒绝模板（CardTemplateError）时才改发内联卡片；超时、5xx、熔断等失败直接返回，
+        交给 outbox 重试，避免模板其实已送达时再发一张内联卡片。
+        """
+        global _template_off_until
+        card = self.template()
+        if card is None:
+            return fn(self.inline())
+        try:
+            return fn(card)
+        except CardTemplateError as e:
+            # 模板本身有问题，冷却期内不再尝试模板
+            _template_off_until = time.monotonic() + TEMPLATE_COOLDOWN
+            log.warning(
+                "Feishu template card %s rejected (code=%s), using inline cards for %.0fs",
+                self.cfg.card_template_id,
+                e.code,
+                TEMPLATE_COOLDOWN,
+            )
+        return fn(self.inline())
+
+
+def _fan_out(calls: list[tuple[str, Callable[[], Any]]]) -> dict[str, Any]:
+    """并发执行各群的 send / patch（或各应用的 token 获取），返回 key -> 结果；只有一项时直接在当前线程执行。"""
+    if len(calls) == 1:
+        chat, fn = calls[0]
+        return {chat: fn()}
+    futures = [(chat, upstream_pool.submit(fn)) for chat, fn in calls]
+    out: dict[str, Any] = {}
+    for chat, fut in futures:
+        try:
+            out[chat] = fut.result()
+        except Exception:
+            log.exception("Feishu fan-out to %s failed", chat)
+            out[chat] = None
+    return out
+
+
+def _tokens(cfg: Config, token_file: str, apps: set[str]) -> dict[str, str | None]:
+    """每个应用一个 tenant token；路由到多个应用时经 upstream_pool 并发获取，失败的为 None。"""
+    secrets = router(cfg).apps
+    return _fan_out(
+        [(app, partial(get_tenant_access_token, app, secrets.get(app, ""), token_file, base_url=cfg.feishu_base_url)) for app in apps]
+    )
+
+
+def sync_card(
     cfg: Config,
     token_file: str,
     store: EventStore,
     repo_name: str,
     pr_number: int,
+    *,
+    publish: bool,
 ) -> bool:
-    with _sync_lock_for_pr(repo_name, pr_number):
+    """按记录最新状态 patch 各群已发卡片，并向路由新命中的群 send；从未发过卡时仅当 publish 才 send。
+
+    各群按所属飞书应用取 token 后并发请求；任一群失败返回 False（由 outbox 重试，已成功的群不会重复发卡）。
+    """
+    with span("sync_card", pr=f"{repo_name}#{pr_number}"), _sync_lock_for_pr(repo_name, pr_number):
         rec = store.get(repo_name, pr_number)
         if not rec:
             return False
+        ids = card_ids(rec, cfg)
+        if not ids and not publish:
+            return True
+        rt = router(cfg)
+        targets = [c for c in rt.chats_for(repo_name, rec.get("labels") or ()) if c not in ids]
+        if not ids and not targets:
+            log.warning("[%s#%s] no chat routed, card not sent", repo_name, pr_number)
+            return True
+        # 已发卡片须用发送它的应用更新（路由改动后也不变）
+        sent_by = rec.get("card_apps") or {}
+        apps = {chat: sent_by.get(chat) or rt.app_for(chat) for chat in ids}
+        apps.update((chat, rt.app_for(chat)) for chat in targets)
         t0 = time.monotonic()
         ctx = f"[{repo_name}#{pr_number}]"
-        token = get_tenant_access_token(cfg.app_id, cfg.app_secret, token_file)
-        log.info("%s token ok %.3fs", ctx, time.monotonic() - t0)
-        if not token:
-            return False
-        card = build_timeline_card(rec)
-        mid = rec.get("message_id")
-        if mid:
-            return patch_interactive_card(token, mid, card, ctx=ctx)
-        new_id = send_interactive_card(token, cfg.chat_id, card, ctx=ctx)
-        if not new_id:
+        tokens = _tokens(cfg, token_file, set(apps.values()))
+        elapsed = time.monotonic() - t0
+        observe_stage("token", elapsed)
+        log.info("%s token ok %.3fs", ctx, elapsed)
+        if not any(tokens.values()):
             return False
+        cards = _CardVariants(cfg, rec)
+        base = cfg.feishu_base_url
+        calls: list[tuple[str, Callable[[], Any]]] = []
+        for chat in [*ids, *targets]:
+            token = tokens[apps[chat]]
+            if not token:
+                continue  # 该应用取 token 失败：本群记为失败，等待重试
+            if chat in ids:
+                fn = partial(patch_interactive_card, token, ids[chat], ctx=ctx, base_url=base)
+            else:
+                fn = partial(send_interactive_card, token, chat, ctx=ctx, base_url=base)
+            calls.append((chat, partial(cards.deliver, fn)))
+        results = _fan_out(calls)
+        sent = {chat: results[chat] for chat in targets if results.get(chat)}
+        ok = all(results.get(chat) for chat in ids) and len(sent) == len(targets)
+        if not sent and rec.get("message_ids") == ids:
+            return ok
 
         k = pr_key(repo_name, pr_number)
 
         def fn(data: dict[str, Any]):
-            if k in data:
-                data[k]["message_id"] = new_id
-                data[k]["last_touched"] = _now_iso()
-
-        store.mutate(fn)
-        return True
-
-
-def sync_card_if_published(
+            r = data.get(k)
+            if r is None:
+                return
+            merged = card_ids(r, cfg)
+            merged.update(sent)
+            r["message_ids"] = merged
+            r.pop("message_id", None)
+            if sent:
+                r.setdefault("card_apps", {}).update((chat, apps[chat]) for chat in sent)
+            if sent:
+                r["last_touched"] = _now_iso()
+                touch(data, k)
+
+        store.mutate(fn, k)
+        return ok
+
+
+def send_digest(
     cfg: Config,
     token_file: str,
-    store: EventStore,
     repo_name: str,
-    pr_number: int,
-    *,
-    publish_first: bool,
-) -> bool:
-    """未发过飞书（无 message_id）时仅当 publish_first（非 Draft 的 opened，或 ready_for_review）才真正 send/patch。"""
-    rec = store.get(repo_name, pr_number)
-    if not rec:
-        return False
-    if rec.get("message_id") or publish_first:
-        return _sync_card(cfg, token_file, store, repo_name, pr_number)
-    return True
+    items: list[tuple[dict[str, Any], dict[str, Any]]],
+) -> tuple[set[str], bool]:
+    """按群路由分组后各发一张摘要卡片，返回 (发送成功的群, 是否全部成功)。
+
+    缓冲的 sent_chats 记录本轮部分失败前已收到该缓冲的群，重试时不再发给这些群。
+    """
+    rt = router(cfg)
+    by_chat: dict[str, list[tuple[dict[str, Any], dict[str, Any]]]] = {}
+    for rec, buf in items:
+        done = buf.get("sent_chats") or ()
+        for chat in rt.chats_for(repo_name, rec.get("labels") or ()):
+            if chat not in done:
+                by_chat.setdefault(chat, []).append((rec, buf))
+    if not by_chat:
+        return set(), True
+    ctx = f"[{repo_name} digest]"
+    tokens = _tokens(cfg, token_file, {rt.app_for(chat) for chat in by_chat})
+    calls: list[tuple[str, Callable[[], Any]]] = []
+    for chat, chat_items in by_chat.items():
+        token = tokens[rt.app_for(chat)]
+        if not token:
+            continue
+        with stage("card_build"):
+            card = build_digest_card(repo_name, chat_items, cfg.digest_interval_seconds)
+        calls.append((chat, partial(send_interactive_card, token, chat, card, ctx=ctx, base_url=cfg.feishu_base_url)))
+    results = _fan_out(calls) if calls else {}
+    sent = {chat for chat, mid in results.items() if mid}
+    return sent, len(sent) == len(by_chat)
@@ -1,16 +1,29 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-"""GitHub API：PR 文件统计、compare 提交列表"""
+"""GitHub API：PR 文件统计、compare 提交列表（REST；GraphQL 实现见 github_graphql）"""
 
 import logging
 import time
+from typing import Callable
 
 import requests
-from requests.exceptions import ConnectionError, Timeout
+from requests.exceptions import ConnectionError, RequestException, Timeout
+
+from src.circuit_breaker import CircuitOpenError, breaker
+from src.commit_cache import CommitTitleCache
+from src.metrics import observe_stage
 
 log = logging.getLogger(__name__)
 
 
+def subject_line(message: str) -> str:
+    return message.split("\n", 1)[0].strip()[:200]
+
+
+# compare 单页提交上限（GitHub 限制）
+MAX_COMPARE_COMMITS = 250
+
+
 class GitHubAPITimeout(Exception):
     pass
 
@@ -22,38 +35,50 @@ class GitHubAPIError(Exception):
 
 
 class GitHubAPI:
-    def __init__(self, timeout=5, token=None):
+    def __init__(self, timeout=5, token=None, base_url="https://api.github.com", title_cache=None):
         self.timeout = timeout
-        self.base_url = "https://api.github.com"
+        self.titles = title_cache if title_cache is not None else CommitTitleCache()
+        self.base_url = base_url.rstrip("/")
         self.headers = {"Accept": "application/vnd.github+json", "User-Agent": "GitHub-Feishu-Bot/1.0"}
         if token:
             self.headers["Authorization"] = f"Bearer {token}"
         self._token = token
 
-    def _get(self, url):
+    def _get(self, url, endpoint="rest"):
+        """endpoint 为熔断分类（files / compare / commits）；熔断打开时直接抛 CircuitOpenError。"""
+        br = breaker(f"github:{endpoint}")
+        if not br.allow():
+            log.warning("GitHubAPI GET skipped url=%s circuit open", url)
+            raise CircuitOpenError(br.name)
         t0 = time.monotonic()
         try:
             r = requests.get(url, headers=self.headers, timeout=self.timeout)
+            if r.status_code == 401 and self._token:
+                h = self.headers.copy()
+                h["Authorization"] = f"token {self._token}"
+                r = requests.get(url, headers=h, timeout=self.timeout)
         except (Timeout, ConnectionError) as e:
             elapsed = time.monotonic() - t0
+            br.record(False, elapsed)
+            observe_stage("github", elapsed)
             log.warning("GitHubAPI GET failed url=%s %.3fs %s", url, elapsed, type(e).__name__)
             raise GitHubAPITimeout(str(e)) from e
-        if r.status_code == 401 and self._token:
-            h = self.headers.copy()
-            h["Authorization"] = f"token {self._token}"
-            try:
-                r = requests.get(url, headers=h, timeout=self.timeout)
-            except (Timeout, ConnectionError) as e:
-                elapsed = time.monotonic() - t0
-                log.warning("GitHubAPI GET failed url=%s %.3fs %s", url, elapsed, type(e).__name__)
-                raise GitHubAPITimeout(str(e)) from e
+        except RequestException as e:
+            # SSLError / ChunkedEncodingError 等同样要计入熔断，否则半开探测永远不结束
+            elapsed = time.monotonic() - t0
+            br.record(False, elapsed)
+            observe_stage("github", elapsed)
+            log.warning("GitHubAPI GET failed url=%s %.3fs %s", url, elapsed, type(e).__name__)
+            raise
         elapsed = time.monotonic() - t0
+        br.record(r.status_code < 500 and r.status_code != 429, elapsed)
+        observe_stage("github", elapsed)
         log.debug("GitHubAPI GET url=%s status=%s %.3fs", url, r.status_code, elapsed)
         return r
 
     def get_pr_files(self, repo_name, pr_number):
         url = f"{self.base_url}/repos/{repo_name}/pulls/{pr_number}/files"
-        r = self._get(url)
+        r = self._get(url, "files")
         if r.status_code == 200:
             return r.json()
         if r.status_code == 401:
@@ -100,44 +125,84 @@ class GitHubAPI:
         return out
 
     def get_commit_title_line(self, repo_name: str, sha: str) -> str:
-        """GET /commits/{sha}，返回 message 首行（subject）。"""
+        """返回 message 首行（subject）：先查缓存，未命中时 GET /git/commits/{sha}（不含 files / patch）。"""
         if not sha or len(sha) < 7:
             return ""
-        url = f"{self.base_url}/repos/{repo_name}/commits/{sha}"
-        r = self._get(url)
+        cached = self.titles.get(repo_name, sha)
+        if cached is not None:
+            return cached
+        url = f"{self.base_url}/repos/{repo_name}/git/commits/{sha}"
+        r = self._get(url, "commits")
         if r.status_code != 200:
             return ""
-        j = r.json()
-        msg = (j.get("commit") or {}).get("message") or ""
-        return msg.split("\n", 1)[0].strip()[:200]
-
-    def get_commits_between(self, repo_name: str, base_sha: str, head_sha: str) -> tuple[int, str, list[str]]:
-        """compare base...head，返回 (total_commits, head 短 SHA, 每条 commit 的 message 首行)。"""
+        title = subject_line(r.json().get("message") or "")
+        self.titles.put(repo_name, sha, title)
+        return title
+
+    def get_commits_between(
+        self,
+        repo_name: str,
+        base_sha: str,
+        head_sha: str,
+        head_title: Callable[[], str] | None = None,
+        limit: int = MAX_COMPARE_COMMITS,
+    ) -> tuple[int, str, list[str]]:
+        """compare base...head，返回 (total_commits, head 短 SHA, 最新 limit 条 commit 的 message 首行，从旧到新)。
+
+        head_title：取 head 提交标题的回调，compare 失败或无提交时的回退。
+        limit：按 per_page=limit 分页，总数取自 total_commits；提交数超过 limit 时再取末页（不足 limit 条时连同前一页），
+        只展示最新的提交，与 GraphQL 实现一致，远距离 rebase 也不必下载 250 个提交对象。
+        """
         if not head_sha:
             return 0, "", []
 
         short = head_sha[:7]
+        if head_title is None:
+            def head_title():
+                return self.get_commit_title_line(repo_name, head_sha)
+
         if not base_sha or base_sha.startswith("0" * 7):
-            title = self.get_commit_title_line(repo_name, head_sha)
+            title = head_title()
             return 1, short, [title] if title else []
 
-        url = f"{self.base_url}/repos/{repo_name}/compare/{base_sha}...{head_sha}"
-        r = self._get(url)
+        per_page = max(1, min(limit, MAX_COMPARE_COMMITS))
+        url = f"{self.base_url}/repos/{repo_name}/compare/{base_sha}...{head_sha}?per_page={per_page}"
+        r = self._get(f"{url}&page=1", "compare")
         if r.status_code != 200:
-            title = self.get_commit_title_line(repo_name, head_sha)
+            title = head_title()
             return 1, short, [title] if title else []
 
         j = r.json()
         total = int(j.get("total_commits", 0))
-        commits = j.get("commits") or []
+        commits = (j.get("commits") or [])[:per_page]
+        if total > per_page:
+            last = -(-total // per_page)
+            tail = self._compare_page(url, last)
+            if tail is not None:
+                if len(tail) < per_page and last > 2:
+                    prev = self._compare_page(url, last - 1)
+                    tail = (prev or []) + tail
+                elif len(tail) < per_page:
+                    tail = commits + tail
+                commits = tail[-per_page:]
         msgs = []
         for c in commits:
-            msg = (c.get("commit") or {}).get("message") or ""
-            first = msg.split("\n", 1)[0].strip()[:120]
+            first = subject_line((c.get("commit") or {}).get("message") or "")
+            self.titles.put(repo_name, c.get("sha", ""), first)
             if first:
-                msgs.append(first)
+                msgs.append(first[:120])
         if not msgs and head_sha:
-            title = self.get_commit_title_line(repo_name, head_sha)
+            title = head_title()
             if title:
                 msgs = [title]
         return total, short, msgs
+
+    def _compare_page(self, url: str, page: int) -> list[dict] | None:
+        """compare 的某一页提交；失败返回 None（调用方保留已取到的第一页）。"""
+        try:
+            r = self._get(f"{url}&page={page}", "compare")
+        except (GitHubAPITimeout, CircuitOpenError, RequestException):
+            return None
+        if r.status_code != 200:
+            return None
+        return r.json().get("commits") or []
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""GitHub GraphQL 实现：一次查询（游标分页）取 PR 文件增删统计、push 区间的提交标题
+
+接口与 GitHubAPI 相同；GraphQL 不可用（非 200、errors、熔断）或 push 区间非线性时回退 REST。
+"""
+
+import logging
+import time
+from typing import Any, Callable
+
+import requests
+from requests.exceptions import ConnectionError, RequestException, Timeout
+
+from src.circuit_breaker import CircuitOpenError, breaker
+from src.github_api import GitHubAPI, GitHubAPITimeout, subject_line
+from src.metrics import observe_stage
+
+log = logging.getLogger(__name__)
+
+PAGE_SIZE = 100
+# 与 REST pulls/files 上限（3000 个文件）一致
+MAX_FILE_PAGES = 30
+# 与 REST compare 上限（250 个提交）一致
+MAX_RANGE_COMMITS = 250
+
+_FILES_QUERY = """
+query($owner: String!, $name: String!, $number: Int!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      files(first: %d, after: $cursor) {
+        pageInfo { hasNextPage endCursor }
+        nodes { path additions deletions }
+      }
+    }
+  }
+}
+""" % PAGE_SIZE
+
+# base 与 head 的祖先数之差即区间提交数（base 是 head 祖先时与 compare 的 total_commits 相同）。
+# head 历史多取一条：线性区间内第 total 条必须正好是 base，否则（force push、merge 提交）回退 REST
+_RANGE_QUERY = """
+query($owner: String!, $name: String!, $base: GitObjectID!, $head: GitObjectID!, $first: Int!) {
+  repository(owner: $owner, name: $name) {
+    base: object(oid: $base) { ... on Commit { oid history { totalCount } } }
+    head: object(oid: $head) {
+      ... on Commit {
+        history(first: $first) {
+          totalCount
+          nodes { oid message parents { totalCount } }
+        }
+      }
+    }
+  }
+}
+"""
+
+
+class GraphQLUnavailable(Exception):
+    """GraphQL 这次无法给出结果，调用方回退 REST。"""
+
+
+def graphql_url(base_url: str) -> str:
+    """api.github.com → /graphql；GitHub Enterprise 的 /api/v3 → /api/graphql。"""
+    base = base_url.rstrip("/")
+    if base.endswith("/api/v3"):
+        return base[: -len("v3")] + "graphql"
+    return base + "/graphql"
+
+
+class GitHubGraphQLAPI(GitHubAPI):
+    def __init__(self, timeout=5, token=None, base_url="https://api.github.com", title_cache=None):
+        super().__init__(timeout=timeout, token=token, base_url=base_url, title_cache=title_cache)
+        self.graphql_url = graphql_url(self.base_url)
+
+    def _query(self, query: str, variables: dict[str, Any]) -> dict[str, Any]:
+        """POST /graphql，返回 data；超时抛 GitHubAPITimeout，其它失败抛 GraphQLUnavailable。"""
+        br = breaker("github:graphql")
+        if not br.allow():
+            raise GraphQLUnavailable("circuit open")
+        t0 = time.monotonic()
+        try:
+            r = requests.post(self.graphql_url, json={"query": query, "variables": variables}, headers=self.headers, timeout=self.timeout)
+        except (Timeout, ConnectionError) as e:
+            elapsed = time.monotonic() - t0
+            br.record(False, elapsed)
+            observe_stage("github", elapsed)
+            log.warning("GitHub GraphQL failed %.3fs %s", elapsed, type(e).__name__)
+            raise GitHubAPITimeout(str(e)) from e
+        except RequestException as e:
+            # SSLError / TooManyRedirects 等同样计入熔断，否则半开探测永远不结束；交给 REST 回退
+            elapsed = time.monotonic() - t0
+            br.record(False, elapsed)
+            observe_stage("github", elapsed)
+            log.warning("GitHub GraphQL failed %.3fs %s", elapsed, type(e).__name__)
+            raise GraphQLUnavailable(type(e).__name__) from e
+        elapsed = time.monotonic() - t0
+        br.record(r.status_code < 500 and r.status_code != 429, elapsed)
+        observe_stage("github", elapsed)
+        log.debug("GitHub GraphQL status=%s %.3fs", r.status_code, elapsed)
+        if r.status_code != 200:
+            raise GraphQLUnavailable(f"status {r.status_code}")
+        try:
+            j = r.json()
+        except ValueError as e:
+            raise GraphQLUnavailable("response is not JSON") from e
+        if not isinstance(j, dict) or j.get("errors") or not isinstance(j.get("data"), dict):
+            raise GraphQLUnavailable(str(j.get("errors") if isinstance(j, dict) else j)[:200])
+        return j["data"]
+
+    def get_pr_files(self, repo_name, pr_number):
+        owner, _, name = repo_name.partition("/")
+        files: list[dict[str, Any]] = []
+        cursor = None
+        try:
+            for _ in range(MAX_FILE_PAGES):
+                data = self._query(_FILES_QUERY, {"owner": owner, "name": name, "number": int(pr_number), "cursor": cursor})
+                pr = (data.get("repository") or {}).get("pullRequest")
+                if pr is None:
+                    raise GraphQLUnavailable("pull request not found")
+                conn = pr.get("files") or {}
+                for n in conn.get("nodes") or []:
+                    files.append({"filename": n.get("path", ""), "additions": n.get("additions", 0), "deletions": n.get("deletions", 0)})
+                page = conn.get("pageInfo") or {}
+                if not page.get("hasNextPage"):
+                    break
+                cursor = page.get("endCursor")
+        except GraphQLUnavailable as e:
+            log.info("GraphQL files unavailable for %s#%s (%s), falling back to REST", repo_name, pr_number, e)
+            return super().get_pr_files(repo_name, pr_number)
+        return files
+
+    def get_commits_between(
+        self,
+        repo_name: str,
+        base_sha: str,
+        head_sha: str,
+        head_title: Callable[[], str] | None = None,
+        limit: int = MAX_RANGE_COMMITS,
+    ) -> tuple[int, str, list[str]]:
+        """一次查询取区间提交数与最新 limit 条标题；非线性区间或提交数超过 limit 时回退 REST。"""
+        if not head_sha or not base_sha or base_sha.startswith("0" * 7):
+            return super().get_commits_between(repo_name, base_sha, head_sha, head_title, limit)
+        try:
+            total, msgs = self._range_messages(repo_name, base_sha, head_sha, max(1, min(limit, PAGE_SIZE - 1)))
+        except (GraphQLUnavailable, CircuitOpenError) as e:
+            log.info("GraphQL range unavailable for %s %s...%s (%s), falling back to REST", repo_name, base_sha[:7], head_sha[:7], e)
+            return super().get_commits_between(repo_name, base_sha, head_sha, head_title, limit)
+        msgs = [m[:120] for m in msgs if m]
+        return total, head_sha[:7], msgs
+
+    def _range_messages(self, repo_name: str, base_sha: str, head_sha: str, limit: int) -> tuple[int, list[str]]:
+        """返回 (base（不含）到 head 的提交数, 全部提交首行（从旧到新）)；只在区间为线性且不超过 limit 条时成功。"""
+        owner, _, name = repo_name.partition("/")
+        data = self._query(
+            _RANGE_QUERY,
+            {"owner": owner, "name": name, "base": base_sha, "head": head_sha, "first": limit + 1},
+        )
+        repo = data.get("repository") or {}
+        base = (repo.get("base") or {}).get("history")
+        if base is None:
+            raise GraphQLUnavailable("base commit not found")
+        history = (repo.get("head") or {}).get("history")
+        if history is None:
+            raise GraphQLUnavailable("head commit not found")
+        total = int(history.get("totalCount") or 0) - int(base.get("totalCount") or 0)
+        if total <= 0:
+            raise GraphQLUnavailable("base is not an ancestor of head")
+        if total > limit:
+            raise GraphQLUnavailable(f"{total} commits exceed limit {limit}")
+        nodes = history.get("nodes") or []
+        if len(nodes) <= total or nodes[total].get("oid") != base_sha:
+            raise GraphQLUnavailable("base is not an ancestor of head")
+        out: list[str] = []
+        for n in nodes[:total]:
+            if ((n.get("parents") or {}).get("totalCount") or 0) > 1:
+                raise GraphQLUnavailable("merge commit in range")
+            title = subject_line(n.get("message") or "")
+            self.titles.put(repo_name, n.get("oid", ""), title)
+            out.append(title)
+        out.reverse()
+        return total, out
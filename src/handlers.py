@@ -5,55 +5,85 @@ from __future__ import annotations
 
 import hashlib
 import hmac
+import re
 from datetime import datetime, timezone
+from functools import cache
 from typing import Any
 
+from src import outbox
+from src.chat_routing import router
+from src.circuit_breaker import CircuitOpenError
 from src.config import Config
-from src.event_store import EventStore, pr_key
+from src.event_store import EventStore, demote, open_store, pr_key, published, touch
 from src.feishu_card import (
+    COMPACTED_FIELD,
+    PUSH_MESSAGES_SHOWN,
+    compact_timeline,
     extract_ai_review_for_card,
+    fold_push,
     is_claude_ai_comment,
     strip_blockquote_lines,
     truncate_issue_comment_body,
 )
-from src.feishu_sync import sync_card_if_published
 from src.github_api import GitHubAPI, GitHubAPITimeout
 from src.timeline_event_type import TimelineEventType
+from src.tracing import span
+from src.webhook_payload import (
+    IssueCommentEvent,
+    PullRequestEvent,
+    PullRequestInfo,
+    PullRequestReviewEvent,
+    WebhookEvent,
+)
+
+
+HANDLED_EVENTS = frozenset({"pull_request", "pull_request_review", "issue_comment"})
 
 
 def _now_iso() -> str:
     return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
 
 
-def _iso_from_pr(pr: dict[str, Any]) -> str:
-    return pr.get("updated_at") or pr.get("created_at") or _now_iso()
+def _iso_from_pr(pr: PullRequestInfo) -> str:
+    return pr.updated_at or pr.created_at or _now_iso()
 
 
-def pr_state_from_payload(pr: dict[str, Any]) -> str:
-    if pr.get("merged"):
+def pr_state_from_payload(pr: PullRequestInfo) -> str:
+    if pr.merged:
         return "merged"
-    if pr.get("state") == "closed":
+    if pr.state == "closed":
         return "closed"
     return "open"
 
 
-def _label_requested_reviewer(obj: dict[str, Any] | None) -> str:
-    if not obj:
-        return ""
-    lg = obj.get("login")
-    if lg:
-        return lg
-    slug = obj.get("slug") or obj.get("name")
-    if slug:
-        return f"team/{slug}"
-    return ""
+def new_signature_hasher(secret: str) -> "hmac.HMAC | None":
+    """未配置 secret 时返回 None（不校验）；否则返回可分块 update 的 HMAC-SHA256。"""
+    if not secret:
+        return None
+    return hmac.new(secret.encode(), digestmod=hashlib.sha256)
 
 
-def verify_signature(payload: bytes, sig: str, secret: str) -> bool:
+_SIGNATURE_RE = re.compile(r"sha256=[0-9a-fA-F]{64}")
+
+
+def signature_header_plausible(sig: str, secret: str) -> bool:
+    """读 body 前的廉价检查：配置了 secret 时签名头必须是 sha256=<64 hex>。"""
     if not secret:
         return True
-    expect = "sha256=" + hmac.new(secret.encode(), payload, hashlib.sha256).hexdigest()
-    return hmac.compare_digest(sig, expect)
+    return _SIGNATURE_RE.fullmatch(sig) is not None
+
+
+def signature_matches(hasher: "hmac.HMAC | None", sig: str) -> bool:
+    if hasher is None:
+        return True
+    return hmac.compare_digest(sig, "sha256=" + hasher.hexdigest())
+
+
+def verify_signature(payload: bytes, sig: str, secret: str) -> bool:
+    hasher = new_signature_hasher(secret)
+    if hasher is not None:
+        hasher.update(payload)
+    return signature_matches(hasher, sig)
 
 
 def new_record(
@@ -64,7 +94,7 @@ def new_record(
     pr_state: str,
 ) -> dict[str, Any]:
     return {
-        "message_id": None,
+        "message_ids": {},
         "pr_state": pr_state,
         "pr_title": pr_title,
         "pr_number": pr_number,
@@ -78,31 +108,34 @@ def new_record(
 def _ensure_record(
     store: EventStore,
     repo_name: str,
-    pr: dict[str, Any],
+    pr: PullRequestInfo,
 ) -> None:
-    k = pr_key(repo_name, pr["number"])
+    k = pr_key(repo_name, pr.number)
     st = pr_state_from_payload(pr)
 
     def fn(data: dict[str, Any]):
         if k not in data:
-            data[k] = new_record(
-                repo_name,
-                int(pr["number"]),
-                pr.get("html_url", ""),
-                pr.get("title", ""),
-                st,
-            )
+            data[k] = store.archived(k) or new_record(repo_name, pr.number, pr.html_url, pr.title, st)
 
-    store.mutate(fn)
+    store.mutate(fn, k)
 
 
 def _append_event(
     store: EventStore,
     repo_name: str,
     pr_number: int,
-    event: dict[str, Any],
+    event: dict[str, Any] | None,
     record_updates: dict[str, Any] | None = None,
+    *,
+    publish_first: bool = False,
+    finalize: str | None = None,
+    digest: bool = False,
+    fold_window: int = 0,
 ) -> None:
+    """追加事件并在同一事务里登记飞书同步意图（event 为 None 时只更新记录并登记）。
+
+    digest 为 True（摘要模式仓库）且该 PR 未发过时间线卡片时，事件进入摘要缓冲而不是登记同步。
+    """
     k = pr_key(repo_name, pr_number)
     ru = dict(record_updates or {})
     ru["last_touched"] = _now_iso()
@@ -111,35 +144,46 @@ def _append_event(
         rec = data.get(k)
         if rec is None:
             return
-        rec.setdefault("events", []).append(event)
+        was_closed = rec.get("pr_state") in ("closed", "merged")
+        if event is not None:
+            if not fold_push(rec, event, fold_window):
+                rec.setdefault("events", []).append(event)
+            compact_timeline(rec)
         rec.update(ru)
-        data[k] = rec
+        if digest and not published(rec):
+            queued = outbox.enqueue_digest(rec, event, finalize=finalize)
+        else:
+            queued = outbox.enqueue_sync(rec, publish_first=publish_first, finalize=finalize)
+        if not queued and finalize == outbox.FINALIZE_REMOVE:
+            data.pop(k, None)  # 从未发过卡（如一直是 Draft）：无需同步，直接收尾
+            return
+        if rec.get("pr_state") not in ("closed", "merged"):
+            touch(data, k)
+        elif not was_closed:
+            demote(data, k)  # 只在关闭 / 合并的那一次移入头部；已关闭记录上的迟到事件不再重排
 
-    store.mutate(fn)
+    store.mutate(fn, k)
+    outbox.kick()
 
 
-def _has_comment_id_seen(store: EventStore, repo_name: str, pr_number: int, comment_id: int) -> bool:
-    """同一 issue_comment id 只处理一次（含 AI 与普通评论）。"""
+def _has_comment_id_seen(rec: dict[str, Any], comment_id: int) -> bool:
+    """同一 issue_comment id 只处理一次（含 AI 与普通评论）；rec 可以是从归档找回的记录。"""
     if not comment_id:
         return False
-    rec = store.get(repo_name, pr_number)
-    if not rec:
-        return False
     for ev in rec.get("events") or []:
         if ev.get("comment_id") == comment_id:
             return True
-    return False
+    return comment_id in ((rec.get(COMPACTED_FIELD) or {}).get("comment_ids") or ())
 
 
 
 def handle_pull_request(
-    data: dict[str, Any],
+    event: PullRequestEvent,
     cfg: Config,
-    token_file: str,
     store: EventStore,
     gh: GitHubAPI,
 ) -> tuple[dict, int]:
-    action = data.get("action", "")
+    action = event.action
     if action not in (
         "opened",
         "synchronize",
@@ -148,86 +192,123 @@ def handle_pull_request(
         "closed",
         "review_requested",
         "ready_for_review",
+        "labeled",
+        "unlabeled",
     ):
         return {"status": "ignored", "action": action or "unknown"}, 200
 
-    pr = data.get("pull_request") or {}
-    repo = data.get("repository") or {}
-    repo_name = repo.get("full_name", "")
-    pr_number = int(pr.get("number") or 0)
+    pr = event.pr
+    repo_name = event.repo_name
+    pr_number = pr.number
     if not repo_name or not pr_number:
         return {"error": "Missing repo/pr"}, 400
 
-    sender = data.get("sender") or {}
-    sender_login = sender.get("login", "")
+    sender_login = event.sender_login
+
+    # 飞书 token 预热与本请求的 GitHub 调用并发进行
+    if action in ("opened", "synchronize", "ready_for_review"):
+        outbox.prefetch_token()
 
     _ensure_record(store, repo_name, pr)
 
+    # label 参与群路由（chat_routing）：每次 PR 事件都刷新
+    labels = list(pr.labels)
+    digest = router(cfg).digest(repo_name)
     if action == "edited":
-        title = pr.get("title", "")
-
-        def fn2(data2: dict[str, Any]):
-            k = pr_key(repo_name, pr_number)
-            if k in data2:
-                data2[k]["pr_title"] = title
-                data2[k]["last_touched"] = _now_iso()
-
-        store.mutate(fn2)
-        ok = sync_card_if_published(cfg, token_file, store, repo_name, pr_number, publish_first=False)
-        return ({"status": "success", "detail": "title_edited"}, 200) if ok else ({"error": "Feishu update failed"}, 500)
+        _append_event(store, repo_name, pr_number, None, {"pr_title": pr.title, "labels": labels}, digest=digest)
+        return {"status": "success", "detail": "title_edited"}, 200
+    if action in ("labeled", "unlabeled"):
+        # 已发过卡时登记同步：新命中路由的群补发卡片；未发过卡只更新记录
+        _append_event(store, repo_name, pr_number, None, {"labels": labels}, digest=digest)
+        return {"status": "success", "detail": "labels"}, 200
 
     st = pr_state_from_payload(pr)
     tm = _iso_from_pr(pr)
     detail = ""
+    # Draft：仅写 store，ready_for_review 时首次发群；非 Draft：opened 即首次发群。request review 不再作为首次触发。
+    if action == "opened":
+        publish_first = not pr.draft
+    elif action == "ready_for_review":
+        publish_first = True
+    else:
+        publish_first = False
+    # merged 后记录在卡片最终更新投递成功时移出热存储；启用归档时 closed 同样移出（reopen / 迟到事件从归档找回）
+    finishes = action == "closed" and (pr.merged or store.archive is not None)
+    finalize = outbox.FINALIZE_REMOVE if finishes else None
+
+    def append(ev: dict[str, Any] | None, updates: dict[str, Any]) -> None:
+        updates["labels"] = labels
+        _append_event(
+            store,
+            repo_name,
+            pr_number,
+            ev,
+            updates,
+            publish_first=publish_first,
+            finalize=finalize,
+            digest=digest,
+            fold_window=cfg.push_fold_seconds,
+        )
 
     if action == "opened":
         try:
-            file_stat = gh.format_git_file_stats(repo_name, pr_number)
+            with span("github_file_stats"):
+                file_stat = gh.format_git_file_stats(repo_name, pr_number)
         except GitHubAPITimeout:
             file_stat = "⚠️ GitHub 连接超时，无法获取文件列表"
+        except CircuitOpenError:
+            file_stat = "⚠️ GitHub 暂不可用（已熔断），无法获取文件列表"
         except Exception:
             file_stat = "⚠️ GitHub 文件列表获取失败"
         ev: dict[str, Any] = {
             "type": TimelineEventType.PR_OPEN.value,
             "time": tm,
             "author": sender_login,
-            "title": pr.get("title", ""),
+            "title": pr.title,
             "pr_number": pr_number,
             "file_stat": file_stat,
         }
-        _append_event(
-            store,
-            repo_name,
-            pr_number,
-            ev,
-            {
-                "pr_state": st,
-                "pr_title": pr.get("title", ""),
-                "pr_url": pr.get("html_url", ""),
-            },
-        )
+        append(ev, {"pr_state": st, "pr_title": pr.title, "pr_url": pr.html_url})
         detail = "pr_open"
     elif action == "synchronize":
-        before = data.get("before") or ""
-        after = data.get("after") or pr.get("head", {}).get("sha", "")
-        branch = (pr.get("head") or {}).get("ref", "")
-        try:
-            total, short_sha, msgs = gh.get_commits_between(repo_name, before, after)
-            if total <= 0 and after:
-                total = 1
-                if not short_sha:
-                    short_sha = after[:7]
-                if not msgs:
-                    t = gh.get_commit_title_line(repo_name, after)
-                    msgs = [t] if t else []
-            if total == 1 and after and (not msgs or not str(msgs[0]).strip()):
-                t = gh.get_commit_title_line(repo_name, after)
-                if t:
-                    msgs = [t]
-        except GitHubAPITimeout:
-            total, short_sha, msgs = 1, after[:7] if after else "", []
-        except Exception:
-            total, short_sha, msgs = 1, after[:7] if after else "", []
+        before = event.before
+        after = event.after or pr.head_sha
+        branch = pr.head_ref
+
+        @cache
+        def title() -> str:
+            # 仅 compare 回退路径调用；compare 成功时已把 head 标题写入缓存，这里先查缓存不再请求。
+            # 本请求内记住结果（含缓存不保存的空标题），回退路径上多处调用只查询一次
+            return gh.get_commit_title_line(repo_name, after)
+
+        if event.commits:
+            # payload 自带提交列表：不请求 GitHub，顺手填充标题缓存
+            for sha, subject in event.commits:
+                gh.titles.put(repo_name, sha, subject)
+            total = max(event.commit_total, 1)
+            short_sha = after[:7] if after else ""
+            msgs = [m[:120] for _, m in event.commits[-PUSH_MESSAGES_SHOWN:] if m]
+        else:
+            try:
+                with span("github_commits"):
+                    total, short_sha, msgs = gh.get_commits_between(
+                        repo_name, before, after, head_title=title, limit=PUSH_MESSAGES_SHOWN
+                    )
+                if total <= 0 and after:
+                    total = 1
+                    if not short_sha:
+                        short_sha = after[:7]
+                    if not msgs:
+                        t = title()
+                        msgs = [t] if t else []
+                if total == 1 and after and (not msgs or not str(msgs[0]).strip()):
+                    t = title()
+                    if t:
+                        msgs = [t]
+            except GitHubAPITimeout:
+                total, short_sha, msgs = 1, after[:7] if after else "", []
+            except Exception:
+                total, short_sha, msgs = 1, after[:7] if after else "", []
         ev = {
             "type": TimelineEventType.PR_PUSH.value,
             "time": tm,
@@ -237,10 +318,10 @@ def handle_pull_request(
             "commit_count": total,
             "commit_messages": msgs,
         }
-        _append_event(store, repo_name, pr_number, ev, {"pr_state": st, "pr_title": pr.get("title", "")})
+        append(ev, {"pr_state": st, "pr_title": pr.title})
         detail = "pr_push"
     elif action == "review_requested":
-        label = _label_requested_reviewer(data.get("requested_reviewer"))
+        label = event.requested_reviewer
         if label:
             ev = {
                 "type": TimelineEventType.REVIEW_REQUESTED.value,
@@ -248,115 +329,105 @@ def handle_pull_request(
                 "requester": sender_login,
                 "reviewer": label,
             }
-            _append_event(store, repo_name, pr_number, ev, {"pr_state": st, "pr_title": pr.get("title", "")})
+            append(ev, {"pr_state": st, "pr_title": pr.title})
             detail = "review_requested"
+        else:
+            append(None, {"pr_state": st, "pr_title": pr.title})
     elif action == "ready_for_review":
         ev = {"type": TimelineEventType.PR_READY.value, "time": tm, "author": sender_login}
-        _append_event(store, repo_name, pr_number, ev, {"pr_state": st, "pr_title": pr.get("title", "")})
+        append(ev, {"pr_state": st, "pr_title": pr.title})
         detail = "pr_ready"
     elif action == "reopened":
         ev = {"type": TimelineEventType.PR_REOPEN.value, "time": tm, "author": sender_login}
-        _append_event(store, repo_name, pr_number, ev, {"pr_state": "open", "pr_title": pr.get("title", "")})
+        append(ev, {"pr_state": "open", "pr_title": pr.title})
         detail = "pr_reopen"
     elif action == "closed":
-        if pr.get("merged"):
+        if pr.merged:
             ev = {"type": TimelineEventType.PR_MERGE.value, "time": tm, "merger": sender_login}
-            _append_event(store, repo_name, pr_number, ev, {"pr_state": "merged", "pr_title": pr.get("title", "")})
+            append(ev, {"pr_state": "merged", "pr_title": pr.title})
             detail = "pr_merge"
         else:
             ev = {"type": TimelineEventType.PR_CLOSE.value, "time": tm, "author": sender_login}
-            _append_event(store, repo_name, pr_number, ev, {"pr_state": "closed", "pr_title": pr.get("title", "")})
+            append(ev, {"pr_state": "closed", "pr_title": pr.title})
             detail = "pr_close"
 
-    # Draft：仅写 store，ready_for_review 时首次发群；非 Draft：opened 即首次发群。request review 不再作为首次触发。
-    if action == "opened":
-        publish_first = not pr.get("draft", False)
-    elif action == "ready_for_review":
-        publish_first = True
-    else:
-        publish_first = False
-    ok = sync_card_if_published(cfg, token_file, store, repo_name, pr_number, publish_first=publish_first)
-    if ok and action == "closed" and pr.get("merged"):
-        store.remove_record(repo_name, pr_number)
-    if ok:
-        return {"status": "success", "detail": detail or "sync"}, 200
-    return ({"error": "Feishu send/update failed"}, 500)
+    return {"status": "success", "detail": detail or "sync"}, 200
 
 
 def handle_pull_request_review(
-    data: dict[str, Any],
+    event: PullRequestReviewEvent,
     cfg: Config,
-    token_file: str,
     store: EventStore,
 ) -> tuple[dict, int]:
-    if data.get("action") != "submitted":
-        return {"status": "ignored", "action": data.get("action", "")}, 200
-
-    pr = data.get("pull_request") or {}
-    review = data.get("review") or {}
-    repo = data.get("repository") or {}
-    repo_name = repo.get("full_name", "")
-    pr_number = int(pr.get("number") or 0)
+    if event.action != "submitted":
+        return {"status": "ignored", "action": event.action}, 200
+
+    pr = event.pr
+    repo_name = event.repo_name
+    pr_number = pr.number
     if not repo_name or not pr_number:
         return {"error": "Missing repo/pr"}, 400
 
     _ensure_record(store, repo_name, pr)
-    st = (review.get("state") or "").lower()
-    user = (review.get("user") or {}).get("login", "")
-    tm = review.get("submitted_at") or _iso_from_pr(pr)
-    body = (review.get("body") or "").strip()
+    tm = event.submitted_at or _iso_from_pr(pr)
     ev = {
         "type": TimelineEventType.HUMAN_REVIEW.value,
         "time": tm,
-        "reviewer": user,
-        "state": st,
-        "body": body,
+        "reviewer": event.reviewer,
+        "state": event.review_state,
+        "body": event.body,
     }
-    _append_event(store, repo_name, pr_number, ev, {"pr_state": pr_state_from_payload(pr), "pr_title": pr.get("title", "")})
-    ok = sync_card_if_published(cfg, token_file, store, repo_name, pr_number, publish_first=False)
-    return ({"status": "success", "detail": "human_review"}, 200) if ok else ({"error": "Feishu send/update failed"}, 500)
+    _append_event(
+        store,
+        repo_name,
+        pr_number,
+        ev,
+        {"pr_state": pr_state_from_payload(pr), "pr_title": pr.title},
+        digest=router(cfg).digest(repo_name),
+    )
+    return {"status": "success", "detail": "human_review"}, 200
 
 
 def handle_issue_comment(
-    data: dict[str, Any],
+    event: IssueCommentEvent,
     cfg: Config,
-    token_file: str,
     store: EventStore,
 ) -> tuple[dict, int]:
-    if data.get("action") != "created":
-        return {"status": "ignored", "action": data.get("action", "")}, 200
+    if event.action != "created":
+        return {"status": "ignored", "action": event.action}, 200
 
-    issue = data.get("issue") or {}
-    if not issue.get("pull_request"):
+    if not event.is_pull_request:
         return {"status": "ignored", "reason": "not_a_pr"}, 200
 
-    comment = data.get("comment") or {}
-    body = comment.get("body") or ""
-    repo = data.get("repository") or {}
-    repo_name = repo.get("full_name", "")
-    pr_number = int(issue.get("number") or 0)
-    comment_id = int(comment.get("id") or 0)
-    author = (comment.get("user") or {}).get("login", "")
-    tm = comment.get("updated_at") or comment.get("created_at") or _now_iso()
+    body = event.body
+    repo_name = event.repo_name
+    pr_number = event.pr_number
+    comment_id = event.comment_id
+    author = event.author
+    tm = event.time or _now_iso()
 
     if not repo_name or not pr_number:
         return {"error": "Missing repo/pr"}, 400
 
-    if comment_id and _has_comment_id_seen(store, repo_name, pr_number, comment_id):
-        return {"status": "ignored", "reason": "duplicate_comment"}, 200
-
     k = pr_key(repo_name, pr_number)
-    pr_url = issue.get("html_url", "")
-    title = issue.get("title", "")
-    st = "closed" if issue.get("state") == "closed" else "open"
-
-    def ensure_from_issue(d: dict[str, Any]):
+    pr_url = event.issue_url
+    title = event.issue_title
+    st = "closed" if event.issue_state == "closed" else "open"
+
+    def ensure_from_issue(d: dict[str, Any]) -> bool:
+        """返回 False 表示重复投递；去重在找回归档之后做，已归档 PR 的评论同样只记一次。"""
+        rec = d.get(k) or store.archived(k)
+        if rec is not None and _has_comment_id_seen(rec, comment_id):
+            return False
         if k not in d:
-            d[k] = new_record(repo_name, pr_number, pr_url, title, st)
+            d[k] = rec or new_record(repo_name, pr_number, pr_url, title, st)
+        return True
 
-    store.mutate(ensure_from_issue)
+    if not store.mutate(ensure_from_issue, k):
+        return {"status": "ignored", "reason": "duplicate_comment"}, 200
+    digest = router(cfg).digest(repo_name)
 
-    if is_claude_ai_comment(body, comment):
+    if is_claude_ai_comment(event.author, event.author_type, event.in_reply_to_id):
         review_text = extract_ai_review_for_card(body)
         ev = {
             "type": TimelineEventType.AI_REVIEW.value,
@@ -365,9 +436,8 @@ def handle_issue_comment(
             "comment_id": comment_id,
             "final_opinion": review_text,
         }
-        _append_event(store, repo_name, pr_number, ev, {"pr_title": issue.get("title", "")})
-        ok = sync_card_if_published(cfg, token_file, store, repo_name, pr_number, publish_first=False)
-        return ({"status": "success", "detail": "ai_review"}, 200) if ok else ({"error": "Feishu send/update failed"}, 500)
+        _append_event(store, repo_name, pr_number, ev, {"pr_title": title}, digest=digest)
+        return {"status": "success", "detail": "ai_review"}, 200
 
     plain = strip_blockquote_lines(body)
     if not plain:
@@ -380,35 +450,31 @@ def handle_issue_comment(
         "comment_id": comment_id,
         "body": truncate_issue_comment_body(plain),
     }
-    _append_event(store, repo_name, pr_number, ev, {"pr_title": issue.get("title", "")})
-    ok = sync_card_if_published(cfg, token_file, store, repo_name, pr_number, publish_first=False)
-    return ({"status": "success", "detail": "pr_comment"}, 200) if ok else ({"error": "Feishu send/update failed"}, 500)
+    _append_event(store, repo_name, pr_number, ev, {"pr_title": title}, digest=digest)
+    return {"status": "success", "detail": "pr_comment"}, 200
 
 
 def handle(
-    payload: bytes,
-    sig: str,
     event_type: str,
-    data: dict[str, Any] | None,
+    event: WebhookEvent | None,
     cfg: Config,
-    token_file: str,
     store_path: str,
     gh: GitHubAPI,
 ) -> tuple[dict, int]:
-    if event_type not in ("pull_request", "pull_request_review", "issue_comment"):
+    """签名已由 server 在读 body 时流式校验，这里只分发已解析的 payload。"""
+    if event_type not in HANDLED_EVENTS:
         return {"status": "ignored", "event": event_type or "unknown"}, 200
-    if not data:
+    if event is None:
         return {"error": "Empty payload"}, 400
-    if not verify_signature(payload, sig, cfg.github_webhook_secret):
-        return {"error": "Invalid signature"}, 401
 
-    store = EventStore(store_path)
+    store = open_store(store_path, cfg.max_pr_records, archive=cfg.archive_records, shards=cfg.store_shards)
 
-    if event_type == "pull_request":
-        return handle_pull_request(data, cfg, token_file, store, gh)
-    if event_type == "pull_request_review":
-        return handle_pull_request_review(data, cfg, token_file, store)
-    if event_type == "issue_comment":
-        return handle_issue_comment(data, cfg, token_file, store)
+    with span(f"handle_{event_type}", action=event.action):
+        if isinstance(event, PullRequestEvent):
+            return handle_pull_request(event, cfg, store, gh)
+        if isinstance(event, PullRequestReviewEvent):
+            return handle_pull_request_review(event, cfg, store)
+        if isinstance(event, IssueCommentEvent):
+            return handle_issue_comment(event, cfg, store)
 
     return {"status": "ignored", "event": event_type or "unknown"}, 200
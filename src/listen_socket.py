@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""监听 socket：优先接管 systemd socket activation 传入的 fd，否则自行 bind
+
+只依赖标准库，供 app.py 在导入业务模块之前调用：端口先进入 LISTEN，启动期间到达的
+webhook 排在 backlog 里等待处理，而不是被拒绝连接。
+"""
+
+from __future__ import annotations
+
+import os
+import socket
+
+# systemd sd_listen_fds 约定：传入的第一个 fd 为 3
+SD_LISTEN_FDS_START = 3
+LISTEN_BACKLOG = 128
+
+
+def systemd_socket() -> socket.socket | None:
+    """LISTEN_PID 指向本进程且 LISTEN_FDS >= 1 时返回第一个传入的 socket。"""
+    if os.environ.get("LISTEN_PID") != str(os.getpid()):
+        return None
+    try:
+        n = int(os.environ.get("LISTEN_FDS", "0"))
+    except ValueError:
+        return None
+    if n < 1:
+        return None
+    # 子进程不应再继承
+    for k in ("LISTEN_PID", "LISTEN_FDS", "LISTEN_FDNAMES"):
+        os.environ.pop(k, None)
+    return socket.socket(fileno=SD_LISTEN_FDS_START)
+
+
+def listen_socket(port: int, host: str = "0.0.0.0") -> tuple[socket.socket, bool]:
+    """返回 (监听中的 socket, 是否来自 systemd)。"""
+    sock = systemd_socket()
+    if sock is not None:
+        return sock, True
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        sock.bind((host, port))
+        sock.listen(LISTEN_BACKLOG)
+    except OSError:
+        sock.close()
+        raise
+    return sock, False
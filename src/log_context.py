@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""请求级日志上下文：delivery / pr_key / 阶段耗时随 contextvars 传递，结构化日志自动带上"""
+
+from __future__ import annotations
+
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+_ctx: contextvars.ContextVar[dict[str, Any] | None] = contextvars.ContextVar("feishubot_log_ctx", default=None)
+
+
+@contextmanager
+def log_context(**fields: Any) -> Iterator[dict[str, Any]]:
+    """开启一个请求的上下文；upstream_pool 复制 contextvars，工作线程写入的是同一个 dict。"""
+    d = {k: v for k, v in fields.items() if v}
+    token = _ctx.set(d)
+    try:
+        yield d
+    finally:
+        _ctx.reset(token)
+
+
+def bind(**fields: Any) -> None:
+    """向当前上下文追加字段；不在请求中时为空操作。"""
+    d = _ctx.get()
+    if d is not None:
+        d.update((k, v) for k, v in fields.items() if v)
+
+
+def note_stage(name: str, seconds: float) -> None:
+    d = _ctx.get()
+    if d is not None:
+        stages = d.setdefault("stages_ms", {})
+        stages[name] = round(stages.get(name, 0.0) + seconds * 1000, 3)
+
+
+def current() -> dict[str, Any] | None:
+    return _ctx.get()
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""进程内指标：直方图 / 计数器 / 仪表，GET /metrics 输出 Prometheus 文本格式"""
+
+from __future__ import annotations
+
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+from src import log_context, tracing
+
+# 秒；覆盖本地文件锁（毫秒级）到上游超时（10s）
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _fmt_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_num(v: float) -> str:
+    if math.isnan(v):
+        return "NaN"
+    if math.isinf(v):
+        return "+Inf" if v > 0 else "-Inf"
+    if v == int(v):
+        return str(int(v))
+    return repr(v)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        # 每个指标一把锁，临界区只有几次整数加法
+        self._lock = threading.Lock()
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, n: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + n
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        out = self._header()
+        for labels, v in items:
+            out.append(f"{self.name}{_fmt_labels(self.labelnames, labels)} {_fmt_num(v)}")
+        return out
+
+
+class Gauge(_Metric):
+    """可 inc/dec，也可传 callback 在抓取时取值（如锁表大小）；带 labelnames 时 callback 返回 {labels: value}。"""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        callback: Callable[[], Any] | None = None,
+        labelnames: tuple[str, ...] = (),
+    ):
+        super().__init__(name, help_text, labelnames)
+        self._value = 0.0
+        self._callback = callback
+
+    def inc(self, n: float = 1) -> None:
+        with self._lock:
+            self._value += n
+
+    def dec(self, n: float = 1) -> None:
+        with self._lock:
+            self._value -= n
+
+    def set(self, v: float) -> None:
+        self._value = v
+
+    def value(self) -> float:
+        if self._callback is not None:
+            try:
+                return float(self._callback())
+            except Exception:
+                return float("nan")
+        return self._value
+
+    def render(self) -> list[str]:
+        if self.labelnames and self._callback is not None:
+            try:
+                items = sorted(self._callback().items())
+            except Exception:
+                items = []
+            out = self._header()
+            for labels, v in items:
+                out.append(f"{self.name}{_fmt_labels(self.labelnames, labels)} {_fmt_num(v)}")
+            return out
+        return self._header() + [f"{self.name} {_fmt_num(self.value())}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [各桶计数（非累计，最后一格为 +Inf）, sum]
+        self._series: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+            s[0][i] += 1
+            s[1][0] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        t0 = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - t0, *labels)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted((k, (list(c), s[0])) for k, (c, s) in self._series.items())
+        out = self._header()
+        for labels, (counts, total) in items:
+            acc = 0
+            for le, c in zip(self.buckets, counts):
+                acc += c
+                lb = _fmt_labels(self.labelnames, labels, f'le="{_fmt_num(le)}"')
+                out.append(f"{self.name}_bucket{lb} {acc}")
+            acc += counts[-1]
+            lb = _fmt_labels(self.labelnames, labels, 'le="+Inf"')
+            out.append(f"{self.name}_bucket{lb} {acc}")
+            plain = _fmt_labels(self.labelnames, labels)
+            out.append(f"{self.name}_sum{plain} {total!r}")
+            out.append(f"{self.name}_count{plain} {acc}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, m: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(m)
+        return m
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for m in list(self._metrics):
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.register(
+    Histogram("feishubot_request_seconds", "Webhook handling time by event.", ("event",))
+)
+STAGE_SECONDS = REGISTRY.register(
+    Histogram("feishubot_stage_seconds", "Time spent per processing stage.", ("stage",))
+)
+WEBHOOKS_TOTAL = REGISTRY.register(
+    Counter("feishubot_webhooks_total", "Webhooks by event, action and outcome.", ("event", "action", "outcome"))
+)
+IN_FLIGHT = REGISTRY.register(Gauge("feishubot_in_flight_requests", "Webhooks currently being handled."))
+
+
+def register_gauge_callback(name: str, help_text: str, callback: Callable[[], float]) -> Gauge:
+    return REGISTRY.register(Gauge(name, help_text, callback))
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """with stage("github"): ... —— 记录该阶段耗时到 feishubot_stage_seconds（开启追踪时同时记 span）。"""
+    t0 = time.monotonic()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.monotonic() - t0)
+
+
+def observe_stage(name: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(seconds, name)
+    tracing.record(name, seconds)
+    log_context.note_stage(name, seconds)
+
+
+def render() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+"""飞书投递 outbox：同步意图与事件在同一次 store 事务中落盘，后台线程带退避重试地投递
+
+意图存放在记录的 "outbox" 字段：同一 PR 多次登记合并为一条（seq 递增），投递时总是按记录的最新状态
+send / patch，因此重启、飞书故障都不会丢卡片更新，webhook 也不再等待飞书返回。
+投递线程按内存索引调度，不同 PR 并发投递，一个 PR 卡在飞书请求上不会挡住其它仓库的卡片。
+
+摘要模式仓库的事件改为缓冲在记录的 "digest" 字段，同一仓库最早一条缓冲满一个周期后，
+由投递线程合并为每群一张摘要卡片发出；部分群发送失败时，已收到的群（sent_chats）与退避时间同样记在缓冲中。
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable
+
+from src import upstream_pool
+from src.chat_routing import app_secrets, router
+from src.config import Config
+from src.event_store import EventStore, open_store, pr_key, published
+from src.feishu_credential import get_tenant_access_token
+from src.feishu_sync import send_digest, sync_card
+
+log = logging.getLogger(__name__)
+
+OUTBOX_FIELD = "outbox"
+DIGEST_FIELD = "digest"
+# 摘要缓冲每个 PR 保留的最近事件数（卡片只展示其中几条，其余计数）
+DIGEST_EVENTS_KEPT = 10
+# 无到期意图时的兜底轮询间隔（秒）
+POLL_INTERVAL = 30.0
+# 停机排空时两轮扫描之间的最短间隔，避免到期意图反复失败时空转
+DRAIN_POLL_INTERVAL = 0.1
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 300.0
+# 约 1.5 小时后放弃，避免永久失败（如群已解散）的意图无限重试
+MAX_ATTEMPTS = 25
+# 并发投递的线程数：不同 PR（摘要为不同仓库）互不等待，同一 PR 同时只有一次投递。
+# 不用 upstream_pool：投递内部还要经它扇出到多个群，共用一个池时投递占满线程会与扇出互相等待
+DELIVERY_WORKERS = 4
+
+FINALIZE_REMOVE = "remove"
+
+
+def enqueue_sync(rec: dict[str, Any], *, publish_first: bool, finalize: str | None = None) -> bool:
+    """在 store.mutate 回调内调用：登记同步意图，返回是否登记。
+
+    未发过卡（无 message_id）且本次不是首次发布时不登记（Draft 只写 store）；已有意图时合并，
+    publish / finalize 取并集，attempts 清零以便立即重试。
+    """
+    prev = rec.get(OUTBOX_FIELD)
+    if not (published(rec) or publish_first or prev):
+        return False
+    prev = prev or {}
+    rec[OUTBOX_FIELD] = {
+        "seq": int(prev.get("seq", 0)) + 1,
+        "publish": bool(publish_first or prev.get("publish")),
+        "finalize": finalize or prev.get("finalize"),
+        "attempts": 0,
+        "next_at": 0,
+    }
+    _note(rec)
+    return True
+
+
+def enqueue_digest(rec: dict[str, Any], event: dict[str, Any] | None, *, finalize: str | None = None) -> bool:
+    """在 store.mutate 回调内调用：摘要模式下把事件放入该 PR 的缓冲，返回记录是否有待发摘要。"""
+    buf = rec.get(DIGEST_FIELD)
+    if event is None:
+        return bool(buf)
+    if not buf:
+        buf = rec[DIGEST_FIELD] = {"since": time.time(), "count": 0, "events": []}
+    buf["count"] = int(buf.get("count", 0)) + 1
+    buf["events"] = (list(buf.get("events") or []) + [event])[-DIGEST_EVENTS_KEPT:]
+    if finalize:
+        buf["finalize"] = finalize
+    _note(rec)
+    return True
+
+
+def _note(rec: dict[str, Any]) -> None:
+    """登记后更新投递线程的内存索引（在 mutate 回调内调用，索引只会比落盘略早，投递时以 store 为准）。"""
+    d = _dispatcher
+    if d is not None:
+        d.note(pr_key(rec.get("repo", ""), rec.get("pr_number") or 0), rec)
+
+
+def _backoff(attempts: int) -> float:
+    return min(BACKOFF_BASE * (2 ** max(attempts - 1, 0)), BACKOFF_MAX)
+
+
+class OutboxDispatcher:
+    """调度线程只看内存索引（pr_key -> next_at、仓库 -> 摘要缓冲），到期项交给投递线程池并发投递。
+
+    索引在启动时从 store 读一次，之后由 enqueue_* 与投递结果维护，唤醒时不再读取全部记录。
+    """
+
+    def __init__(self, cfg: Config, token_file: str, store: EventStore):
+        self.cfg = cfg
+        self.token_file = token_file
+        self.store = store
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        # stop() 之后仍继续投递到期意图，直到该时刻（time.monotonic）
+        self._deadline = 0.0
+        self._thread: threading.Thread | None = None
+        self._pool: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+        # pr_key -> 同步意图的 next_at
+        self._due_at: dict[str, float] = {}
+        # repo -> {pr_key: 摘要缓冲的 (since, next_at)}
+        self._digests: dict[str, dict[str, tuple[float, float]]] = {}
+        # 投递中的 pr_key 与摘要仓库（_digest_tag）
+        self._inflight: set[str] = set()
+        self._loaded = False
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._pool = ThreadPoolExecutor(max_workers=DELIVERY_WORKERS, thread_name_prefix="feishu-outbox")
+        self._thread = threading.Thread(target=self._run, name="feishu-outbox", daemon=True)
+        self._thread.start()
+
+    def kick(self) -> None:
+        self._wake.set()
+
+    def stop(self, timeout: float = 0.0) -> bool:
+        """停止投递：先用至多 timeout 秒投完已到期的意图，进行中的投递不打断。
+
+        返回是否已全部结束；超时仍未结束说明有投递卡在飞书请求上，意图保留在 store 中由下次启动补投。
+        """
+        self._deadline = time.monotonic() + max(timeout, 0.0)
+        self._stop.set()
+        self._wake.set()
+        if self._thread is None:
+            return True
+        self._thread.join(max(timeout, 0.0))
+        with self._lock:
+            busy = bool(self._inflight)
+        return not self._thread.is_alive() and not busy
+
+    def warm_token(self) -> None:
+        cfg = self.cfg
+        for app_id, secret in app_secrets(cfg).items():
+            get_tenant_access_token(app_id, secret, self.token_file, base_url=cfg.feishu_base_url)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._due_at)
+
+    def note(self, k: str, rec: dict[str, Any] | None) -> None:
+        """按记录当前的意图 / 摘要缓冲更新索引；rec 为 None 表示记录已不在热存储。"""
+        with self._lock:
+            self._index(k, rec)
+
+    def _index(self, k: str, rec: dict[str, Any] | None) -> None:
+        ob = rec.get(OUTBOX_FIELD) if rec else None
+        buf = rec.get(DIGEST_FIELD) if rec else None
+        if ob:
+            self._due_at[k] = float(ob.get("next_at") or 0)
+        else:
+            self._due_at.pop(k, None)
+        repo_name = k.rsplit("#", 1)[0]
+        bufs = self._digests.get(repo_name)
+        if buf:
+            if bufs is None:
+                bufs = self._digests[repo_name] = {}
+            # 发送失败后的重试时间随缓冲落盘，重启后仍按退避进行
+            bufs[k] = (float(buf.get("since") or 0), float(buf.get("next_at") or 0))
+        elif bufs is not None:
+            bufs.pop(k, None)
+            if not bufs:
+                del self._digests[repo_name]
+
+    def _load_index(self) -> None:
+        """启动时读一次全部记录；只补充索引，不覆盖读盘期间 enqueue 已登记的较新状态。"""
+        records = self.store.all_records()
+        with self._lock:
+            for k, rec in records.items():
+                if not (rec.get(OUTBOX_FIELD) or rec.get(DIGEST_FIELD)):
+                    continue
+                if k in self._due_at or k in self._digests.get(k.rsplit("#", 1)[0], {}):
+                    continue
+                self._index(k, rec)
+        self._loaded = True
+
+    def _apply(self, k: str, fn: Callable[[dict[str, Any]], None], data: dict[str, Any]) -> None:
+        """在 store.mutate 内执行 fn 后按结果更新索引。"""
+        fn(data)
+        self.note(k, data.get(k))
+
+    def _run(self) -> None:
+        while True:
+            # 先清再扫：扫描期间到来的 kick 会让下一次 wait 立即返回
+            self._wake.clear()
+            try:
+                if not self._loaded:
+                    self._load_index()
+                wait = self.drain_once()
+            except Exception:
+                log.exception("outbox drain failed")
+                wait = POLL_INTERVAL
+            if self._stop.is_set() and (time.monotonic() >= self._deadline or not self._busy()):
+                break  # 停止中：投完到期意图（或到截止时间）即退出
+            self._wake.wait(min(wait, DRAIN_POLL_INTERVAL) if self._stop.is_set() else wait)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _busy(self) -> bool:
+        now = time.time()
+        with self._lock:
+            return bool(self._inflight) or any(at <= now for at in self._due_at.values())
+
+    def drain_once(self) -> float:
+        """把到期且不在投递中的意图与摘要交给投递线程池；返回距下一个到期项的秒数（供调度线程等待）。"""
+        now = time.time()
+        next_due = POLL_INTERVAL
+        interval = max(self.cfg.digest_interval_seconds, 1)
+        jobs: list[tuple[str, Callable[[], None]]] = []
+        with self._lock:
+            for repo_name, bufs in self._digests.items():
+                tag = _digest_tag(repo_name)
+                if tag in self._inflight:
+                    continue
+                due = max(min(s for s, _ in bufs.values()) + interval, max(n for _, n in bufs.values()))
+                if due > now or self._stop.is_set():
+                    # 停机时不提前发摘要，缓冲已落盘，下次启动按原周期发送
+                    next_due = min(next_due, max(due - now, 0.05))
+                    continue
+                jobs.append((tag, partial(self._deliver_digest, repo_name, list(bufs))))
+            if not (self._stop.is_set() and time.monotonic() >= self._deadline):
+                for k, due in self._due_at.items():
+                    if k in self._inflight:
+                        continue
+                    if due > now:
+                        next_due = min(next_due, due - now)
+                        continue
+                    jobs.append((k, partial(self._deliver, k)))
+            self._inflight.update(tag for tag, _ in jobs)
+        for tag, job in jobs:
+            if self._pool is None:
+                self._job(tag, job)
+            else:
+                self._pool.submit(self._job, tag, job)
+        return max(next_due, 0.05)
+
+    def _job(self, tag: str, job: Callable[[], None]) -> None:
+        try:
+            job()
+        except Exception:
+            # 一个 PR / 仓库出错不影响其余投递
+            log.exception("[%s] outbox delivery failed", tag)
+        finally:
+            with self._lock:
+                self._inflight.discard(tag)
+            self._wake.set()
+
+    def _read(self, k: str) -> dict[str, Any] | None:
+        repo_name, _, n = k.rpartition("#")
+        return self.store.get(repo_name, n)
+
+    def _deliver_digest(self, repo_name: str, keys: list[str]) -> None:
+        recs: dict[str, dict[str, Any]] = {}
+        for k in keys:
+            rec = self._read(k)
+            if rec and rec.get(DIGEST_FIELD):
+                recs[k] = rec
+            else:
+                self.note(k, rec)  # 索引过期：缓冲已发出或记录已离开热存储
+        if not recs:
+            return
+        items = sorted(((r, r[DIGEST_FIELD]) for r in recs.values()), key=lambda x: float(x[1].get("since") or 0))
+        try:
+            sent, ok = send_digest(self.cfg, self.token_file, repo_name, items)
+        except Exception:
+            log.exception("[%s] digest delivery raised", repo_name)
+            sent, ok = set(), False
+        if not ok:
+            attempts = max(int(r[DIGEST_FIELD].get("attempts", 0)) for r in recs.values()) + 1
+            if attempts < MAX_ATTEMPTS:
+                # 已发成功的群记入各缓冲：重试（含重启后）只补发失败的群
+                rt = router(self.cfg)
+                next_at = time.time() + _backoff(attempts)
+                for k, rec in recs.items():
+                    chats = sent.intersection(rt.chats_for(repo_name, rec.get("labels") or ()))
+                    self.store.mutate(partial(self._apply, k, partial(_digest_failed, k, chats, attempts, next_at)), k)
+                log.warning("[%s] digest delivery failed, will retry", repo_name)
+                return
+            log.error("[%s] digest give up after %d attempts", repo_name, attempts)
+        for k, rec in recs.items():
+            self.store.mutate(partial(self._apply, k, partial(_digest_done, k, rec[DIGEST_FIELD])), k)
+        log.info("[%s] digest sent prs=%d chats=%d", repo_name, len(recs), len(sent))
+
+    def _deliver(self, k: str) -> None:
+        rec = self._read(k)
+        ob = rec.get(OUTBOX_FIELD) if rec else None
+        if not ob or float(ob.get("next_at") or 0) > time.time():
+            self.note(k, rec)  # 索引过期：意图已投递、被合并推迟或记录已离开热存储
+            return
+        repo_name, pr_number = rec.get("repo", ""), int(rec.get("pr_number") or 0)
+        seq = ob.get("seq")
+        try:
+            ok = sync_card(self.cfg, self.token_file, self.store, repo_name, pr_number, publish=bool(ob.get("publish")))
+        except Exception:
+            # 按一次失败计入退避与 MAX_ATTEMPTS，避免单条记录反复抛错、反复重投
+            log.exception("[%s] outbox delivery raised", k)
+            ok = False
+
+        def done(data: dict[str, Any]):
+            rec = data.get(k)
+            if rec is None:
+                return
+            cur = rec.get(OUTBOX_FIELD)
+            if not cur:
+                return
+            if ok:
+                if cur.get("seq") != seq:
+                    return  # 投递期间又有新事件，保留意图再同步一次
+                rec.pop(OUTBOX_FIELD, None)
+                if cur.get("finalize") == FINALIZE_REMOVE:
+                    data.pop(k, None)
+                return
+            attempts = int(cur.get("attempts", 0)) + 1
+            if attempts >= MAX_ATTEMPTS:
+                log.error("[%s] outbox give up after %d attempts", k, attempts)
+                rec.pop(OUTBOX_FIELD, None)
+                if cur.get("finalize") == FINALIZE_REMOVE:
+                    data.pop(k, None)
+                return
+            cur["attempts"] = attempts
+            cur["next_at"] = time.time() + _backoff(attempts)
+
+        self.store.mutate(partial(self._apply, k, done), k)
+        if not ok:
+            log.warning("[%s] outbox delivery failed, will retry", k)
+
+
+def _digest_tag(repo_name: str) -> str:
+    return f"digest:{repo_name}"
+
+
+def _digest_failed(k: str, sent: set[str], attempts: int, next_at: float, data: dict[str, Any]) -> None:
+    """摘要部分失败：记下本轮已收到该缓冲的群与退避时间。"""
+    cur = (data.get(k) or {}).get(DIGEST_FIELD)
+    if not cur:
+        return
+    cur["sent_chats"] = sorted(set(cur.get("sent_chats") or ()) | sent)
+    cur["attempts"] = attempts
+    cur["next_at"] = next_at
+
+
+def _digest_done(k: str, delivered: dict[str, Any], data: dict[str, Any]) -> None:
+    """摘要发出后清空缓冲；投递期间新缓冲的事件留给下一轮。"""
+    rec = data.get(k)
+    if rec is None:
+        return
+    cur = rec.get(DIGEST_FIELD)
+    if not cur:
+        return
+    newer = int(cur.get("count", 0)) - int(delivered.get("count", 0))
+    if newer > 0:
+        for f in ("sent_chats", "attempts", "next_at"):
+            cur.pop(f, None)
+        cur["count"] = newer
+        cur["events"] = list(cur.get("events") or [])[-newer:]
+        cur["since"] = time.time()
+        return
+    rec.pop(DIGEST_FIELD, None)
+    if cur.get("finalize") == FINALIZE_REMOVE and not rec.get(OUTBOX_FIELD):
+        data.pop(k, None)
+
+
+_dispatcher: OutboxDispatcher | None = None
+
+
+def start_dispatcher(cfg: Config, token_file: str, store_path: str) -> OutboxDispatcher:
+    global _dispatcher
+    if _dispatcher is None:
+        store = open_store(store_path, cfg.max_pr_records, archive=cfg.archive_records, shards=cfg.store_shards)
+        _dispatcher = OutboxDispatcher(cfg, token_file, store)
+        _dispatcher.start()
+        _dispatcher.kick()  # 重启后先投递上次遗留的意图
+    return _dispatcher
+
+
+def stop_dispatcher(timeout: float) -> bool:
+    """停机时调用：投完到期意图后停止投递线程，返回是否在 timeout 内完成。"""
+    global _dispatcher
+    d, _dispatcher = _dispatcher, None
+    return d.stop(timeout) if d is not None else True
+
+
+def reconfigure(cfg: Config) -> None:
+    """配置热加载：之后的投递使用新的凭据与群路由。"""
+    if _dispatcher is not None:
+        _dispatcher.cfg = cfg
+
+
+def prefetch_token() -> None:
+    """webhook 做 GitHub 查询时并发预热飞书 token，投递线程随后直接命中缓存。"""
+    if _dispatcher is not None:
+        upstream_pool.submit(_dispatcher.warm_token)
+
+
+def kick() -> None:
+    """handlers 登记意图后唤醒投递线程；未启动 dispatcher 时为空操作。"""
+    if _dispatcher is not None:
+        _dispatcher.kick()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""已结束 PR 记录的冷归档：追加写的 gzip 分帧 JSONL + key→偏移索引
+
+每条记录单独压缩为一个 gzip member 追加到 records.jsonl.gz，索引 records.idx 每行
+"offset length key"，同一 key 以最后一行为准。查找只需一次 seek + 解压一个 member。
+归档只追加不改写；单进程使用（索引常驻内存）。
+"""
+
+import gzip
+import json
+import logging
+import os
+import threading
+import zlib
+from typing import Any
+
+log = logging.getLogger(__name__)
+
+ARCHIVE_DIRNAME = ".pr_archive"
+DATA_FILENAME = "records.jsonl.gz"
+INDEX_FILENAME = "records.idx"
+
+
+class RecordArchive:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.data_path = os.path.join(directory, DATA_FILENAME)
+        self.index_path = os.path.join(directory, INDEX_FILENAME)
+        self._index: dict[str, tuple[int, int]] = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self) -> None:
+        if not os.path.exists(self.index_path):
+            if os.path.exists(self.data_path) and os.path.getsize(self.data_path):
+                self._rebuild_index()
+            return
+        size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split(" ", 2)
+                if len(parts) != 3:
+                    continue  # 崩溃时写了一半的行
+                try:
+                    off, n = int(parts[0]), int(parts[1])
+                except ValueError:
+                    continue
+                if off + n <= size:
+                    self._index[parts[2]] = (off, n)
+
+    def _rebuild_index(self) -> None:
+        """索引丢失时顺序解压各 member 重建。"""
+        log.warning("archive index missing, rebuilding from %s", self.data_path)
+        with open(self.data_path, "rb") as f:
+            raw = f.read()
+        off = 0
+        with open(self.index_path, "w", encoding="utf-8") as idx:
+            while off < len(raw):
+                d = zlib.decompressobj(wbits=31)
+                try:
+                    body = d.decompress(raw[off:])
+                except zlib.error:
+                    break  # 末尾不完整的 member
+                n = len(raw) - off - len(d.unused_data)
+                try:
+                    key = json.loads(body)["key"]
+                except (ValueError, KeyError):
+                    break
+                self._index[key] = (off, n)
+                idx.write(f"{off} {n} {key}\n")
+                off += n
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._index
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._index)
+
+    def put(self, key: str, record: dict[str, Any]) -> None:
+        frame = gzip.compress(json.dumps({"key": key, "record": record}, ensure_ascii=False).encode("utf-8"), mtime=0)
+        with self._lock:
+            with open(self.data_path, "ab") as f:
+                off = f.tell()
+                f.write(frame)
+                f.flush()
+                os.fsync(f.fileno())
+            # 先落数据再写索引：中途崩溃只会留下无索引的孤立 member
+            with open(self.index_path, "a", encoding="utf-8") as idx:
+                idx.write(f"{off} {len(frame)} {key}\n")
+            self._index[key] = (off, len(frame))
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        with self._lock:
+            loc = self._index.get(key)
+        if loc is None:
+            return None
+        off, n = loc
+        try:
+            with open(self.data_path, "rb") as f:
+                f.seek(off)
+                frame = f.read(n)
+            return json.loads(gzip.decompress(frame))["record"]
+        except (OSError, ValueError, KeyError, TypeError, EOFError, zlib.error) as e:
+            # 损坏 / 截断的 member：当作不存在，不让异常从 store 事务里抛出
+            log.error("archive read %s failed: %s", key, e)
+            return None
+
+
+_archives: dict[str, RecordArchive] = {}
+_archives_guard = threading.Lock()
+
+
+def archive_for_store(store_path: str) -> RecordArchive:
+    """与 store 同目录的归档；同一目录共享一个实例（索引只加载一次）。"""
+    directory = os.path.join(os.path.dirname(os.path.abspath(store_path)), ARCHIVE_DIRNAME)
+    with _archives_guard:
+        arc = _archives.get(directory)
+        if arc is None:
+            arc = _archives[directory] = RecordArchive(directory)
+        return arc
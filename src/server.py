@@ -2,71 +2,226 @@
 # -*- coding: utf-8 -*-
 """HTTP 服务：GitHub Webhook → handlers"""
 
+import dataclasses
 import json
 import logging
 import os
+import signal
+import socket
 import sys
+import threading
 import time
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from urllib.parse import urlparse
 
-from src.config import load_config, project_root
-from src.event_store import EVENT_STORE_FILENAME
-from src.feishu_credential import FEISHU_TOKEN_FILENAME
+from src import metrics, outbox, tracing, upstream_pool
+from src.chat_routing import app_secrets, router
+from src.commit_cache import COMMIT_CACHE_FILENAME, CommitTitleCache
+from src.config import RESTART_ONLY_FIELDS, Config, load_config, project_root
+from src.event_store import EVENT_STORE_FILENAME, migrate_store
+from src.feishu_credential import FEISHU_TOKEN_FILENAME, forget, migrate_legacy_token
 from src.github_api import GitHubAPI
-from src.handlers import handle
-from src.webhook_logging import ctx_tag, setup_logging, strip_log_fields
+from src.github_graphql import GitHubGraphQLAPI
+from src.handlers import (
+    HANDLED_EVENTS,
+    handle,
+    new_signature_hasher,
+    signature_header_plausible,
+    signature_matches,
+)
+from src.listen_socket import listen_socket
+from src.log_context import bind, log_context
+from src.metrics import IN_FLIGHT, REQUEST_SECONDS, WEBHOOKS_TOTAL, observe_stage, stage
+from src.tracing import TRACE_DIRNAME
+from src.webhook_logging import ctx_tag, set_level, setup_logging, stop_logging, strip_log_fields
+from src.webhook_payload import PayloadDecodeError, decode_event
 
 log = logging.getLogger(__name__)
 
 MAX_BODY = 10 * 1024 * 1024
+READ_CHUNK = 64 * 1024
 REQUEST_TIMEOUT = 30
+# HTTP/1.1 长连接：空闲超时与单连接最多处理的请求数（nginx upstream keepalive 复用）
+KEEPALIVE_IDLE_TIMEOUT = 15
+MAX_KEEPALIVE_REQUESTS = 100
 
 
-def _setup():
-    root = project_root()
-    cfg = load_config()
+def _github_api(cfg: Config, titles: CommitTitleCache) -> GitHubAPI:
+    api_cls = GitHubGraphQLAPI if cfg.github_api_mode == "graphql" else GitHubAPI
+    return api_cls(token=cfg.github_token, base_url=cfg.github_api_url, title_cache=titles)
+
+
+def _configure_tracing(cfg: Config) -> None:
+    tracing.configure(
+        cfg.trace_slow_ms,
+        cfg.trace_profile,
+        cfg.trace_dir or os.path.join(cfg.data_dir or project_root(), TRACE_DIRNAME),
+        cfg.trace_keep,
+    )
+
+
+def _setup(cfg: Config):
+    root = cfg.data_dir or project_root()
     token_file = os.path.join(root, FEISHU_TOKEN_FILENAME)
     store_path = os.path.join(root, EVENT_STORE_FILENAME)
-    gh = GitHubAPI(token=cfg.github_token)
+    migrate_store(store_path, cfg.store_shards)
+    migrate_legacy_token(token_file, cfg.app_id)
+    router(cfg)  # 路由表非法时启动即失败
+    titles = CommitTitleCache(
+        cfg.commit_cache_size,
+        os.path.join(root, COMMIT_CACHE_FILENAME) if cfg.commit_cache_persist else None,
+    )
+    gh = _github_api(cfg, titles)
+    _configure_tracing(cfg)
     return cfg, token_file, store_path, gh
 
 
+class _InFlight:
+    """正在处理的 webhook 数；停机时等待归零。"""
+
+    def __init__(self):
+        self._n = 0
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        with self._cond:
+            self._n += 1
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self._n -= 1
+            if self._n == 0:
+                self._cond.notify_all()
+
+    def wait_idle(self, timeout: float) -> int:
+        """等到没有进行中的请求或超时，返回剩余的请求数。"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._n == 0, max(timeout, 0.0))
+            return self._n
+
+
+_in_flight = _InFlight()
+# SIGTERM 后置位：服务完当前请求即关闭长连接，客户端重连到新实例
+_draining = threading.Event()
+
+
 class Handler(BaseHTTPRequestHandler):
-    cfg, token_file, store_path, github_api = _setup()
+    # 由 main() 在端口就绪后通过 configure 填充；导入本模块不读配置、不建客户端
+    cfg: Config
+    token_file = ""
+    store_path = ""
+    github_api: GitHubAPI
+    protocol_version = "HTTP/1.1"
+    # StreamRequestHandler.setup 用作 socket 超时：等待下一个请求行时即空闲超时
+    timeout = KEEPALIVE_IDLE_TIMEOUT
 
-    def do_POST(self):
-        if urlparse(self.path).path not in ("/", "/webhook"):
-            self._json(404, {"error": "Not Found"})
+    @classmethod
+    def configure(cls, cfg: Config) -> None:
+        cls.cfg, cls.token_file, cls.store_path, cls.github_api = _setup(cfg)
+
+    @classmethod
+    def reconfigure(cls, cfg: Config) -> None:
+        """热加载：换用新配置与 GitHub 客户端（沿用提交标题缓存）；进行中的请求继续用旧配置。"""
+        old = cls.cfg
+        # token 按 app_id 缓存；secret 或飞书地址变了的应用丢弃旧 token
+        before, after = app_secrets(old), app_secrets(cfg)
+        for app_id, secret in after.items():
+            if app_id in before and (before[app_id] != secret or cfg.feishu_base_url != old.feishu_base_url):
+                forget(app_id, cls.token_file)
+        cls.github_api = _github_api(cfg, cls.github_api.titles)
+        cls.cfg = cfg
+        _configure_tracing(cfg)
+        set_level(cfg.log_level)
+        outbox.reconfigure(cfg)
+
+    def setup(self):
+        super().setup()
+        self._served = 0
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/metrics":
+            self._send(200, metrics.render().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8")
             return
-        n = int(self.headers.get("Content-Length", 0))
-        if n < 0 or n > MAX_BODY:
-            self._json(400, {"error": "Invalid Content-Length"})
+        self._json(404, {"error": "Not Found"})
+
+    def do_POST(self):
+        event_type = self.headers.get("X-GitHub-Event", "")
+        IN_FLIGHT.inc()
+        t0 = time.monotonic()
+        delivery = self.headers.get("X-GitHub-Delivery") or ""
+        try:
+            with _in_flight, log_context(delivery=delivery, event=event_type), tracing.trace_request(delivery, event_type):
+                res = self._webhook(event_type)
+        finally:
+            IN_FLIGHT.dec()
+        if res is None:
             return
+        code, body, action = res
+        # 未处理的事件类型来自请求头，不作为 label 以免基数失控
+        ev_label = event_type if event_type in HANDLED_EVENTS else "other"
+        REQUEST_SECONDS.observe(time.monotonic() - t0, ev_label)
+        WEBHOOKS_TOTAL.inc(ev_label, action or "-", body.get("status") or str(code))
+        self._json(code, body)
+
+    def _webhook(self, event_type: str) -> tuple[int, dict, str] | None:
+        """返回 (HTTP 状态码, 响应 body, GitHub action)；连接已断开时返回 None。"""
+        n = self._content_length()
+        if n is None:
+            self.close_connection = True
+            return 400, {"error": "Invalid Content-Length"}, ""
+        if urlparse(self.path).path not in ("/", "/webhook"):
+            self._discard_body(n)
+            return 404, {"error": "Not Found"}, ""
+        if n > MAX_BODY:
+            self.close_connection = True
+            return 400, {"error": "Invalid Content-Length"}, ""
         self.connection.settimeout(REQUEST_TIMEOUT)
-        raw = self.rfile.read(n) if n else b""
-        event_type = self.headers.get("X-GitHub-Event", "")
+        # 取一次快照：处理期间 SIGHUP 热加载不影响本请求
+        cfg, gh = self.cfg, self.github_api
         delivery = (self.headers.get("X-GitHub-Delivery") or "")[:8]
+        sig = self.headers.get("X-Hub-Signature-256", "")
+        secret = cfg.github_webhook_secret
 
-        data = None
-        if event_type in ("pull_request", "pull_request_review", "issue_comment"):
-            try:
-                data = json.loads(raw.decode("utf-8")) if raw else None
-            except json.JSONDecodeError:
-                self._json(400, {"error": "Invalid JSON"})
-                return
+        # 先看事件类型与签名头，忽略的事件与明显无效的签名不缓冲 body、不解析 JSON
+        if event_type not in HANDLED_EVENTS:
+            self._discard_body(n)
+            log.info("[?] %s -> HTTP 200 ignored delivery=%s", event_type or "unknown", delivery or "-")
+            return 200, {"status": "ignored", "event": event_type or "unknown"}, ""
+        if not signature_header_plausible(sig, secret):
+            self._discard_body(n)
+            log.info("%s rejected: bad signature header delivery=%s", event_type, delivery or "-")
+            return 401, {"error": "Invalid signature"}, ""
 
-        tag, gh_action = ctx_tag(event_type, data)
+        # HMAC 随读取分块流式计算；读 body 受对端网速影响，与 HMAC 分开计时，verify 只含签名计算本身
+        t_read = time.monotonic()
+        hasher = new_signature_hasher(secret)
+        raw, hashed = self._read_body(n, hasher)
+        if raw is None:
+            return None
+        t_sig = time.monotonic()
+        ok = signature_matches(hasher, sig)
+        observe_stage("read_body", t_sig - t_read - hashed)
+        observe_stage("verify", hashed + time.monotonic() - t_sig)
+        if not ok:
+            log.info("%s rejected: signature mismatch delivery=%s", event_type, delivery or "-")
+            return 401, {"error": "Invalid signature"}, ""
+
+        try:
+            with stage("decode"):
+                event = decode_event(event_type, raw)
+        except PayloadDecodeError:
+            return 400, {"error": "Invalid JSON"}, ""
+        del raw
+
+        tag, gh_action = ctx_tag(event_type, event)
+        bind(pr_key=tag, action=gh_action)
         t0 = time.monotonic()
         body, code = handle(
-            raw,
-            self.headers.get("X-Hub-Signature-256", ""),
             event_type,
-            data,
-            self.cfg,
-            self.token_file,
+            event,
+            cfg,
             self.store_path,
-            self.github_api,
+            gh,
         )
         elapsed = time.monotonic() - t0
         status = body.get("status") or body.get("error", "")
@@ -87,22 +242,78 @@ class Handler(BaseHTTPRequestHandler):
             tail,
             elapsed,
             delivery or "-",
+            extra={"fields": {"status_code": code, "outcome": status, "elapsed_ms": round(elapsed * 1000, 3)}},
         )
-        self._json(code, strip_log_fields(body))
+        return code, strip_log_fields(body), gh_action
+
+    def _content_length(self) -> int | None:
+        """只支持 Content-Length 定长 body；chunked 或非法长度返回 None（无法正确分帧，须关闭连接）。"""
+        if "chunked" in (self.headers.get("Transfer-Encoding") or "").lower():
+            return None
+        try:
+            n = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            return None
+        return n if n >= 0 else None
+
+    def _read_body(self, n: int, hasher) -> tuple[bytes | None, float]:
+        """分块读取 body，同时增量计算 HMAC；返回 (body, HMAC 耗时秒数)，对端提前断开时 body 为 None。"""
+        chunks: list[bytes] = []
+        left = n
+        hashed = 0.0
+        while left > 0:
+            chunk = self.rfile.read(min(READ_CHUNK, left))
+            if not chunk:
+                self.close_connection = True
+                return None, hashed
+            if hasher is not None:
+                t0 = time.monotonic()
+                hasher.update(chunk)
+                hashed += time.monotonic() - t0
+            chunks.append(chunk)
+            left -= len(chunk)
+        return b"".join(chunks), hashed
+
+    def _discard_body(self, n: int):
+        """读掉并丢弃 body（不缓冲）；过大或非法长度直接关闭连接。"""
+        if n <= 0:
+            return
+        if n > MAX_BODY:
+            self.close_connection = True
+            return
+        self.connection.settimeout(REQUEST_TIMEOUT)
+        left = n
+        while left > 0:
+            chunk = self.rfile.read(min(READ_CHUNK, left))
+            if not chunk:
+                self.close_connection = True
+                return
+            left -= len(chunk)
 
     def _json(self, status: int, body: dict):
-        b = json.dumps(body).encode("utf-8")
+        self._send(status, json.dumps(body).encode("utf-8"), "application/json")
+
+    def _send(self, status: int, b: bytes, content_type: str):
+        self._served += 1
+        if self._served >= MAX_KEEPALIVE_REQUESTS or _draining.is_set():
+            self.close_connection = True
         self.send_response(status)
-        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Type", content_type)
         self.send_header("Content-Length", len(b))
+        if self.close_connection:
+            self.send_header("Connection", "close")
         self.end_headers()
         self.wfile.write(b)
+        self.connection.settimeout(self.timeout)
 
     def log_message(self, *args):
         pass
 
 
 class QuietHTTPServer(ThreadingHTTPServer):
+    # 默认 backlog 仅 5，webhook 突发（GitHub 重投、多仓库并发）时新连接会被 reset
+    request_queue_size = 128
+
     def handle_error(self, request, client_address):
         exc_type, exc_value, _ = sys.exc_info()
         if exc_type in (ConnectionResetError, BrokenPipeError, ConnectionAbortedError):
@@ -111,12 +322,103 @@ class QuietHTTPServer(ThreadingHTTPServer):
         super().handle_error(request, client_address)
 
 
-def main():
-    setup_logging()
-    port = Handler.cfg.github_webhook_port
+def main(
+    cfg: Config | None = None,
+    sock: socket.socket | None = None,
+    activated: bool = False,
+    started_at: float | None = None,
+    listening_s: float | None = None,
+):
+    """app.py 先 bind（或接管 systemd 传入的 socket）再导入本模块并传入；直接调用时在此 bind。"""
+    t0 = started_at if started_at is not None else time.monotonic()
+    cfg = cfg or load_config()
+    setup_logging(cfg.log_level, cfg.log_json, cfg.log_debug_per_sec)
+    port = cfg.github_webhook_port
+    if sock is None:
+        try:
+            sock, activated = listen_socket(port)
+        except OSError as e:
+            if getattr(e, "errno", None) == 98:
+                log.error("bind failed port=%s address already in use", port)
+            raise
+        listening_s = time.monotonic() - t0
+    Handler.configure(cfg)
+    server = QuietHTTPServer(sock.getsockname()[:2], Handler, bind_and_activate=False)
+    server.socket.close()
+    server.socket = sock
+    outbox.start_dispatcher(Handler.cfg, Handler.token_file, Handler.store_path)
+    _install_signal_handlers(server)
+    log.info(
+        "listening on :%s (%s) time_to_listening=%.1fms ready=%.1fms",
+        sock.getsockname()[1],
+        "systemd socket" if activated else "bound",
+        (listening_s or 0) * 1000,
+        (time.monotonic() - t0) * 1000,
+    )
+    server.serve_forever()
+    _drain(server)
+
+
+def reload_config() -> None:
+    """SIGHUP：重读 config.json 并热更新；读取失败保留当前配置，需重启的字段保持原值。"""
+    try:
+        cfg = load_config()
+    except (RuntimeError, FileNotFoundError) as e:
+        log.error("config reload failed, keeping current config: %s", e)
+        return
+    old = Handler.cfg
+    pinned = {f: getattr(old, f) for f in RESTART_ONLY_FIELDS if getattr(cfg, f) != getattr(old, f)}
+    if pinned:
+        log.warning("config reload: %s changed, takes effect after restart", ", ".join(sorted(pinned)))
+    cfg = dataclasses.replace(cfg, **pinned)
     try:
-        QuietHTTPServer(("0.0.0.0", port), Handler).serve_forever()
-    except OSError as e:
-        if getattr(e, "errno", None) == 98:
-            log.error("bind failed port=%s address already in use", port)
-        raise
+        router(cfg)
+    except ValueError as e:
+        log.error("config reload failed, keeping current config: %s", e)
+        return
+    changed = [f.name for f in dataclasses.fields(Config) if getattr(cfg, f.name) != getattr(old, f.name)]
+    Handler.reconfigure(cfg)
+    log.info("config reloaded changed=%s", ",".join(changed) or "-")
+
+
+def _install_signal_handlers(server: QuietHTTPServer) -> None:
+    """SIGTERM / SIGINT 停止接收并排空；SIGHUP 热加载配置。
+
+    处理函数运行在 serve_forever 所在的主线程，shutdown() 会等待该循环退出，因此都交给独立线程。
+    """
+
+    def on_term(signum, _frame):
+        if _draining.is_set():
+            return
+        _draining.set()
+        log.info("received %s, draining", signal.Signals(signum).name)
+        threading.Thread(target=server.shutdown, name="shutdown", daemon=True).start()
+
+    def on_hup(_signum, _frame):
+        threading.Thread(target=reload_config, name="reload", daemon=True).start()
+
+    signal.signal(signal.SIGTERM, on_term)
+    signal.signal(signal.SIGINT, on_term)
+    signal.signal(signal.SIGHUP, on_hup)
+
+
+def _drain(server: QuietHTTPServer) -> None:
+    """serve_forever 退出后：等待进行中的 webhook，投完 outbox 中到期的意图，落盘缓存。
+
+    事件与投递意图每次 mutate 都已原子写入 store，超时未完成的意图在下次启动时补投。
+    """
+    t0 = time.monotonic()
+    deadline = t0 + Handler.cfg.shutdown_drain_seconds
+    left = _in_flight.wait_idle(deadline - time.monotonic())
+    if left:
+        log.warning("drain deadline reached with %d webhook(s) still in flight", left)
+    stopped = outbox.stop_dispatcher(deadline - time.monotonic())
+    if not stopped:
+        log.warning("drain deadline reached with an outbox delivery in progress")
+    Handler.github_api.titles.save()
+    if stopped:
+        # 投递可能仍在用线程池扇出到多个群，投递线程退出后才关闭
+        upstream_pool.shutdown(wait=False)
+    server.server_close()
+    log.info("shutdown complete drain=%.1fms", (time.monotonic() - t0) * 1000)
+    stop_logging()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""慢请求追踪（可选）：按 X-GitHub-Delivery 记录阶段 span 树，超阈值时落盘，可附带 cProfile"""
+
+from __future__ import annotations
+
+import contextvars
+import cProfile
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+log = logging.getLogger(__name__)
+
+TRACE_DIRNAME = ".traces"
+
+
+class Span:
+    __slots__ = ("name", "start", "duration", "children", "attrs")
+
+    def __init__(self, name: str, start: float, attrs: dict[str, Any] | None = None):
+        self.name = name
+        self.start = start
+        self.duration = 0.0
+        self.children: list[Span] = []
+        self.attrs = attrs
+
+    def to_dict(self, origin: float) -> dict[str, Any]:
+        d: dict[str, Any] = {
+            "name": self.name,
+            "offset_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round(self.duration * 1000, 3),
+        }
+        if self.attrs:
+            d["attrs"] = self.attrs
+        if self.children:
+            d["children"] = [c.to_dict(origin) for c in self.children]
+        return d
+
+
+class _Settings:
+    __slots__ = ("threshold", "profile", "directory", "keep")
+
+    def __init__(self):
+        self.threshold = 0.0
+        self.profile = False
+        self.directory = ""
+        self.keep = 50
+
+
+_settings = _Settings()
+_current: contextvars.ContextVar[Span | None] = contextvars.ContextVar("feishubot_span", default=None)
+_dump_lock = threading.Lock()
+_dump_seq = itertools.count()
+
+
+def configure(slow_ms: int, profile: bool, directory: str, keep: int) -> None:
+    """slow_ms <= 0 关闭追踪；此时 span/record 都是一次 ContextVar 读取的空操作。"""
+    _settings.threshold = max(slow_ms, 0) / 1000.0
+    _settings.profile = bool(profile)
+    _settings.directory = directory
+    _settings.keep = max(int(keep), 1)
+
+
+def enabled() -> bool:
+    return _settings.threshold > 0
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[None]:
+    parent = _current.get()
+    if parent is None:
+        yield
+        return
+    s = Span(name, time.monotonic(), attrs or None)
+    parent.children.append(s)
+    token = _current.set(s)
+    try:
+        yield
+    finally:
+        s.duration = time.monotonic() - s.start
+        _current.reset(token)
+
+
+def record(name: str, seconds: float) -> None:
+    """事后补记一个已结束的阶段（metrics.observe_stage 调用）。"""
+    parent = _current.get()
+    if parent is None:
+        return
+    s = Span(name, time.monotonic() - seconds)
+    s.duration = seconds
+    parent.children.append(s)
+
+
+@contextmanager
+def trace_request(delivery: str, event_type: str) -> Iterator[None]:
+    """请求入口：开启根 span；耗时超过阈值时写出 span 树（与可选 profile）。"""
+    if not enabled():
+        yield
+        return
+    root = Span("webhook", time.monotonic(), {"delivery": delivery or "-", "event": event_type or "-"})
+    token = _current.set(root)
+    prof = cProfile.Profile() if _settings.profile else None
+    if prof is not None:
+        try:
+            prof.enable()
+        except ValueError:  # 本线程已有其它 profiler
+            prof = None
+    try:
+        yield
+    finally:
+        if prof is not None:
+            prof.disable()
+        root.duration = time.monotonic() - root.start
+        _current.reset(token)
+        if root.duration >= _settings.threshold:
+            _dump(root, prof)
+
+
+def _dump(root: Span, prof: cProfile.Profile | None) -> None:
+    delivery = (root.attrs or {}).get("delivery") or "-"
+    safe = re.sub(r"[^A-Za-z0-9-]", "", delivery)[:36] or "-"
+    # 同一 delivery 重投时也不覆盖：时间戳 + 进程内序号
+    stem = f"{time.strftime('%Y%m%d-%H%M%S')}-{next(_dump_seq) % 1000000:06d}_{safe}"
+    try:
+        os.makedirs(_settings.directory, exist_ok=True)
+        path = os.path.join(_settings.directory, stem + ".json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(root.to_dict(root.start), f, ensure_ascii=False, indent=2)
+        if prof is not None:
+            prof.dump_stats(os.path.join(_settings.directory, stem + ".prof"))
+        _rotate()
+    except OSError as e:
+        log.warning("trace dump failed delivery=%s %s", delivery, e)
+        return
+    log.warning("slow webhook %.3fs delivery=%s trace=%s", root.duration, delivery, path)
+
+
+def _rotate() -> None:
+    with _dump_lock:
+        names = sorted(n for n in os.listdir(_settings.directory) if n.endswith(".json"))
+        for n in names[: max(len(names) - _settings.keep, 0)]:
+            stem = n[: -len(".json")]
+            for ext in (".json", ".prof"):
+                try:
+                    os.remove(os.path.join(_settings.directory, stem + ext))
+                except FileNotFoundError:
+                    pass
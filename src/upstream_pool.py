@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""共享的有界线程池：并发执行互不依赖的上游调用（GitHub 查询、飞书 token 预热等）"""
+
+from __future__ import annotations
+
+import contextvars
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+# 上游调用都是网络 IO；上限避免 webhook 突发时打爆 GitHub / 飞书
+MAX_WORKERS = 8
+
+_executor: ThreadPoolExecutor | None = None
+_executor_guard = threading.Lock()
+# shutdown 之后不再新建线程池，迟到的提交在调用方线程内直接执行
+_closed = False
+
+
+def executor() -> ThreadPoolExecutor | None:
+    global _executor
+    with _executor_guard:
+        if _executor is None and not _closed:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="upstream")
+        return _executor
+
+
+def submit(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+    """提交到共享线程池，并带上调用方的 contextvars（追踪 span 归属到当前请求）。"""
+    ctx = contextvars.copy_context()
+    ex = executor()
+    if ex is not None:
+        try:
+            return ex.submit(ctx.run, fn, *args, **kwargs)
+        except RuntimeError:
+            pass  # 与 shutdown 竞争：线程池刚关闭
+    fut: Future = Future()
+    try:
+        fut.set_result(ctx.run(fn, *args, **kwargs))
+    except BaseException as e:
+        fut.set_exception(e)
+    return fut
+
+
+def shutdown(wait: bool = True) -> None:
+    global _executor, _closed
+    with _executor_guard:
+        ex, _executor = _executor, None
+        _closed = True
+    if ex is not None:
+        ex.shutdown(wait=wait)
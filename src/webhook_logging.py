@@ -1,48 +1,149 @@
 # -*- coding: utf-8 -*-
-"""Webhook 与 systemd 日志：统一格式与 [repo#pr] 上下文"""
+"""Webhook 与 systemd 日志：统一格式与 [repo#pr] 上下文；经队列异步写出，不阻塞请求线程"""
 
 from __future__ import annotations
 
+import atexit
+import json
 import logging
+import queue
 import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
 from typing import Any
 
+from src import log_context
+from src.metrics import REGISTRY, Counter
+
 HTTP_RESPONSE_EXCLUDE_KEYS = frozenset({"detail"})
 
 
-def setup_logging() -> None:
+# 日志队列上限：写日志的线程只入队，队列满时丢弃而不是阻塞请求
+LOG_QUEUE_SIZE = 10000
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_listener: QueueListener | None = None
+
+DROPPED = REGISTRY.register(
+    Counter("feishubot_log_dropped_total", "Log records dropped by DEBUG sampling or a full log queue.", ("reason",))
+)
+
+
+class _ContextFilter(logging.Filter):
+    """在写日志的线程上把请求上下文（delivery、pr_key、阶段耗时）快照到 record.ctx。"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        ctx = log_context.current()
+        record.ctx = dict(ctx) if ctx else None
+        return True
+
+
+class _DebugSampler(logging.Filter):
+    """DEBUG 级别令牌桶限流：每秒最多 rate 条（突发同量），超出的丢弃并计数；rate <= 0 不限。"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+        self._tokens = rate
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.INFO or self.rate <= 0:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+        DROPPED.inc("sampled")
+        return False
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """原样入队：% 格式化与异常栈渲染留给 QueueListener 线程（默认实现会在请求线程上完成并清掉 exc_info）。"""
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED.inc("queue_full")
+
+
+class JsonFormatter(logging.Formatter):
+    """每条一行 JSON：ts / level / logger / msg，加上请求上下文与 extra={"fields": {...}}。"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        out: dict[str, Any] = {
+            "ts": self.formatTime(record, DATE_FORMAT),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        ctx = getattr(record, "ctx", None)
+        if ctx:
+            out.update(ctx)
+        fields = getattr(record, "fields", None)
+        if fields:
+            out.update(fields)
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+def _level(name: str) -> int:
+    v = logging.getLevelName(name.upper())
+    return v if isinstance(v, int) else logging.DEBUG
+
+
+def setup_logging(level: str = "DEBUG", json_lines: bool = False, debug_per_sec: float = 0) -> None:
+    """根 logger 只挂一个非阻塞的 QueueHandler，格式化与写 stdout 在后台 QueueListener 线程完成。"""
+    global _listener
     root = logging.getLogger()
     if root.handlers:
         return
-    h = logging.StreamHandler(sys.stdout)
-    h.setFormatter(
-        logging.Formatter(
-            fmt="%(asctime)s %(levelname)s %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S",
-        )
-    )
-    root.addHandler(h)
-    root.setLevel(logging.DEBUG)
+    out = logging.StreamHandler(sys.stdout)
+    out.setFormatter(JsonFormatter() if json_lines else logging.Formatter(fmt=TEXT_FORMAT, datefmt=DATE_FORMAT))
+    q: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+    qh = _NonBlockingQueueHandler(q)
+    qh.addFilter(_DebugSampler(debug_per_sec))
+    qh.addFilter(_ContextFilter())
+    root.addHandler(qh)
+    root.setLevel(_level(level))
     logging.getLogger("urllib3").setLevel(logging.WARNING)
+    _listener = QueueListener(q, out, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def set_level(level: str) -> None:
+    """配置热加载时调整根 logger 级别。"""
+    logging.getLogger().setLevel(_level(level))
+
+
+def stop_logging() -> None:
+    """停止后台线程并写完队列中剩余的日志（退出前调用）。"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
 
 
-def ctx_tag(event_type: str, data: dict[str, Any] | None) -> tuple[str, str]:
-    """返回 (「owner/repo#n」, GitHub action)。"""
-    if not data:
+def ctx_tag(event_type: str, event: Any) -> tuple[str, str]:
+    """返回 (「owner/repo#n」, GitHub action)；event 为 webhook_payload 视图。"""
+    if event is None:
         return "?", ""
-    repo = (data.get("repository") or {}).get("full_name") or ""
-    action = data.get("action") or ""
-    if event_type == "issue_comment":
-        issue = data.get("issue") or {}
-        n = issue.get("number")
-        if repo and n:
-            return f"{repo}#{n}", action
-    if event_type in ("pull_request", "pull_request_review"):
-        pr = data.get("pull_request") or {}
-        n = pr.get("number")
-        if repo and n:
-            return f"{repo}#{n}", action
-    return (f"{repo}?" if repo else "?"), action
+    repo = event.repo_name
+    n = event.pr_number
+    if repo and n:
+        return f"{repo}#{n}", event.action
+    return (f"{repo}?" if repo else "?"), event.action
 
 
 def strip_log_fields(body: dict[str, Any]) -> dict[str, Any]:
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""Webhook payload 解码：可选 orjson 加速，只抽取 handlers 用到的字段为 __slots__ 视图"""
+
+from __future__ import annotations
+
+import json
+from typing import Any, Callable
+
+try:
+    import orjson as _orjson
+except ImportError:  # 可选依赖，未安装时退回标准库
+    _orjson = None
+
+JSON_BACKEND = "orjson" if _orjson is not None else "json"
+
+
+class PayloadDecodeError(ValueError):
+    pass
+
+
+def loads(raw: bytes) -> Any:
+    if _orjson is not None:
+        try:
+            return _orjson.loads(raw)
+        except _orjson.JSONDecodeError as e:
+            raise PayloadDecodeError(str(e)) from e
+    try:
+        return json.loads(raw.decode("utf-8"))
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise PayloadDecodeError(str(e)) from e
+
+
+def _obj(d: Any, name: str) -> dict[str, Any]:
+    v = d.get(name) if isinstance(d, dict) else None
+    return v if isinstance(v, dict) else {}
+
+
+def _int(v: Any) -> int:
+    try:
+        return int(v or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _str(v: Any) -> str:
+    return v if isinstance(v, str) else ""
+
+
+def requested_reviewer_label(obj: dict[str, Any] | None) -> str:
+    if not obj:
+        return ""
+    lg = obj.get("login")
+    if lg:
+        return lg
+    slug = obj.get("slug") or obj.get("name")
+    if slug:
+        return f"team/{slug}"
+    return ""
+
+
+class PullRequestInfo:
+    __slots__ = (
+        "number",
+        "title",
+        "state",
+        "merged",
+        "draft",
+        "html_url",
+        "updated_at",
+        "created_at",
+        "head_ref",
+        "head_sha",
+        "labels",
+    )
+
+    def __init__(self, pr: dict[str, Any]):
+        head = _obj(pr, "head")
+        self.number = _int(pr.get("number"))
+        self.title = _str(pr.get("title"))
+        self.state = _str(pr.get("state"))
+        self.merged = bool(pr.get("merged"))
+        self.draft = bool(pr.get("draft"))
+        self.html_url = _str(pr.get("html_url"))
+        self.updated_at = _str(pr.get("updated_at"))
+        self.created_at = _str(pr.get("created_at"))
+        self.head_ref = _str(head.get("ref"))
+        self.head_sha = _str(head.get("sha"))
+        labels = pr.get("labels")
+        self.labels = tuple(_str(lb.get("name")) for lb in labels if isinstance(lb, dict)) if isinstance(labels, list) else ()
+
+
+def _commit_subjects(commits: Any) -> tuple[tuple[str, str], ...]:
+    """push 风格 payload 的 commits 数组（GitHub 最多附带 20 条）-> ((sha, message 首行), ...)，从旧到新。"""
+    if not isinstance(commits, list):
+        return ()
+    out = []
+    for c in commits:
+        if isinstance(c, dict):
+            msg = _str(c.get("message"))
+            out.append((_str(c.get("id")) or _str(c.get("sha")), msg.split("\n", 1)[0].strip()[:200]))
+    return tuple(out)
+
+
+class PullRequestEvent:
+    __slots__ = (
+        "action",
+        "repo_name",
+        "sender_login",
+        "pr",
+        "before",
+        "after",
+        "requested_reviewer",
+        "commits",
+        "commit_total",
+    )
+
+    def __init__(self, data: dict[str, Any]):
+        self.action = _str(data.get("action"))
+        self.repo_name = _str(_obj(data, "repository").get("full_name"))
+        self.sender_login = _str(_obj(data, "sender").get("login"))
+        self.pr = PullRequestInfo(_obj(data, "pull_request"))
+        self.before = _str(data.get("before"))
+        self.after = _str(data.get("after"))
+        self.requested_reviewer = requested_reviewer_label(_obj(data, "requested_reviewer"))
+        # 带 commits 数组时（push 风格 / 中转服务补全的 payload）可免去 compare；size 为真实总数，数组可能被截断
+        self.commits = _commit_subjects(data.get("commits"))
+        self.commit_total = _int(data.get("size")) or len(self.commits)
+
+    @property
+    def pr_number(self) -> int:
+        return self.pr.number
+
+
+class PullRequestReviewEvent:
+    __slots__ = ("action", "repo_name", "pr", "review_state", "reviewer", "submitted_at", "body")
+
+    def __init__(self, data: dict[str, Any]):
+        review = _obj(data, "review")
+        self.action = _str(data.get("action"))
+        self.repo_name = _str(_obj(data, "repository").get("full_name"))
+        self.pr = PullRequestInfo(_obj(data, "pull_request"))
+        self.review_state = _str(review.get("state")).lower()
+        self.reviewer = _str(_obj(review, "user").get("login"))
+        self.submitted_at = _str(review.get("submitted_at"))
+        self.body = _str(review.get("body")).strip()
+
+    @property
+    def pr_number(self) -> int:
+        return self.pr.number
+
+
+class IssueCommentEvent:
+    __slots__ = (
+        "action",
+        "repo_name",
+        "pr_number",
+        "is_pull_request",
+        "issue_url",
+        "issue_title",
+        "issue_state",
+        "comment_id",
+        "body",
+        "author",
+        "author_type",
+        "in_reply_to_id",
+        "time",
+    )
+
+    def __init__(self, data: dict[str, Any]):
+        issue = _obj(data, "issue")
+        comment = _obj(data, "comment")
+        user = _obj(comment, "user")
+        self.action = _str(data.get("action"))
+        self.repo_name = _str(_obj(data, "repository").get("full_name"))
+        self.pr_number = _int(issue.get("number"))
+        self.is_pull_request = bool(issue.get("pull_request"))
+        self.issue_url = _str(issue.get("html_url"))
+        self.issue_title = _str(issue.get("title"))
+        self.issue_state = _str(issue.get("state"))
+        self.comment_id = _int(comment.get("id"))
+        self.body = _str(comment.get("body"))
+        self.author = _str(user.get("login"))
+        self.author_type = _str(user.get("type"))
+        self.in_reply_to_id = comment.get("in_reply_to_id")
+        self.time = _str(comment.get("updated_at")) or _str(comment.get("created_at"))
+
+
+WebhookEvent = PullRequestEvent | PullRequestReviewEvent | IssueCommentEvent
+
+# event_type -> 视图构造；新增事件类型在此注册
+_EVENT_DECODERS: dict[str, Callable[[dict[str, Any]], Any]] = {
+    "pull_request": PullRequestEvent,
+    "pull_request_review": PullRequestReviewEvent,
+    "issue_comment": IssueCommentEvent,
+}
+
+
+def decode_event(event_type: str, raw: bytes) -> WebhookEvent | None:
+    """解析 body 并立即抽取为紧凑视图，原始 dict 随即释放；空 body / 非对象返回 None。"""
+    if not raw:
+        return None
+    build = _EVENT_DECODERS.get(event_type)
+    if build is None:
+        return None
+    data = loads(raw)
+    if not isinstance(data, dict) or not data:
+        return None
+    return build(data)
@@ -39,11 +39,14 @@ stop_and_disable() {
     log_info "停止并禁用服务..."
     systemctl stop github-feishu-bot 2>/dev/null || true
     systemctl disable github-feishu-bot 2>/dev/null || true
+    systemctl stop github-feishu-bot.socket 2>/dev/null || true
+    systemctl disable github-feishu-bot.socket 2>/dev/null || true
 }
 
 remove_service_file() {
     log_info "删除 systemd 服务配置..."
     rm -f /etc/systemd/system/github-feishu-bot.service
+    rm -f /etc/systemd/system/github-feishu-bot.socket
     systemctl daemon-reload
 }
 